@@ -0,0 +1,262 @@
+from SpotifyHistory import database
+from SpotifyHistory.database import get_engine, get_state
+from SpotifyHistory.instrumentation import traced
+import argparse
+import json
+import os
+import shutil
+import sqlalchemy
+import numpy as np
+
+# the columns of the plays kept in the archive and the type each is stored as. Each track, artist and album is kept by its integer key,
+# so a play takes 27 bytes instead of the text of every name, and the names are looked up in the database only for the rows that are shown
+ARCHIVE_COLUMNS = {
+    "played_at": "int64",
+    "date_played": "datetime64[D]",
+    "track_key": "int32",
+    "artist_key": "int32",
+    "album_key": "int32",
+    "hour_played": "int8",
+    "weekday_played": "int8",
+    "duration_in_ms": "int32"
+}
+
+# the value kept for the hour and day of the week of a play stored without them, which is not counted in any hour,
+# and the expression each column is read from the plays with
+MISSING_TIME_VALUE = -1
+COLUMN_EXPRESSIONS = {column: "COALESCE({column}, {missing}) AS {column}".format(column=column, missing=MISSING_TIME_VALUE)
+                      if column in ("hour_played", "weekday_played") else column for column in ARCHIVE_COLUMNS}
+
+# the file every column of a month is compressed into together. Only the latest month, which each load appends to, is kept as a file
+# of uncompressed values per column instead, memory mapped when it is read, and the months before it are compressed as soon as a later month is written
+COMPRESSED_NAME = "columns.npz"
+
+# the file listing the archive's partitions, and the plays generation of the database they were last synced at, which is only increased
+# when the plays change, so that building the most played counters or splitting the sessions again does not leave the archive out of date
+MANIFEST_NAME = "manifest.json"
+
+# the number of plays and total duration of each month in the database, compared with the manifest to find the months that have changed, and the plays of a month
+MONTH_TOTALS_QUERY = """
+    SELECT substr(date_played, 1, 7) AS month, SUM(num_plays), SUM(total_duration)
+    FROM daily_totals
+    GROUP BY month
+    """
+MONTH_PLAYS_QUERY = """
+    SELECT {columns}
+    FROM plays
+    WHERE date_played >= :start_date AND date_played < :end_date AND played_at > :after
+    ORDER BY played_at
+    """.format(columns=", ".join(COLUMN_EXPRESSIONS.values()))
+
+
+def get_archive_location(database_location=None):
+    '''(str) -> str
+    This function returns the folder the archive of the given database (the default database if none is given) is kept in, next to the database file.
+    '''
+    path = sqlalchemy.engine.make_url(database_location or database.DATABASE_LOCATION).database
+    if not path or path == ":memory:":
+        raise ValueError("Only a database stored in a file can be archived.")
+    return(os.path.splitext(path)[0] + ".archive")
+
+
+def get_month_bounds(month):
+    '''(str) -> str, str
+    Given a month in YYYY-mm format, this function returns its first date and the first date of the month after it.
+    '''
+    start = np.datetime64(month, "M")
+    return(str(start.astype("datetime64[D]")), str((start + 1).astype("datetime64[D]")))
+
+
+def load_manifest(archive_location):
+    '''(str) -> dict
+    This function returns the manifest of the archive in the given folder, or None if there is no archive there.
+    '''
+    try:
+        with open(os.path.join(archive_location, MANIFEST_NAME)) as f:
+            return(json.load(f))
+    except (OSError, ValueError):
+        return(None)
+
+
+def replace_file(path, write):
+    '''(str, function) -> Nonetype
+    This function writes a file by calling write with a temporary file opened for binary writing, and then puts it in place of the given path,
+    so that a reader never sees a partly written file.
+    '''
+    with open(path + ".tmp", "wb") as f:
+        write(f)
+    os.replace(path + ".tmp", path)
+
+
+def read_month(conn, month, after=-1):
+    '''(sqlalchemy.engine.Connection, str, int) -> dict of ndarray
+    This function reads the columns of the plays in the given month played after the given unix timestamp in milliseconds, oldest first.
+    '''
+    start_date, end_date = get_month_bounds(month)
+    rows = conn.exec_driver_sql(MONTH_PLAYS_QUERY, {"start_date": start_date, "end_date": end_date, "after": after}).all()
+    values = list(zip(*rows)) or [[] for column in ARCHIVE_COLUMNS]
+    return({column: np.array(column_values, dtype=dtype) for (column, dtype), column_values in zip(ARCHIVE_COLUMNS.items(), values)})
+
+
+def write_partition(partition_location, columns, compress=False):
+    '''(str, dict of ndarray, Boolean) -> Nonetype
+    This function saves the columns of a partition either compressed together into one .npz file, or each as an uncompressed .npy file
+    so that it can be memory mapped when it is read, and removes the files of the other format.
+    '''
+    os.makedirs(partition_location, exist_ok=True)
+    compressed_path = os.path.join(partition_location, COMPRESSED_NAME)
+    column_paths = [os.path.join(partition_location, column + ".npy") for column in columns]
+    if compress:
+        replace_file(compressed_path, lambda f: np.savez_compressed(f, **columns))
+        old_paths = column_paths
+    else:
+        for path, values in zip(column_paths, columns.values()):
+            replace_file(path, lambda f: np.save(f, values))
+        old_paths = [compressed_path]
+    for path in old_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@traced
+def sync_archive(database_location=None, rebuild=False):
+    '''(str, Boolean) -> dict
+    This function brings the archive of the given database (the default database if none is given) up to date, creating it the first time.
+    The number of plays and total duration of each month are read from the daily totals and compared with the archive's manifest, so that only the months
+    that have changed are read from the database. A month that has only gained plays after the last one archived, as after each load, is appended to,
+    while any other change to a month, e.g. an import of older plays, rewrites that month. Every month but the latest is compressed, so a month is
+    also rewritten, from its own files, once a later month has been written. If rebuild is True, every month is rewritten.
+    The number of months written and removed and the number of plays read are returned.
+    '''
+    archive_location = get_archive_location(database_location)
+    manifest = None if rebuild else load_manifest(archive_location)
+    if manifest is None:
+        shutil.rmtree(archive_location, ignore_errors=True)
+        manifest = {"plays_generation": None, "partitions": {}}
+    partitions = manifest["partitions"]
+    stats = {"months_written": 0, "months_removed": 0, "plays_read": 0}
+    with get_engine(database_location).connect() as conn:
+        plays_generation = get_state(conn, "plays_generation", 0)
+        if manifest.get("plays_generation") == plays_generation:
+            return(stats)
+        month_totals = {month: (num_plays, total_duration) for month, num_plays, total_duration in conn.exec_driver_sql(MONTH_TOTALS_QUERY)}
+        # remove the months that no longer have any plays
+        for month in [month for month in partitions if month not in month_totals]:
+            shutil.rmtree(os.path.join(archive_location, month), ignore_errors=True)
+            del partitions[month]
+            stats["months_removed"] += 1
+        last_month = max(month_totals, default=None)
+        for month, (num_plays, total_duration) in sorted(month_totals.items()):
+            partition = partitions.get(month)
+            compress = month != last_month
+            unchanged = partition is not None and (partition["num_plays"], partition["total_duration"]) == (num_plays, total_duration)
+            if unchanged and partition.get("compressed", False) == compress:
+                continue
+            partition_location = os.path.join(archive_location, month)
+            columns = None
+            if partition is not None:
+                try:
+                    old_columns = read_partition(partition_location)
+                except (OSError, ValueError, KeyError):
+                    old_columns = {"played_at": []}
+                # a sync that was interrupted may have written the month's files without recording them in the manifest, so check the files as well
+                if len(old_columns["played_at"]) == partition["num_plays"]:
+                    # a month that is no longer the latest only has to be compressed, copying it out of its memory maps before its files are removed
+                    if unchanged:
+                        columns = {column: np.array(values) for column, values in old_columns.items()}
+                    # otherwise try appending the plays after the last one archived, and fall back to rewriting the month if that does not account for every play
+                    else:
+                        new_columns = read_month(conn, month, partition["last_played_at"])
+                        stats["plays_read"] += len(new_columns["played_at"])
+                        if partition["num_plays"] + len(new_columns["played_at"]) == num_plays:
+                            columns = {column: np.concatenate([old_columns[column], new_columns[column]]) for column in ARCHIVE_COLUMNS}
+            if columns is None:
+                columns = read_month(conn, month)
+                stats["plays_read"] += len(columns["played_at"])
+            write_partition(partition_location, columns, compress)
+            partitions[month] = {"num_plays": len(columns["played_at"]), "total_duration": int(columns["duration_in_ms"].sum(dtype=np.int64)),
+                                 "last_played_at": int(columns["played_at"].max()) if len(columns["played_at"]) else -1, "compressed": compress}
+            stats["months_written"] += 1
+    # record the plays generation last, so that the archive is only used once every partition has been written
+    manifest["plays_generation"] = plays_generation
+    replace_file(os.path.join(archive_location, MANIFEST_NAME), lambda f: f.write(json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8")))
+    return(stats)
+
+
+def refresh_archive(database_location=None):
+    '''(str) -> dict
+    This function syncs the archive of the given database after tracks have been loaded into it, if it has been created, returning the result of the sync
+    or None if there is no archive.
+    '''
+    try:
+        archive_location = get_archive_location(database_location)
+    except ValueError:
+        return(None)
+    if not os.path.exists(os.path.join(archive_location, MANIFEST_NAME)):
+        return(None)
+    return(sync_archive(database_location))
+
+
+def read_partition(partition_location, columns=ARCHIVE_COLUMNS):
+    '''(str, list of str) -> dict of ndarray
+    This function reads the given columns of a partition, decompressing only those columns of a compressed month, and memory mapping those of
+    the latest month so that nothing is read from its files until it is used.
+    '''
+    compressed_path = os.path.join(partition_location, COMPRESSED_NAME)
+    if os.path.exists(compressed_path):
+        with np.load(compressed_path) as compressed:
+            return({column: compressed[column] for column in columns})
+    return({column: np.load(os.path.join(partition_location, column + ".npy"), mmap_mode="r") for column in columns})
+
+
+def read_archive(columns, start_date=None, end_date=None, database_location=None):
+    '''(list of str, str, str, str) -> dict of ndarray
+    This function returns the given columns of the plays between the given dates (inclusive, the whole history by default) from the archive of the given database,
+    oldest first, reading only the months that overlap the dates and only the given columns of each. The columns of the latest month alone are returned
+    as read-only memory maps of its files, and those of several months are joined into one array each. None is returned if there is no archive
+    or the plays have changed since it was synced, in which case the plays should be read from the database instead.
+    '''
+    for column in columns:
+        if column not in ARCHIVE_COLUMNS:
+            raise ValueError("Invalid column: " + str(column))
+    try:
+        archive_location = get_archive_location(database_location)
+    except ValueError:
+        return(None)
+    manifest = load_manifest(archive_location)
+    if manifest is None:
+        return(None)
+    with get_engine(database_location).connect() as conn:
+        if manifest.get("plays_generation") != get_state(conn, "plays_generation", 0):
+            return(None)
+    # skip every month outside the dates, and only filter the plays by date if the dates fall within a month
+    months = [month for month in sorted(manifest["partitions"])
+              if (start_date is None or month >= start_date[:7]) and (end_date is None or month <= end_date[:7])]
+    read_columns = list(columns) + (["date_played"] if (start_date or end_date) and "date_played" not in columns else [])
+    partitions = [read_partition(os.path.join(archive_location, month), read_columns) for month in months]
+    if not partitions:
+        return({column: np.array([], dtype=ARCHIVE_COLUMNS[column]) for column in columns})
+    if len(partitions) == 1:
+        result = partitions[0]
+    else:
+        result = {column: np.concatenate([partition[column] for partition in partitions]) for column in read_columns}
+    if start_date or end_date:
+        date_played = result["date_played"]
+        mask = np.ones(len(date_played), dtype=bool)
+        if start_date:
+            mask &= date_played >= np.datetime64(start_date, "D")
+        if end_date:
+            mask &= date_played <= np.datetime64(end_date, "D")
+        if not mask.all():
+            result = {column: values[mask] for column, values in result.items()}
+    return({column: result[column] for column in columns})
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Keep a columnar copy of your listening history, partitioned by month, for fast whole-history reads.")
+    arg_parser.add_argument("--database", default=None, help="the database location (default: " + database.DATABASE_LOCATION + ")")
+    arg_parser.add_argument("--rebuild", action="store_true", help="rewrite every month instead of only the months that have changed")
+    args = arg_parser.parse_args()
+    stats = sync_archive(args.database, args.rebuild)
+    print("Wrote " + str(stats["months_written"]) + " months (" + str(stats["plays_read"]) + " plays) and removed " + str(stats["months_removed"])
+          + " months of " + get_archive_location(args.database) + ".")
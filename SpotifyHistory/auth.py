@@ -0,0 +1,123 @@
+from SpotifyHistory.instrumentation import traced
+from SpotifyHistory.spotify_api import ACCOUNTS_URL, REDIRECT_URI, get_token_from_code, refresh_access_token
+import http.server
+import json
+import os
+import secrets
+import time
+import webbrowser
+from urllib.parse import urlencode, urlparse, parse_qs
+
+# the file the tokens of each client are kept in between runs, readable only by the current user
+TOKEN_CACHE_LOCATION = os.getenv("SPOTIFY_TOKEN_CACHE", os.path.join(os.path.expanduser("~"), ".spotify_history_tokens.json"))
+
+# the seconds before an access token expires after which it is refreshed instead of used, so that it cannot expire mid-ingest
+EXPIRY_MARGIN_SECONDS = 60
+
+# the seconds to wait for the browser to be redirected back with an authorization code before asking for it to be pasted instead
+CALLBACK_TIMEOUT = 120
+
+SCOPE = "user-read-recently-played"
+
+
+def load_token_cache(path=TOKEN_CACHE_LOCATION):
+    '''(str) -> dict
+    This function returns the cached tokens of every client, keyed by client id, or an empty dictionary if nothing has been cached yet.
+    '''
+    try:
+        with open(path) as f:
+            return(json.load(f))
+    except (OSError, ValueError):
+        return({})
+
+
+def save_token(client_id, token, path=TOKEN_CACHE_LOCATION):
+    '''(str, dict, str) -> dict
+    Given a token response from Spotify, this function caches the client's access token with the time it expires and its refresh token,
+    keeping the previous refresh token if Spotify did not issue a new one. The file is replaced atomically and only the current user can read it.
+    The cached token is returned.
+    '''
+    tokens = load_token_cache(path)
+    cached = {"access_token": token["access_token"],
+              "expires_at": time.time() + token.get("expires_in", 3600),
+              "refresh_token": token.get("refresh_token") or tokens.get(client_id, {}).get("refresh_token")}
+    tokens[client_id] = cached
+    temp_path = path + ".tmp"
+    with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(tokens, f)
+    os.replace(temp_path, path)
+    return(cached)
+
+
+def capture_auth_code(client_id, timeout=CALLBACK_TIMEOUT):
+    '''(str, int) -> str
+    This function opens the Spotify authorization page in the browser and listens on the redirect uri for the authorization code it is sent back with,
+    returning the code, or None if the listener could not be started, authorization was refused or no code arrived before the timeout.
+    '''
+    redirect = urlparse(REDIRECT_URI)
+    state = secrets.token_urlsafe(16)
+    received = {}
+
+    class CallbackHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            # only accept the redirect of the authorization this function started
+            if url.path != redirect.path or query.get("state", [None])[0] != state:
+                self.send_error(404)
+                return
+            received["code"] = query.get("code", [None])[0]
+            received["error"] = query.get("error", [None])[0]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            message = "Authorization complete. You can close this window." if received["code"] else "Authorization was not granted."
+            self.wfile.write(message.encode("utf-8"))
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = http.server.HTTPServer((redirect.hostname, redirect.port), CallbackHandler)
+    except OSError:
+        return(None)
+    with server:
+        server.timeout = 1
+        webbrowser.open(ACCOUNTS_URL + "/authorize?" + urlencode({"client_id": client_id, "response_type": "code", "redirect_uri": REDIRECT_URI,
+                                                                  "scope": SCOPE, "state": state}))
+        print("Waiting for you to authorize access in the browser window that was opened ...")
+        deadline = time.time() + timeout
+        while not received and time.time() < deadline:
+            server.handle_request()
+    return(received.get("code"))
+
+
+@traced
+def get_cached_access_token(client_id, client_secret, interactive=True, path=TOKEN_CACHE_LOCATION):
+    '''(str, str, Boolean, str) -> str
+    This function returns an access token for the client, using the cached one if it has not expired, otherwise refreshing it with the cached refresh token,
+    so that no authorization is needed after the first. If neither works and interactive is True, the user is asked to authorize access,
+    with the code captured on the redirect uri or, failing that, pasted in. None is returned if no access token could be obtained.
+    '''
+    from SpotifyHistory.etl_data import authorize_user
+    cached = load_token_cache(path).get(client_id, {})
+    if cached.get("access_token") and cached.get("expires_at", 0) - EXPIRY_MARGIN_SECONDS > time.time():
+        return(cached["access_token"])
+    if cached.get("refresh_token"):
+        token = refresh_access_token(client_id, client_secret, cached["refresh_token"])
+        if "access_token" in token:
+            return(save_token(client_id, token, path)["access_token"])
+    if not interactive:
+        return(None)
+    # ask for authorization until a valid code is given or the user quits
+    auth_code = capture_auth_code(client_id)
+    while True:
+        if auth_code is None:
+            auth_code = authorize_user(client_id)
+        if auth_code.lower() == 'quit':
+            return(None)
+        token = get_token_from_code(client_id, client_secret, auth_code)
+        if "access_token" in token:
+            return(save_token(client_id, token, path)["access_token"])
+        print("Invalid authorization code. Launching a new window to generate a new code ...")
+        auth_code = None
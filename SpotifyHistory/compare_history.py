@@ -0,0 +1,188 @@
+from SpotifyHistory.database import get_engine
+from SpotifyHistory.query_cache import cached_query
+from SpotifyHistory.instrumentation import traced
+import functools
+import math
+import warnings
+import sqlalchemy
+import numpy as np
+import pandas as pd
+
+# the significance level of the two-tailed paired t-tests
+SIGNIFICANCE_LEVEL = 0.05
+
+# the lengths of time that can be compared, each paired day by day (by day of the week, or by day of the month)
+PERIODS = ("week", "month")
+
+DAILY_TOTALS_QUERY = sqlalchemy.text("""
+    SELECT date_played, total_duration
+    FROM daily_totals
+    WHERE date_played BETWEEN :start_date AND :end_date
+    ORDER BY date_played
+    """)
+HISTORY_RANGE_QUERY = sqlalchemy.text("""
+    SELECT MIN(date_played), MAX(date_played) FROM daily_totals
+    """)
+
+
+def regularized_incomplete_beta(a, b, x):
+    '''(float, float, float) -> float
+    This function returns the regularized incomplete beta function I_x(a, b), evaluated with its continued fraction (by the modified Lentz method).
+    '''
+    if x <= 0:
+        return(0.0)
+    if x >= 1:
+        return(1.0)
+    # the continued fraction converges quickly only below this point, so use the symmetry I_x(a, b) = 1 - I_(1-x)(b, a) above it
+    if x > (a + 1) / (a + b + 2):
+        return(1 - regularized_incomplete_beta(b, a, 1 - x))
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x)) / a
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 300):
+        # each step of the continued fraction has an even and an odd term
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)), -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1) < 1e-15:
+            break
+    return(front * result)
+
+
+def t_two_tailed_p_value(t_stat, df):
+    '''(float, int) -> float
+    This function returns the probability of a t-statistic at least as far from 0 as the one given, for the given degrees of freedom.
+    '''
+    return(regularized_incomplete_beta(df / 2, 0.5, df / (df + t_stat ** 2)))
+
+
+@functools.lru_cache(maxsize=None)
+def get_t_critical(df, significance_level=SIGNIFICANCE_LEVEL):
+    '''(int, float) -> float
+    This function returns the critical t-value of a two-tailed test at the given significance level for the given degrees of freedom,
+    by bisecting the t-distribution rather than reading it from a t-table, so that any number of degrees of freedom can be used.
+    '''
+    if df < 1:
+        return(math.nan)
+    low, high = 0.0, 1.0
+    # widen the search until the critical value is inside it, then halve it until it is known to well beyond the precision shown
+    while t_two_tailed_p_value(high, df) > significance_level:
+        low, high = high, high * 2
+    while high - low > 1e-9:
+        middle = (low + high) / 2
+        if t_two_tailed_p_value(middle, df) > significance_level:
+            low = middle
+        else:
+            high = middle
+    return((low + high) / 2)
+
+
+def paired_t_tests(later, earlier, significance_level=SIGNIFICANCE_LEVEL):
+    '''(ndarray, ndarray, float) -> dict of ndarray
+    Given two matrices of durations where each row of later is paired day by day with the same row of earlier, this function runs a paired t-test on every row at once.
+    Days that are missing (NaN) from either period are left out of their pair. The mean difference, t-statistic, degrees of freedom, critical t-value
+    and whether the difference is significant are returned for each row. A row whose differences are all the same has a t-statistic of 0 if they are 0
+    and of plus or minus infinity otherwise.
+    '''
+    differences = np.asarray(later, dtype=float) - np.asarray(earlier, dtype=float)
+    n = np.sum(~np.isnan(differences), axis=1)
+    df = n - 1
+    # rows with too few days to test are left as NaN instead of warning about them
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean_differences = np.nanmean(differences, axis=1)
+        std_devs = np.sqrt(np.nansum((differences - mean_differences[:, None]) ** 2, axis=1) / df)
+        t_stats = mean_differences / (std_devs / np.sqrt(n))
+        t_stats = np.where(std_devs == 0, np.where(mean_differences == 0, 0.0, np.sign(mean_differences) * np.inf), t_stats)
+        t_crits = np.array([get_t_critical(int(d), significance_level) for d in df], dtype=float)
+        significant = np.abs(t_stats) >= t_crits
+    return({"mean_difference": mean_differences, "t_stat": t_stats, "df": df, "t_crit": t_crits, "significant": significant})
+
+
+@traced
+@cached_query
+def get_history_range():
+    '''() -> str, str
+    This function returns the first and last dates with any songs played, or None for both if nothing has been played yet.
+    '''
+    with get_engine().connect() as conn:
+        first_date, last_date = conn.execute(HISTORY_RANGE_QUERY).one()
+    return(first_date, last_date)
+
+
+@traced
+@cached_query
+def get_period_matrix(start_date=None, end_date=None, period="week"):
+    '''(str, str, str) -> list of str, ndarray
+    This function returns the first date of every week (starting on Sunday) or month overlapping the given range of dates (the whole history by default),
+    and a matrix with a row for each of them holding the total duration spent listening in milliseconds on each day of the week, or each day of the month.
+    Days without any songs played are 0, and days outside the range or, for months, past the end of the month are NaN.
+    The matrix is built from a single query of the daily totals.
+    '''
+    if period not in PERIODS:
+        raise ValueError("Invalid period: " + str(period))
+    if start_date is None or end_date is None:
+        first_date, last_date = get_history_range()
+        if first_date is None:
+            return([], np.zeros((0, 7 if period == "week" else 31)))
+        start_date = start_date or first_date
+        end_date = end_date or last_date
+    with get_engine().connect() as conn:
+        rows = conn.execute(DAILY_TOTALS_QUERY, {"start_date": start_date, "end_date": end_date}).all()
+    # number every day of the range, so that each day's row and column in the matrix can be worked out with array arithmetic
+    days = np.arange(np.datetime64(start_date, "D"), np.datetime64(end_date, "D") + 1)
+    if period == "week":
+        # 1970-01-01 was a Thursday, so this is the day of the week of each day with Sunday as 0
+        columns = (days.astype(np.int64) + 4) % 7
+        period_starts = days - columns
+        num_columns = 7
+    else:
+        period_starts = days.astype("datetime64[M]").astype("datetime64[D]")
+        columns = (days - period_starts).astype(np.int64)
+        num_columns = 31
+    unique_starts, row_indices = np.unique(period_starts, return_inverse=True)
+    matrix = np.full((len(unique_starts), num_columns), np.nan)
+    matrix[row_indices, columns] = 0
+    # place each day's total at its row and column
+    if rows:
+        dates = np.array([date for date, total in rows], dtype="datetime64[D]")
+        totals = np.array([total for date, total in rows], dtype=float)
+        positions = (dates - days[0]).astype(np.int64)
+        matrix[row_indices[positions], columns[positions]] = totals
+    return([str(start) for start in unique_starts], matrix)
+
+
+@traced
+def compare_periods(start_date=None, end_date=None, period="week", window=1, significance_level=SIGNIFICANCE_LEVEL):
+    '''(str, str, str, int, float) -> Dataframe
+    This function compares every block of window consecutive weeks or months in the given range (the whole history by default) with the block of the same length
+    just before it, using a paired t-test of the durations listened on each day, paired by day of the week or day of the month.
+    A row is returned for each comparison with the first date of both blocks, the total duration of each in milliseconds and the test's results.
+    '''
+    period_starts, matrix = get_period_matrix(start_date, end_date, period)
+    num_blocks = len(period_starts) - 2 * window + 1
+    if num_blocks <= 0:
+        return(pd.DataFrame(columns=["start_date", "previous_start_date", "total_duration_in_ms", "previous_total_duration_in_ms",
+                                     "mean_difference_in_ms", "t_stat", "df", "t_crit", "significant"]))
+    # lay each block of window periods out as a single row of days, then pair each block with the block window periods before it
+    blocks = np.lib.stride_tricks.sliding_window_view(matrix, (window, matrix.shape[1])).reshape(len(period_starts) - window + 1, -1)
+    later = blocks[window:]
+    earlier = blocks[:-window]
+    results = paired_t_tests(later, earlier, significance_level)
+    return(pd.DataFrame({
+        "start_date": period_starts[window:window + num_blocks],
+        "previous_start_date": period_starts[:num_blocks],
+        "total_duration_in_ms": np.nansum(later, axis=1).astype(np.int64),
+        "previous_total_duration_in_ms": np.nansum(earlier, axis=1).astype(np.int64),
+        "mean_difference_in_ms": results["mean_difference"],
+        "t_stat": np.round(results["t_stat"], 3),
+        "df": results["df"],
+        "t_crit": np.round(results["t_crit"], 3),
+        "significant": results["significant"]
+    }))
@@ -0,0 +1,567 @@
+import argparse
+import functools
+import threading
+import uuid
+import sqlalchemy
+
+
+DATABASE_LOCATION = "sqlite:///my_listening_history.sqlite"
+
+# the prefix of the ids made up from names for the tracks, artists and albums that are loaded without a Spotify id,
+# e.g. the artists and albums of the streaming history export or local files
+NAME_ID_PREFIX = "name:"
+
+# the number of prepared statements sqlite keeps compiled on each pooled connection
+STATEMENT_CACHE_SIZE = 128
+
+# the pragmas set on every new connection: write-ahead logging so that readers are not blocked while tracks are loaded,
+# only syncing to disk at checkpoints, a 64MB page cache and temporary tables kept in memory
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,
+    "temp_store": "MEMORY"
+}
+
+# the dimension tables, and their keys, that the number of plays of each is kept for
+ROLLUP_DIMENSIONS = [("tracks", "track_key"), ("artists", "artist_key"), ("albums", "album_key")]
+
+# the name column of each dimension table, which is indexed for searching
+SEARCH_NAME_COLUMNS = {"tracks": "track_name", "artists": "artist_name", "albums": "album_name"}
+
+# the engines that have been created so far, keyed by database location, and the lock held while one is created and migrated
+# so that threads loading into the same database never create two engines for it
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(database_location=None, pragmas=None):
+    '''(str, dict) -> sqlalchemy.engine.Engine
+    This function returns the engine for the given database (the default database if none is given), creating it the first time it is requested
+    so that the ETL loader and every view share one pool of connections for the life of the process. Any pragmas given override SQLITE_PRAGMAS
+    on the connections of a newly created engine.
+    '''
+    if database_location is None:
+        database_location = DATABASE_LOCATION
+    engine = _engines.get(database_location)
+    if engine is not None:
+        return(engine)
+    with _engines_lock:
+        engine = _engines.get(database_location)
+        if engine is not None:
+            return(engine)
+        # keep a small pool of open connections, each of which reuses its compiled statements between queries
+        engine = sqlalchemy.create_engine(database_location,
+                                          poolclass=sqlalchemy.pool.QueuePool,
+                                          pool_size=5,
+                                          connect_args={"check_same_thread": False, "cached_statements": STATEMENT_CACHE_SIZE})
+        sqlalchemy.event.listen(engine, "connect", functools.partial(configure_connection, {**SQLITE_PRAGMAS, **(pragmas or {})}))
+        sqlalchemy.event.listen(engine, "begin", begin_transaction)
+        migrate_database(engine)
+        _engines[database_location] = engine
+    return(engine)
+
+
+def configure_connection(pragmas, dbapi_connection, connection_record):
+    '''(dict, sqlite3.Connection, sqlalchemy.pool.ConnectionPoolEntry) -> Nonetype
+    This function sets the given pragmas on a new connection and stops the sqlite driver from opening and committing transactions on its own,
+    which it otherwise does around schema changes, so that transactions are only started by begin_transaction.
+    '''
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute("PRAGMA {name} = {value}".format(name=name, value=value))
+    cursor.close()
+
+
+def begin_transaction(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    This function starts a transaction whenever sqlalchemy begins one, so that everything executed inside it, including schema changes, is atomic.
+    '''
+    conn.exec_driver_sql("BEGIN")
+
+
+def dispose_engines():
+    '''() -> Nonetype
+    This function closes every pooled connection and forgets the engines that have been created, e.g. before the database file is replaced.
+    '''
+    for engine in _engines.values():
+        engine.dispose()
+    _engines.clear()
+
+
+def create_history_table(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 1: this function creates the table to store the user's complete listening history if one does not already exist.
+    '''
+    create_query = """
+        CREATE TABLE IF NOT EXISTS complete_listening_history(
+            track_name VARCHAR(200),
+            artist_name VARCHAR(200),
+            album_name VARCHAR(200),
+            track_id VARCHAR(200),
+            artist_id VARCHAR(200),
+            album_id VARCHAR(200),
+            release_date VARCHAR(200),
+            date_time_played VARCHAR(200),
+            date_played VARCHAR(200),
+            time_played VARCHAR(200) PRIMARY KEY,
+            duration_in_ms INT,
+            duration VARCHAR(10)
+        );
+        """
+    conn.exec_driver_sql(create_query)
+
+
+def add_hour_and_weekday_columns(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 2: this function stores the hour of the day (0-23) and the day of the week (Sunday = 0, ... Saturday = 6) that each song was played
+    as integers, fills them in for the songs already in the history and indexes them so that listening by time of day can be counted in one query.
+    '''
+    conn.exec_driver_sql("ALTER TABLE complete_listening_history ADD COLUMN hour_played INT")
+    conn.exec_driver_sql("ALTER TABLE complete_listening_history ADD COLUMN weekday_played INT")
+    conn.exec_driver_sql("""
+        UPDATE complete_listening_history
+        SET hour_played = CAST(substr(time_played, 1, 2) AS INT),
+            weekday_played = CAST(strftime('%w', date_played) AS INT)
+        """)
+    conn.exec_driver_sql("""
+        CREATE INDEX IF NOT EXISTS idx_history_hour_weekday
+        ON complete_listening_history(hour_played, weekday_played)
+        """)
+
+
+def key_history_by_played_at(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 3: this function rebuilds the complete listening history as a table clustered on played_at, the UTC time each song was played
+    as a unix timestamp in milliseconds, replacing the time of day key that collided across days. The local date and time played are converted back
+    to UTC using the local timezone they were converted with, and the date and the track, artist and album ids are indexed.
+    '''
+    create_query = """
+        CREATE TABLE complete_listening_history_v3(
+            played_at INTEGER PRIMARY KEY,
+            track_name TEXT,
+            artist_name TEXT,
+            album_name TEXT,
+            track_id TEXT,
+            artist_id TEXT,
+            album_id TEXT,
+            release_date TEXT,
+            date_time_played TEXT,
+            date_played TEXT,
+            time_played TEXT,
+            hour_played INTEGER,
+            weekday_played INTEGER,
+            duration_in_ms INTEGER,
+            duration TEXT
+        ) WITHOUT ROWID;
+        """
+    conn.exec_driver_sql(create_query)
+    copy_query = """
+        INSERT OR IGNORE INTO complete_listening_history_v3
+        SELECT CAST(strftime('%s', substr(date_time_played, 1, 19), 'utc') AS INTEGER) * 1000 + CAST(substr(date_time_played, 21, 3) AS INTEGER),
+            track_name, artist_name, album_name, track_id, artist_id, album_id, release_date,
+            date_time_played, date_played, time_played, hour_played, weekday_played, duration_in_ms, duration
+        FROM complete_listening_history;
+        """
+    conn.exec_driver_sql(copy_query)
+    conn.exec_driver_sql("DROP TABLE complete_listening_history")
+    conn.exec_driver_sql("ALTER TABLE complete_listening_history_v3 RENAME TO complete_listening_history")
+    for column in ("date_played", "track_id", "artist_id", "album_id"):
+        conn.exec_driver_sql("CREATE INDEX idx_history_{column} ON complete_listening_history({column})".format(column=column))
+    conn.exec_driver_sql("CREATE INDEX idx_history_hour_weekday ON complete_listening_history(hour_played, weekday_played)")
+
+
+def normalize_history(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 4: this function splits the complete listening history into tracks, artists and albums tables, each storing the names and ids once
+    under an integer key, and a narrow plays table that refers to them. The complete listening history is replaced by a view joining them back together,
+    so it can still be queried with the same columns.
+    '''
+    create_queries = ["""
+        CREATE TABLE artists(
+            artist_key INTEGER PRIMARY KEY,
+            artist_id TEXT UNIQUE,
+            artist_name TEXT
+        );
+        """, """
+        CREATE TABLE albums(
+            album_key INTEGER PRIMARY KEY,
+            album_id TEXT UNIQUE,
+            album_name TEXT,
+            release_date TEXT
+        );
+        """, """
+        CREATE TABLE tracks(
+            track_key INTEGER PRIMARY KEY,
+            track_id TEXT UNIQUE,
+            track_name TEXT
+        );
+        """, """
+        CREATE TABLE plays(
+            played_at INTEGER PRIMARY KEY,
+            track_key INTEGER REFERENCES tracks(track_key),
+            artist_key INTEGER REFERENCES artists(artist_key),
+            album_key INTEGER REFERENCES albums(album_key),
+            date_played TEXT,
+            hour_played INTEGER,
+            weekday_played INTEGER,
+            duration_in_ms INTEGER
+        ) WITHOUT ROWID;
+        """]
+    for create_query in create_queries:
+        conn.exec_driver_sql(create_query)
+    # give the tracks, artists and albums without an id one made up from their names, the same way as the loader, so that none of their plays are dropped
+    conn.exec_driver_sql("""
+        UPDATE complete_listening_history
+        SET track_id = COALESCE(track_id, ? || IFNULL(artist_name, '') || '/' || IFNULL(album_name, '') || '/' || IFNULL(track_name, '')),
+            artist_id = COALESCE(artist_id, ? || IFNULL(artist_name, '')),
+            album_id = COALESCE(album_id, ? || IFNULL(artist_name, '') || '/' || IFNULL(album_name, ''))
+        WHERE track_id IS NULL OR artist_id IS NULL OR album_id IS NULL
+        """, (NAME_ID_PREFIX, NAME_ID_PREFIX, NAME_ID_PREFIX))
+    # store each track, artist and album once, and then every play in terms of their keys
+    conn.exec_driver_sql("""
+        INSERT INTO artists(artist_id, artist_name)
+        SELECT artist_id, MAX(artist_name) FROM complete_listening_history GROUP BY artist_id
+        """)
+    conn.exec_driver_sql("""
+        INSERT INTO albums(album_id, album_name, release_date)
+        SELECT album_id, MAX(album_name), MAX(release_date) FROM complete_listening_history GROUP BY album_id
+        """)
+    conn.exec_driver_sql("""
+        INSERT INTO tracks(track_id, track_name)
+        SELECT track_id, MAX(track_name) FROM complete_listening_history GROUP BY track_id
+        """)
+    conn.exec_driver_sql("""
+        INSERT INTO plays
+        SELECT h.played_at, t.track_key, ar.artist_key, al.album_key, h.date_played, h.hour_played, h.weekday_played, h.duration_in_ms
+        FROM complete_listening_history AS h
+        JOIN tracks AS t ON t.track_id = h.track_id
+        JOIN artists AS ar ON ar.artist_id = h.artist_id
+        JOIN albums AS al ON al.album_id = h.album_id
+        """)
+    conn.exec_driver_sql("DROP TABLE complete_listening_history")
+    for column in ("date_played", "track_key", "artist_key", "album_key"):
+        conn.exec_driver_sql("CREATE INDEX idx_plays_{column} ON plays({column})".format(column=column))
+    conn.exec_driver_sql("CREATE INDEX idx_plays_hour_weekday ON plays(hour_played, weekday_played)")
+    # rebuild the complete listening history, formatting the local date and time played and the duration the same way as when they were extracted
+    conn.exec_driver_sql("""
+        CREATE VIEW complete_listening_history AS
+        SELECT p.played_at, t.track_name, ar.artist_name, al.album_name, t.track_id, ar.artist_id, al.album_id, al.release_date,
+            strftime('%Y-%m-%d %H:%M:%S', p.played_at / 1000, 'unixepoch', 'localtime') || ':' || printf('%03d', p.played_at % 1000) AS date_time_played,
+            p.date_played,
+            strftime('%H:%M:%S', p.played_at / 1000, 'unixepoch', 'localtime') || ':' || printf('%03d', p.played_at % 1000) AS time_played,
+            p.hour_played, p.weekday_played, p.duration_in_ms,
+            CASE WHEN p.duration_in_ms < 3600000
+                THEN printf('%d:%02d', p.duration_in_ms / 60000 % 60, p.duration_in_ms / 1000 % 60)
+                ELSE printf('%d:%02d:%02d', p.duration_in_ms / 3600000 % 24, p.duration_in_ms / 60000 % 60, p.duration_in_ms / 1000 % 60)
+            END AS duration
+        FROM plays AS p
+        JOIN tracks AS t ON t.track_key = p.track_key
+        JOIN artists AS ar ON ar.artist_key = p.artist_key
+        JOIN albums AS al ON al.album_key = p.album_key
+        """)
+
+
+def create_etl_state_table(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 5: this function creates a table of named values that the ETL process keeps between runs, starting with the high-water mark
+    of the most recent play that has been loaded and a random id for the database, which tells apart the cached query results of different databases,
+    including a database created again at the same location.
+    '''
+    create_query = """
+        CREATE TABLE etl_state(
+            name TEXT PRIMARY KEY,
+            value
+        );
+        """
+    conn.exec_driver_sql(create_query)
+    conn.exec_driver_sql("INSERT INTO etl_state(name, value) SELECT 'last_played_at', MAX(played_at) FROM plays")
+    set_state(conn, "database_id", uuid.uuid4().hex)
+
+
+def drop_staging_table(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 6: this function drops the table that today's tracks used to be staged in before being copied into the listening history,
+    now that they are loaded into it directly.
+    '''
+    conn.exec_driver_sql("DROP TABLE IF EXISTS todays_tracks")
+
+
+def create_rollup_tables(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 7: this function creates the summary tables of the listening history, with the total duration and number of plays for each day,
+    the number of plays for each hour of each day of the week, and the number of plays, total duration and first and last time played of each track,
+    artist and album. A trigger keeps them up to date as plays are inserted, inside the same transaction, and they are filled in for the existing plays.
+    '''
+    create_queries = ["""
+        CREATE TABLE daily_totals(
+            date_played TEXT PRIMARY KEY,
+            total_duration INTEGER,
+            num_plays INTEGER
+        ) WITHOUT ROWID;
+        """, """
+        CREATE TABLE hourly_counts(
+            hour_played INTEGER,
+            weekday_played INTEGER,
+            num_plays INTEGER,
+            PRIMARY KEY(hour_played, weekday_played)
+        ) WITHOUT ROWID;
+        """]
+    for table, key in ROLLUP_DIMENSIONS:
+        create_queries.append("""
+            CREATE TABLE {table}_counts(
+                {key} INTEGER PRIMARY KEY,
+                num_plays INTEGER,
+                total_duration INTEGER,
+                first_played INTEGER,
+                last_played INTEGER
+            );
+            """.format(table=table, key=key))
+        create_queries.append("CREATE INDEX idx_{table}_counts_num_plays ON {table}_counts(num_plays DESC)".format(table=table))
+    for create_query in create_queries:
+        conn.exec_driver_sql(create_query)
+    # add each new play to every summary table
+    trigger_statements = ["""
+        INSERT INTO daily_totals(date_played, total_duration, num_plays) VALUES (NEW.date_played, NEW.duration_in_ms, 1)
+        ON CONFLICT(date_played) DO UPDATE SET total_duration = total_duration + excluded.total_duration, num_plays = num_plays + 1;
+        """, """
+        INSERT INTO hourly_counts(hour_played, weekday_played, num_plays) VALUES (NEW.hour_played, NEW.weekday_played, 1)
+        ON CONFLICT(hour_played, weekday_played) DO UPDATE SET num_plays = num_plays + 1;
+        """]
+    for table, key in ROLLUP_DIMENSIONS:
+        trigger_statements.append("""
+            INSERT INTO {table}_counts({key}, num_plays, total_duration, first_played, last_played)
+            VALUES (NEW.{key}, 1, NEW.duration_in_ms, NEW.played_at, NEW.played_at)
+            ON CONFLICT({key}) DO UPDATE SET num_plays = num_plays + 1, total_duration = total_duration + excluded.total_duration,
+                first_played = MIN(first_played, excluded.first_played), last_played = MAX(last_played, excluded.last_played);
+            """.format(table=table, key=key))
+    conn.exec_driver_sql("CREATE TRIGGER plays_rollups AFTER INSERT ON plays BEGIN " + "".join(trigger_statements) + " END")
+    fill_rollup_tables(conn)
+
+
+def create_metadata_tables(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 8: this function creates the local cache of the metadata Spotify has for each track, artist and album, including every artist
+    credited on a track and the genres of each artist. A row is kept even for an id Spotify no longer knows, so that it is never requested again.
+    '''
+    create_queries = ["""
+        CREATE TABLE track_metadata(
+            track_id TEXT PRIMARY KEY,
+            popularity INTEGER,
+            explicit INTEGER,
+            fetched_at INTEGER
+        ) WITHOUT ROWID;
+        """, """
+        CREATE TABLE track_artists(
+            track_id TEXT,
+            position INTEGER,
+            artist_id TEXT,
+            artist_name TEXT,
+            PRIMARY KEY(track_id, position)
+        ) WITHOUT ROWID;
+        """, """
+        CREATE INDEX idx_track_artists_artist_id ON track_artists(artist_id);
+        """, """
+        CREATE TABLE artist_metadata(
+            artist_id TEXT PRIMARY KEY,
+            artist_name TEXT,
+            popularity INTEGER,
+            followers INTEGER,
+            fetched_at INTEGER
+        ) WITHOUT ROWID;
+        """, """
+        CREATE TABLE artist_genres(
+            artist_id TEXT,
+            genre TEXT,
+            PRIMARY KEY(artist_id, genre)
+        ) WITHOUT ROWID;
+        """, """
+        CREATE INDEX idx_artist_genres_genre ON artist_genres(genre);
+        """, """
+        CREATE TABLE album_metadata(
+            album_id TEXT PRIMARY KEY,
+            album_type TEXT,
+            label TEXT,
+            popularity INTEGER,
+            total_tracks INTEGER,
+            fetched_at INTEGER
+        ) WITHOUT ROWID;
+        """]
+    for create_query in create_queries:
+        conn.exec_driver_sql(create_query)
+
+
+def create_heavy_hitters_tables(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 9: this function creates the tables of the approximate most played tracks, artists and albums of each year, month and week,
+    kept as a fixed number of counters per window (see heavy_hitters.py), and the number of plays counted in each window and how far over its counts can be.
+    '''
+    create_queries = ["""
+        CREATE TABLE heavy_hitters(
+            dimension TEXT,
+            period TEXT,
+            period_start TEXT,
+            item_key INTEGER,
+            num_plays INTEGER,
+            max_overcount INTEGER,
+            PRIMARY KEY(dimension, period, period_start, item_key)
+        ) WITHOUT ROWID;
+        """, """
+        CREATE TABLE heavy_hitters_totals(
+            dimension TEXT,
+            period TEXT,
+            period_start TEXT,
+            num_plays INTEGER,
+            max_overcount INTEGER,
+            PRIMARY KEY(dimension, period, period_start)
+        ) WITHOUT ROWID;
+        """]
+    for create_query in create_queries:
+        conn.exec_driver_sql(create_query)
+
+
+def create_name_search_tables(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 10: this function creates a full-text index of the names of the tracks, artists and albums, split into trigrams so that any part of a name
+    at least three characters long is found without reading every name, ignoring case. Each index only stores the trigrams and reads the names
+    from its table, and triggers keep it up to date as names are added, changed or removed, inside the same transaction.
+    '''
+    for table, key in ROLLUP_DIMENSIONS:
+        name = SEARCH_NAME_COLUMNS[table]
+        # the loader only updates the names that have changed, and the update trigger only reindexes a name that actually has
+        create_queries = ["""
+            CREATE VIRTUAL TABLE {table}_search USING fts5({name}, content='{table}', content_rowid='{key}', tokenize='trigram');
+            """, """
+            CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {table}_search(rowid, {name}) VALUES (NEW.{key}, NEW.{name});
+            END;
+            """, """
+            CREATE TRIGGER {table}_search_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {table}_search({table}_search, rowid, {name}) VALUES ('delete', OLD.{key}, OLD.{name});
+            END;
+            """, """
+            CREATE TRIGGER {table}_search_update AFTER UPDATE OF {name} ON {table} WHEN OLD.{name} IS NOT NEW.{name} BEGIN
+                INSERT INTO {table}_search({table}_search, rowid, {name}) VALUES ('delete', OLD.{key}, OLD.{name});
+                INSERT INTO {table}_search(rowid, {name}) VALUES (NEW.{key}, NEW.{name});
+            END;
+            """, """
+            INSERT INTO {table}_search({table}_search) VALUES ('rebuild');
+            """]
+        for create_query in create_queries:
+            conn.exec_driver_sql(create_query.format(table=table, key=key, name=name))
+
+
+def create_session_tables(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    Migration 11: this function creates the table of listening sessions, runs of plays with only short gaps between them, each keyed by its first play
+    with its last play, the time it started, its local start date, its number of plays and their total duration, and splits the existing plays into sessions.
+    The sessions are updated in the same transaction as each load (see sessions.py).
+    '''
+    from SpotifyHistory.sessions import update_sessions
+    create_queries = ["""
+        CREATE TABLE listening_sessions(
+            first_played_at INTEGER PRIMARY KEY,
+            last_played_at INTEGER,
+            started_at INTEGER,
+            start_date TEXT,
+            num_plays INTEGER,
+            total_duration INTEGER
+        ) WITHOUT ROWID;
+        """, """
+        CREATE INDEX idx_listening_sessions_start_date ON listening_sessions(start_date);
+        """]
+    for create_query in create_queries:
+        conn.exec_driver_sql(create_query)
+    update_sessions(conn)
+
+
+# the schema migrations in the order they are applied, where a database at version i has had the first i migrations applied
+MIGRATIONS = [create_history_table, add_hour_and_weekday_columns, key_history_by_played_at, normalize_history, create_etl_state_table,
+              drop_staging_table, create_rollup_tables, create_metadata_tables, create_heavy_hitters_tables,
+              create_name_search_tables, create_session_tables]
+
+
+def migrate_database(engine):
+    '''(sqlalchemy.engine.Engine) -> Nonetype
+    This function brings the database up to the latest schema by applying, in a single transaction, each migration that has not been applied yet.
+    The version of the schema is tracked by sqlite's user_version pragma.
+    '''
+    with engine.begin() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for i in range(version, len(MIGRATIONS)):
+            MIGRATIONS[i](conn)
+        if version < len(MIGRATIONS):
+            conn.exec_driver_sql("PRAGMA user_version = {version}".format(version=len(MIGRATIONS)))
+
+
+def get_state(conn, name, default=None):
+    '''(sqlalchemy.engine.Connection, str, object) -> object
+    This function returns the value stored under the given name in the ETL state table, or the default if there is none.
+    '''
+    value = conn.exec_driver_sql("SELECT value FROM etl_state WHERE name = ?", (name,)).scalar()
+    return(default if value is None else value)
+
+
+def set_state(conn, name, value):
+    '''(sqlalchemy.engine.Connection, str, object) -> Nonetype
+    This function stores the value under the given name in the ETL state table, replacing any value already stored.
+    '''
+    conn.exec_driver_sql("INSERT OR REPLACE INTO etl_state(name, value) VALUES (?, ?)", (name, value))
+
+
+def increment_generation(conn, plays_changed=False):
+    '''(sqlalchemy.engine.Connection, Boolean) -> Nonetype
+    This function increases the generation of the database, which marks the results of every query made before the change as out of date.
+    If plays_changed is True, the plays generation is increased as well, which marks the columnar archive of the plays as out of date,
+    while changes that leave the plays as they are, e.g. to the metadata or the listening sessions, do not.
+    '''
+    for name in (["generation", "plays_generation"] if plays_changed else ["generation"]):
+        conn.exec_driver_sql("""
+            INSERT INTO etl_state(name, value) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1
+            """, (name,))
+
+
+def fill_rollup_tables(conn):
+    '''(sqlalchemy.engine.Connection) -> Nonetype
+    This function recomputes every summary table from the plays in the listening history.
+    '''
+    conn.exec_driver_sql("DELETE FROM daily_totals")
+    conn.exec_driver_sql("""
+        INSERT INTO daily_totals(date_played, total_duration, num_plays)
+        SELECT date_played, SUM(duration_in_ms), COUNT(*) FROM plays GROUP BY date_played
+        """)
+    conn.exec_driver_sql("DELETE FROM hourly_counts")
+    conn.exec_driver_sql("""
+        INSERT INTO hourly_counts(hour_played, weekday_played, num_plays)
+        SELECT hour_played, weekday_played, COUNT(*) FROM plays GROUP BY hour_played, weekday_played
+        """)
+    for table, key in ROLLUP_DIMENSIONS:
+        conn.exec_driver_sql("DELETE FROM {table}_counts".format(table=table))
+        conn.exec_driver_sql("""
+            INSERT INTO {table}_counts({key}, num_plays, total_duration, first_played, last_played)
+            SELECT {key}, COUNT(*), SUM(duration_in_ms), MIN(played_at), MAX(played_at) FROM plays GROUP BY {key}
+            """.format(table=table, key=key))
+
+
+def rebuild_rollups(database_location=None):
+    '''(str) -> Nonetype
+    This function rebuilds the summary tables of the given database (the default database if none is given) from its plays in a single transaction,
+    e.g. after plays have been edited or removed by hand.
+    '''
+    with get_engine(database_location).begin() as conn:
+        fill_rollup_tables(conn)
+        increment_generation(conn, plays_changed=True)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Maintain the database of your listening history.")
+    arg_parser.add_argument("command", choices=["migrate", "rebuild-rollups"],
+                            help="migrate: bring the database up to the latest schema; rebuild-rollups: recompute the summary tables from the plays")
+    arg_parser.add_argument("--database", default=None, help="the database location (default: " + DATABASE_LOCATION + ")")
+    args = arg_parser.parse_args()
+    # creating the engine migrates the database
+    get_engine(args.database)
+    if args.command == "rebuild-rollups":
+        rebuild_rollups(args.database)
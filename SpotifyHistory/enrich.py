@@ -0,0 +1,167 @@
+from SpotifyHistory.database import NAME_ID_PREFIX, get_engine, increment_generation
+from SpotifyHistory.instrumentation import traced
+from SpotifyHistory.spotify_api import get_several
+import argparse
+import concurrent.futures
+import time
+import requests
+
+# the most ids Spotify accepts in one request for each kind of object
+BATCH_SIZES = {"tracks": 50, "artists": 50, "albums": 20}
+
+# the most requests for metadata in flight at once
+MAX_CONCURRENT_REQUESTS = 4
+
+# the ids of the tracks, artists and albums in the listening history that are not in the metadata cache yet. The artists and albums of the
+# streaming history export, and the tracks, artists and albums of local files, are identified by name rather than by id (see etl_data.py),
+# which Spotify would reject, so only their real ids, learned from the tracks, are fetched
+UNSEEN_IDS_QUERIES = {
+    "tracks": """
+        SELECT track_id FROM tracks WHERE track_id NOT LIKE :prefix || '%' AND track_id NOT IN (SELECT track_id FROM track_metadata)
+        """,
+    "artists": """
+        SELECT artist_id FROM artists WHERE artist_id NOT LIKE :prefix || '%'
+        UNION SELECT artist_id FROM track_artists WHERE artist_id IS NOT NULL
+        EXCEPT SELECT artist_id FROM artist_metadata
+        """,
+    "albums": """
+        SELECT album_id FROM albums WHERE album_id NOT LIKE :prefix || '%' AND album_id NOT IN (SELECT album_id FROM album_metadata)
+        """
+}
+
+# the queries that add the metadata of each kind of object to the cache
+INSERT_METADATA_QUERIES = {
+    "tracks": [("""
+        INSERT OR REPLACE INTO track_metadata(track_id, popularity, explicit, fetched_at) VALUES (:id, :popularity, :explicit, :fetched_at)
+        """, "rows"), ("""
+        DELETE FROM track_artists WHERE track_id = :id
+        """, "rows"), ("""
+        INSERT INTO track_artists(track_id, position, artist_id, artist_name) VALUES (:track_id, :position, :artist_id, :artist_name)
+        """, "children")],
+    "artists": [("""
+        INSERT OR REPLACE INTO artist_metadata(artist_id, artist_name, popularity, followers, fetched_at) VALUES (:id, :name, :popularity, :followers, :fetched_at)
+        """, "rows"), ("""
+        DELETE FROM artist_genres WHERE artist_id = :id
+        """, "rows"), ("""
+        INSERT OR IGNORE INTO artist_genres(artist_id, genre) VALUES (:artist_id, :genre)
+        """, "children")],
+    "albums": [("""
+        INSERT OR REPLACE INTO album_metadata(album_id, album_type, label, popularity, total_tracks, fetched_at)
+        VALUES (:id, :album_type, :label, :popularity, :total_tracks, :fetched_at)
+        """, "rows")]
+}
+
+
+def get_metadata_rows(kind, ids, objects, fetched_at):
+    '''(str, list of str, list of dict, int) -> list of dict, list of dict
+    Given the requested ids of a kind of object and the objects Spotify returned for them, this function returns the row for the cache of each id,
+    with empty values for any id Spotify did not return, and the rows of the track artists or artist genres that belong to them.
+    '''
+    rows = []
+    children = []
+    for requested_id, item in zip(ids, objects):
+        item = item or {}
+        row = {"id": requested_id, "fetched_at": fetched_at, "popularity": item.get("popularity")}
+        if kind == "tracks":
+            row["explicit"] = item.get("explicit")
+            children.extend({"track_id": requested_id, "position": position, "artist_id": artist.get("id"), "artist_name": artist.get("name")}
+                            for position, artist in enumerate(item.get("artists", [])))
+        elif kind == "artists":
+            row["name"] = item.get("name")
+            row["followers"] = (item.get("followers") or {}).get("total")
+            children.extend({"artist_id": requested_id, "genre": genre} for genre in item.get("genres", []))
+        else:
+            row["album_type"] = item.get("album_type")
+            row["label"] = item.get("label")
+            row["total_tracks"] = item.get("total_tracks")
+        rows.append(row)
+    return(rows, children)
+
+
+def store_metadata(conn, kind, rows, children):
+    '''(sqlalchemy.engine.Connection, str, list of dict, list of dict) -> Nonetype
+    This function adds the given metadata rows of a kind of object, and the rows belonging to them, to the cache.
+    '''
+    for insert_query, rows_name in INSERT_METADATA_QUERIES[kind]:
+        rows_to_insert = rows if rows_name == "rows" else children
+        if rows_to_insert:
+            conn.exec_driver_sql(insert_query, rows_to_insert)
+
+
+def store_track_objects(track_objects, database_location=None):
+    '''(list of dict, str) -> int
+    This function caches the metadata of full track objects that have already been received, such as those in the recently played response,
+    so that these tracks never need to be requested. Tracks already in the cache are skipped. The number of tracks added is returned.
+    '''
+    tracks = {track["id"]: track for track in track_objects if track and track.get("id")}
+    with get_engine(database_location).begin() as conn:
+        seen = {row[0] for row in conn.exec_driver_sql("SELECT track_id FROM track_metadata")} if tracks else set()
+        ids = [track_id for track_id in tracks if track_id not in seen]
+        rows, children = get_metadata_rows("tracks", ids, [tracks[track_id] for track_id in ids], int(time.time()))
+        store_metadata(conn, "tracks", rows, children)
+    return(len(ids))
+
+
+def fetch_metadata(access_token, kind, ids, max_workers=MAX_CONCURRENT_REQUESTS):
+    '''(str, str, list of str, int) -> list of dict, list of dict
+    This function requests the metadata of the given ids in batches of the largest size Spotify accepts, with at most max_workers requests in flight at once,
+    and returns the rows for the cache.
+    '''
+    batch_size = BATCH_SIZES[kind]
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    rows = []
+    children = []
+    fetched_at = int(time.time())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch, objects in zip(batches, executor.map(lambda batch: get_several(access_token, kind, batch), batches)):
+            batch_rows, batch_children = get_metadata_rows(kind, batch, objects, fetched_at)
+            rows.extend(batch_rows)
+            children.extend(batch_children)
+    return(rows, children)
+
+
+@traced
+def enrich_metadata(access_token, database_location=None, max_workers=MAX_CONCURRENT_REQUESTS):
+    '''(str, str, int) -> dict
+    This function fills in the metadata cache for every track, artist and album in the listening history that has never been seen before.
+    The tracks are fetched first since they name every artist credited on them, including featured artists, whose metadata is then fetched with the rest.
+    The number of ids fetched of each kind is returned.
+    '''
+    engine = get_engine(database_location)
+    num_fetched = {}
+    for kind in ("tracks", "artists", "albums"):
+        with engine.connect() as conn:
+            ids = [row[0] for row in conn.exec_driver_sql(UNSEEN_IDS_QUERIES[kind], {"prefix": NAME_ID_PREFIX})]
+        num_fetched[kind] = len(ids)
+        if not ids:
+            continue
+        rows, children = fetch_metadata(access_token, kind, ids, max_workers)
+        with engine.begin() as conn:
+            store_metadata(conn, kind, rows, children)
+            increment_generation(conn)
+    return(num_fetched)
+
+
+def enrich_loaded_tracks(access_token, raw_data, database_location=None):
+    '''(str, dict, str) -> dict
+    This function enriches the listening history after the given raw data has been loaded, caching the tracks it already contains and fetching the metadata
+    of anything else that has never been seen. A failure to fetch metadata is reported without affecting the load, and None is returned in that case.
+    '''
+    try:
+        store_track_objects([item.get("track") for item in raw_data.get("items", [])], database_location)
+        return(enrich_metadata(access_token, database_location))
+    except requests.RequestException as error:
+        print("The metadata of your tracks could not be fetched: " + str(error))
+        return(None)
+
+
+if __name__ == "__main__":
+    from SpotifyHistory.auth import get_cached_access_token
+    from SpotifyHistory.menu_functions import get_client_creds
+    arg_parser = argparse.ArgumentParser(description="Fetch the metadata of every track, artist and album in your listening history that has not been fetched yet.")
+    arg_parser.add_argument("--database", default=None, help="the database location (default: the default listening history)")
+    args = arg_parser.parse_args()
+    access_token = get_cached_access_token(*get_client_creds())
+    if access_token is not None:
+        num_fetched = enrich_metadata(access_token, args.database)
+        print("Fetched " + ", ".join(str(num) + " " + kind for kind, num in num_fetched.items()) + ".")
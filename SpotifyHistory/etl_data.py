@@ -1,15 +1,51 @@
+from SpotifyHistory.database import DATABASE_LOCATION, NAME_ID_PREFIX, get_engine, get_state, increment_generation
+from SpotifyHistory.heavy_hitters import is_enabled, get_new_plays, count_new_plays
+from SpotifyHistory.sessions import update_sessions
+from SpotifyHistory.instrumentation import traced
 import pandas as pd
-import sqlite3
+import numpy as np
 import sqlalchemy
 import datetime
-import base64
-import json
+import os
 import webbrowser
-from dateutil import parser
-from requests import post, get
+import zoneinfo
+from dateutil import parser, tz
 from urllib.parse import urlencode
 
-DATABASE_LOCATION = "sqlite:///my_listening_history.sqlite"
+# the Spotify API client is imported by the functions that call it, so that importing this module only for its transforms does not import requests
+
+
+# the columns of the dataframe of transformed tracks
+TRACK_COLUMNS = ['played_at', 'track_name', 'artist_name', 'album_name', 'track_id', 'artist_id', 'album_id',
+                 'release_date', 'date_time_played', 'date_played', 'time_played', 'duration_in_ms', 'duration']
+
+# the queries used to add a batch of tracks to the database, paired with the column identifying the rows to upsert. The rows already stored
+# are only updated if their names or release date have changed, so that the number of rows changed tells whether the load changed anything
+UPSERT_DIMENSION_QUERIES = [("""
+    INSERT INTO artists(artist_id, artist_name) VALUES (:artist_id, :artist_name)
+    ON CONFLICT(artist_id) DO UPDATE SET artist_name = excluded.artist_name
+    WHERE artist_name IS NOT excluded.artist_name
+    """, "artist_id"), ("""
+    INSERT INTO albums(album_id, album_name, release_date) VALUES (:album_id, :album_name, :release_date)
+    ON CONFLICT(album_id) DO UPDATE SET album_name = excluded.album_name, release_date = COALESCE(excluded.release_date, release_date)
+    WHERE album_name IS NOT excluded.album_name OR release_date IS NOT COALESCE(excluded.release_date, release_date)
+    """, "album_id"), ("""
+    INSERT INTO tracks(track_id, track_name) VALUES (:track_id, :track_name)
+    ON CONFLICT(track_id) DO UPDATE SET track_name = excluded.track_name
+    WHERE track_name IS NOT excluded.track_name
+    """, "track_id")]
+INSERT_PLAYS_QUERY = """
+    INSERT OR IGNORE INTO plays(played_at, track_key, artist_key, album_key, date_played, hour_played, weekday_played, duration_in_ms)
+    VALUES (:played_at,
+        (SELECT track_key FROM tracks WHERE track_id = :track_id),
+        (SELECT artist_key FROM artists WHERE artist_id = :artist_id),
+        (SELECT album_key FROM albums WHERE album_id = :album_id),
+        :date_played, CAST(substr(:time_played, 1, 2) AS INT), CAST(strftime('%w', :date_played) AS INT), :duration_in_ms)
+    """
+UPDATE_LAST_PLAYED_AT_QUERY = """
+    INSERT OR REPLACE INTO etl_state(name, value)
+    SELECT 'last_played_at', MAX(played_at) FROM plays
+    """
 
 
 def get_today_unix_timestamp():
@@ -21,6 +57,15 @@ def get_today_unix_timestamp():
     return today_unix_timestamp
 
 
+def get_date_unix_timestamp(date):
+    '''(str) -> int
+    Given a date in YYYY-mm-dd format, this function returns the date at midnight local time as a unix timestamp.
+    '''
+    midnight = datetime.datetime.fromisoformat(date)
+    date_unix_timestamp = int(midnight.timestamp()) * 1000
+    return date_unix_timestamp
+
+
 def convert_to_local_time(time_played_utc):
     '''(str) -> str, str
     This function converts the time_played attribute of each track from UTC to local time.
@@ -33,6 +78,14 @@ def convert_to_local_time(time_played_utc):
     return(local_date_time_played, local_date_played, local_time_played)
 
 
+def convert_to_unix_timestamp(time_played_utc):
+    '''(str) -> int
+    This function converts the time_played attribute of each track to a unix timestamp in milliseconds, which uniquely identifies each play.
+    '''
+    utc = parser.parse(time_played_utc)
+    return(round(utc.timestamp() * 1000))
+
+
 def convert_duration(duration_ms):
     '''(int) -> str
     This function converts the duration of a song from milliseconds to minutes and seconds to be displayed to the user.
@@ -55,6 +108,55 @@ def convert_duration(duration_ms):
     return(duration_display)
 
 
+def get_local_timezone():
+    '''() -> tzinfo
+    This function returns the local timezone, as a named timezone where possible so that times can be converted to it all at once.
+    '''
+    # a timezone set by TZ is the one the process uses, where a leading ":" only marks the rest as the zone's name, and any other value,
+    # e.g. a POSIX string such as EST+5, is left to the system to work out
+    zone_name = os.environ.get("TZ")
+    if zone_name is not None:
+        try:
+            return(zoneinfo.ZoneInfo(zone_name[1:] if zone_name.startswith(":") else zone_name))
+        except (ValueError, zoneinfo.ZoneInfoNotFoundError):
+            return(tz.tzlocal())
+    # on most unix systems /etc/localtime is a link to the named timezone's file
+    try:
+        zone_path = os.path.realpath("/etc/localtime")
+        return(zoneinfo.ZoneInfo(zone_path.split("zoneinfo" + os.sep, 1)[1]))
+    except (IndexError, ValueError, zoneinfo.ZoneInfoNotFoundError):
+        return(tz.tzlocal())
+
+
+def convert_times_played(times_played_utc):
+    '''(list of str) -> ndarray, ndarray, ndarray, ndarray
+    This function converts the time_played attribute of many tracks at once, the same way as convert_to_unix_timestamp and convert_to_local_time,
+    returning the unix timestamps in milliseconds, local dates and times, local dates and local times.
+    '''
+    utc = pd.Series(pd.to_datetime(times_played_utc, utc=True, format="ISO8601"))
+    played_at = ((utc - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.int64)
+    # format the local times as YYYY-mm-ddTHH:MM:SS.fff, then treat each as a row of characters to swap in the separators and cut out the date and time
+    local = utc.dt.tz_convert(get_local_timezone()).dt.tz_localize(None)
+    local_strings = np.datetime_as_string(local.to_numpy(dtype="datetime64[ms]"), unit="ms").astype("S23")
+    chars = local_strings.view("S1").reshape(-1, 23).copy()
+    chars[:, 10] = b" "
+    chars[:, 19] = b":"
+    local_date_time_played = chars.view("S23").ravel()
+    local_date_played = np.ascontiguousarray(chars[:, :10]).view("S10").ravel()
+    local_time_played = np.ascontiguousarray(chars[:, 11:]).view("S12").ravel()
+    return(played_at, local_date_time_played.astype(str).astype(object), local_date_played.astype(str).astype(object), local_time_played.astype(str).astype(object))
+
+
+def convert_durations(durations_ms):
+    '''(ndarray of int) -> ndarray of str
+    This function converts the durations of many songs at once from milliseconds to minutes and seconds, the same way as convert_duration.
+    '''
+    # songs are played many times over, so only format each distinct duration once
+    unique_durations, inverse = np.unique(np.asarray(durations_ms, dtype=np.int64), return_inverse=True)
+    unique_labels = np.array([convert_duration(int(duration_ms)) for duration_ms in unique_durations], dtype=object)
+    return(unique_labels[inverse.reshape(-1)])
+
+
 def check_data_is_valid(df):
     '''(Dateframe) -> Boolean
     This function determines whether the data extracted and transformed is in the condition to be loaded into the database.
@@ -65,21 +167,24 @@ def check_data_is_valid(df):
         return False
 
     # check for duplicates
-    if not pd.Series(df['time_played']).is_unique:
+    if not pd.Series(df['played_at']).is_unique:
         raise Exception("Duplicate records found. Try listening to a few songs, then generate a new token.")
 
     return True
 
+
+@traced
 def authorize_user(client_id):
     '''(str) -> str
     This function uses the Spotify Web API to generate an authorization code to validate the user.
     '''
+    from SpotifyHistory.spotify_api import ACCOUNTS_URL, REDIRECT_URI
     # define the url and HTTP headers to send to the url
-    url = "https://accounts.spotify.com/authorize?"
+    url = ACCOUNTS_URL + "/authorize?"
     headers = {
         "client_id": client_id,
         "response_type": "code",
-        "redirect_uri": "http://localhost:8888/callback",
+        "redirect_uri": REDIRECT_URI,
         "scope": "user-read-recently-played"
     }
     # prompt the user to copy and paste the authorization code in the url from the window opened by the API call
@@ -89,28 +194,17 @@ def authorize_user(client_id):
     return(auth_code)
 
 
+@traced
 def get_access_token(client_id, client_secret, auth_code):
     '''(str, str, str) -> str, Boolean
-    Given the client credentials and authorization code, this function uses the Spotify Web API to generate an access token.
+    Given the client credentials and authorization code, this function uses the Spotify Web API to generate an access token,
+    caching it along with its refresh token so that later runs do not need to be authorized again.
     '''
-    # encode the client credentials to base64
-    auth_string = client_id + ":" + client_secret
-    auth_bytes = auth_string.encode("utf-8")
-    auth_base64 = str(base64.b64encode(auth_bytes), "utf-8")
-    # define the url, HTTP headers and additional data to send to the url
-    url = "https://accounts.spotify.com/api/token?"
-    headers = {
-        "Authorization": "Basic " + auth_base64,
-        "Content_Type": "application/x-www-form-urlencoded"
-    }
-    data = {"grant_type": "authorization_code",
-            "code": auth_code,
-            "redirect_uri": "http://localhost:8888/callback"}
-    # request and return the access token
+    from SpotifyHistory.spotify_api import get_token_from_code
+    from SpotifyHistory.auth import save_token
+    # request, cache and return the access token
     try:
-        result = post(url, headers=headers, data=data)
-        json_result = json.loads(result.content)
-        access_token = json_result['access_token']
+        access_token = save_token(client_id, get_token_from_code(client_id, client_secret, auth_code))['access_token']
         return(access_token, False)
     # if the access token could not be retrieved then allow the user to copy and paste a new authorization code
     except:
@@ -118,77 +212,73 @@ def get_access_token(client_id, client_secret, auth_code):
         return("" , True)
 
 
-def extract_todays_tracks(access_token):
-    '''(str) -> dict
-    This function uses an authorization token from Spotify in order to extract the user's listening history from the current day.
+def get_last_played_at(database_location=None):
+    '''(str) -> int
+    This function returns the high-water mark of the given listening history (the default one if none is given), the unix timestamp in milliseconds
+    of the most recent play that has been loaded, or None if nothing has been loaded yet.
     '''
-    # store today's date (at midnight) as a unix timestamp
-    today_unix_timestamp = get_today_unix_timestamp()
-    # define the HTTP headers to send to the url
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
-    }
-    # request, store and return the raw data from the Spotify API
-    r = get(f"https://api.spotify.com/v1/me/player/recently-played?limit=50&after={today_unix_timestamp}", headers = headers)
-    raw_data = r.json()
-    return(raw_data)
+    with get_engine(database_location).connect() as conn:
+        last_played_at = get_state(conn, "last_played_at")
+    return(last_played_at)
+
+
+@traced
+def extract_todays_tracks(access_token, after=None, database_location=None):
+    '''(str, int, str) -> dict
+    This function uses an authorization token from Spotify in order to extract the user's listening history played after the given unix timestamp.
+    By default, only the tracks played since the last load into the given listening history are extracted (or since midnight, if nothing has been loaded yet),
+    following each page of results.
+    '''
+    from SpotifyHistory.spotify_api import get_recently_played
+    # store the time to extract tracks from as a unix timestamp
+    if after is None:
+        after = get_last_played_at(database_location)
+    if after is None:
+        after = get_today_unix_timestamp()
+    # request each page of raw data from the Spotify API until there is no next page
+    return(get_recently_played(access_token, after))
 
 
+@traced
 def transform_todays_tracks(raw_data):
     '''(dict) -> Dataframe, Boolean
     Given the raw data, this function transforms the data, containing the user's listening history for the current day,
     into a dataframe so that today's tracks can be added to the database containing the user's complete listening history.
     '''
-    # initialize the lists of attributes of interest that will be recorded from the raw data
-    # and assume that the data will be transformed into the valid format 
-    track_names, artist_names, album_names, track_ids, artist_ids, album_ids, release_dates, date_time_played, date_played, time_played, duration_in_ms, duration = ([] for i in range(12))
+    # initialize the dictionary of attributes of interest that will be recorded from the raw data
+    # and assume that the data will be transformed into the valid format
+    track_dict = {column: [] for column in TRACK_COLUMNS}
     transform_valid = True
 
-    # loop through each track and append each attribute of the current track to the appropriate list
+    # flatten the items into one list per attribute, then convert the times played and durations of every track at once
     try:
-        for track in raw_data['items']:
-            track_names.append(track['track']['name'])
-            artist_names.append(track['track']['album']['artists'][0]['name'])
-            album_names.append(track['track']['album']['name'])
-            track_ids.append(track['track']['id'])
-            artist_ids.append(track['track']['album']['artists'][0]['id'])
-            album_ids.append(track['track']['album']['id'])
-            release_dates.append(track['track']['album']['release_date'])
-            time_played_utc = track['played_at']
-            local_date_time_played, local_date_played, local_time_played = convert_to_local_time(time_played_utc)
-            date_time_played.append(local_date_time_played)
-            date_played.append(local_date_played)
-            time_played.append(local_time_played)
-            duration_ms = track['track']['duration_ms']
-            duration_in_ms.append(duration_ms)
-            converted_duration = convert_duration(duration_ms)
-            duration.append(converted_duration)
+        items = raw_data['items']
+        tracks = [item['track'] for item in items]
+        albums = [track['album'] for track in tracks]
+        album_artists = [album['artists'][0] for album in albums]
+        track_dict["track_name"] = [track['name'] for track in tracks]
+        track_dict["artist_name"] = [artist['name'] for artist in album_artists]
+        track_dict["album_name"] = [album['name'] for album in albums]
+        track_dict["track_id"] = [track['id'] for track in tracks]
+        track_dict["artist_id"] = [artist['id'] for artist in album_artists]
+        track_dict["album_id"] = [album['id'] for album in albums]
+        track_dict["release_date"] = [album['release_date'] for album in albums]
+        played_at, date_time_played, date_played, time_played = convert_times_played([item['played_at'] for item in items])
+        track_dict["played_at"] = played_at
+        track_dict["date_time_played"] = date_time_played
+        track_dict["date_played"] = date_played
+        track_dict["time_played"] = time_played
+        duration_in_ms = np.array([track['duration_ms'] for track in tracks], dtype=np.int64)
+        track_dict["duration_in_ms"] = duration_in_ms
+        track_dict["duration"] = convert_durations(duration_in_ms)
     # otherwise, notify the user that an invalid token was provided
     except:
         print("There was a problem transforming your data.")
+        track_dict = {column: [] for column in TRACK_COLUMNS}
         transform_valid = False
 
-    # create a dictionary using the created lists
-    track_dict = {
-        "track_name": track_names,
-        "artist_name": artist_names,
-        "album_name": album_names,
-        "track_id": track_ids,
-        "artist_id": artist_ids,
-        "album_id": album_ids,
-        "release_date": release_dates,
-        "date_time_played": date_time_played,
-        "date_played": date_played,
-        "time_played": time_played,
-        "duration_in_ms": duration_in_ms,
-        "duration": duration
-    }
-
     # store the data as a dataframe
-    track_df = pd.DataFrame(track_dict, columns=['track_name', 'artist_name', 'album_name', 'track_id', 'artist_id', 'album_id',
-                                                 'release_date', 'date_time_played', 'date_played', 'time_played', 'duration_in_ms', 'duration'])
+    track_df = pd.DataFrame(track_dict, columns=TRACK_COLUMNS)
 
     # validate and return the data
     if check_data_is_valid(track_df) and transform_valid:
@@ -197,72 +287,89 @@ def transform_todays_tracks(raw_data):
         return track_df, False
 
 
-def load_todays_tracks(track_df):  
-    '''(Dataframe) -> Nonetype
-    This function establishes a connection with the database, creates a new table to store today's listening history and
-    appends the tracks listened to today to the complete listening history.
+def get_row_dicts(batch):
+    '''(Dataframe or iterable of dict) -> list of dict
+    This function returns the rows of a batch of tracks, given either as a dataframe or as dictionaries keyed by the transformed column names.
     '''
-    # establish the sqlalchemy engine, the connection to the database and the cursor to execute SQL commands
-    engine = sqlalchemy.create_engine(DATABASE_LOCATION)
-    conn = sqlite3.connect('my_listening_history.sqlite')
-    cursor = conn.cursor()
-
-    # create a table to store the user's complete listening history if one does not already exist
-    create_query = """
-        CREATE TABLE IF NOT EXISTS complete_listening_history(
-            track_name VARCHAR(200),
-            artist_name VARCHAR(200),
-            album_name VARCHAR(200),
-            track_id VARCHAR(200),
-            artist_id VARCHAR(200),
-            album_id VARCHAR(200),
-            release_date VARCHAR(200),
-            date_time_played VARCHAR(200),
-            date_played VARCHAR(200),
-            time_played VARCHAR(200) PRIMARY KEY,
-            duration_in_ms INT,
-            duration VARCHAR(10)
-        );
-        """
-    cursor.execute(create_query)
-
-        
-    # drop the table containing yesterday's listening history
-    drop_yesterday_query = """
-        DROP TABLE IF EXISTS todays_tracks;
-    """
-    cursor.execute(drop_yesterday_query)
-
-    # create a table to store today's listening history and load today's tracks
-    create_today_query = """
-        CREATE TABLE IF NOT EXISTS todays_tracks(
-            track_name VARCHAR(200),
-            artist_name VARCHAR(200),
-            album_name VARCHAR(200),
-            track_id VARCHAR(200),
-            artist_id VARCHAR(200),
-            album_id VARCHAR(200),
-            release_date VARCHAR(200),
-            date_time_played VARCHAR(200),
-            date_played VARCHAR(200),
-            time_played VARCHAR(200) PRIMARY KEY,
-            duration_in_ms INT,
-            duration VARCHAR(10)
-        );
-    """
-    cursor.execute(create_today_query)
-    try:
-        track_df.to_sql(name='todays_tracks', con=engine, if_exists='append', index=False)
-    except:
-        print("Data not loaded :(")
+    if isinstance(batch, pd.DataFrame):
+        return(batch.to_dict("records"))
+    return(list(batch))
 
-    # add today's tracks to the complete listening history
-    add_todays_tracks_query = """
-        INSERT OR IGNORE INTO complete_listening_history
-        SELECT * FROM todays_tracks;
-    """
-    cursor.execute(add_todays_tracks_query)
 
-    # commit the changes and close the connection to the database
-    conn.commit()
-    conn.close()
+def fill_missing_ids(rows):
+    '''(list of dict) -> list of dict
+    This function returns the rows with an id made up from the names given to each track, artist and album without a Spotify id, e.g. a local file,
+    so that their plays refer to a track, artist and album like any other instead of being stored without them.
+    '''
+    filled_rows = []
+    for row in rows:
+        if isinstance(row["track_id"], str) and isinstance(row["artist_id"], str) and isinstance(row["album_id"], str):
+            filled_rows.append(row)
+            continue
+        artist_name = str(row["artist_name"] or "")
+        album_name = artist_name + "/" + str(row["album_name"] or "")
+        names = {"track_id": album_name + "/" + str(row["track_name"] or ""), "artist_id": artist_name, "album_id": album_name}
+        filled_rows.append(dict(row, **{column: row[column] if isinstance(row[column], str) else NAME_ID_PREFIX + name for column, name in names.items()}))
+    return(filled_rows)
+
+
+@traced
+def load_track_batches(batches, database_location=None, reconcile=None):
+    '''(iterable of Dataframe or iterable of dict, str, function) -> int
+    This function loads each batch of tracks into the given complete listening history (the default one if none is given) as it arrives, upserting the tracks, artists and albums and inserting
+    any plays not already stored, all in a single transaction. The listening sessions and, if they have been built, the approximate most played counters
+    are updated with the new plays in the same transaction. If a reconcile function is given, it is called with the connection and the rows of each batch
+    before they are loaded, and returns the rows to load instead.
+    The number of plays added is returned. If nothing was added or changed, the results of earlier queries and the archive are left as up to date.
+    '''
+    num_added = 0
+    num_changed = 0
+    changed_from = None
+    # borrow a pooled connection from the shared engine and run every statement below in a single transaction
+    with get_engine(database_location).begin() as conn:
+        count_heavy_hitters = is_enabled(conn)
+        for batch in batches:
+            rows = fill_missing_ids(get_row_dicts(batch))
+            if rows and reconcile is not None:
+                rows = reconcile(conn, rows)
+            if not rows:
+                continue
+            # note which plays are new before they are inserted, so that only they are added to the approximate most played counters
+            new_played_at = get_new_plays(conn, rows) if count_heavy_hitters else []
+            # add any new tracks, artists and albums once per batch, updating the names of those already stored
+            for upsert_query, id_column in UPSERT_DIMENSION_QUERIES:
+                dimension_rows = list({row[id_column]: row for row in rows}.values())
+                num_changed += max(conn.exec_driver_sql(upsert_query, dimension_rows).rowcount, 0)
+            # add the plays by the keys of their track, artist and album
+            result = conn.exec_driver_sql(INSERT_PLAYS_QUERY, rows)
+            num_added += max(result.rowcount, 0)
+            # note the oldest play loaded, since the listening sessions have to be split again from there
+            oldest_played_at = min(int(row["played_at"]) for row in rows)
+            changed_from = oldest_played_at if changed_from is None else min(changed_from, oldest_played_at)
+            count_new_plays(conn, new_played_at)
+
+        # move the high-water mark up to the most recent play now in the history, extend the listening sessions with the new plays
+        # and mark any cached query results as out of date, along with the archive if any plays were added
+        conn.exec_driver_sql(UPDATE_LAST_PLAYED_AT_QUERY)
+        update_sessions(conn, changed_from)
+        if num_added or num_changed:
+            increment_generation(conn, plays_changed=num_added > 0)
+
+    return(num_added)
+
+
+@traced
+def load_todays_tracks(track_df, database_location=None):
+    '''(Dataframe, str) -> int
+    This function establishes a connection with the database, appends the tracks listened to today to the given complete listening history
+    (the default one if none is given), updates its archive and returns the number of new plays added.
+    '''
+    from SpotifyHistory.archive import refresh_archive
+    try:
+        num_added = load_track_batches([track_df], database_location)
+    except sqlalchemy.exc.DBAPIError:
+        print("Data not loaded :(")
+        return(0)
+    # bring the columnar archive up to date with the new plays, if it has been created
+    refresh_archive(database_location)
+    return(num_added)
@@ -0,0 +1,188 @@
+from SpotifyHistory import database
+from SpotifyHistory.database import ROLLUP_DIMENSIONS, get_engine, get_state, set_state, increment_generation
+import argparse
+import json
+import numpy as np
+
+# the number of counters kept for each dimension and window. Any track, artist or album played more than 1/(CAPACITY + 1) of the plays in a window
+# is guaranteed to have a counter, and each count is over by at most the number of plays in the window divided by CAPACITY + 1
+CAPACITY = 200
+
+# the windows the plays are counted over, each starting on the first day of its year or month, or on the Sunday of its week. The all time counts
+# are not approximated, since the number of plays of every track, artist and album is already kept exactly in the summary tables
+PERIODS = ("year", "month", "week")
+
+# the names of the ETL state values recording that the counters are kept up to date as plays are loaded, and how many counters are kept
+ENABLED_STATE = "heavy_hitters_enabled"
+CAPACITY_STATE = "heavy_hitters_capacity"
+
+# the number of plays read at a time when the counters are built from the existing listening history
+BUILD_CHUNK_SIZE = 100000
+
+EXISTING_PLAYS_QUERY = """
+    SELECT played_at FROM plays WHERE played_at IN (SELECT value FROM json_each(:played_at))
+    """
+PLAY_KEYS_QUERY = """
+    SELECT played_at, track_key, artist_key, album_key, date_played FROM plays WHERE played_at IN (SELECT value FROM json_each(:played_at))
+    """
+PLAYS_CHUNK_QUERY = """
+    SELECT played_at, track_key, artist_key, album_key, date_played FROM plays WHERE played_at > :after ORDER BY played_at LIMIT :limit
+    """
+COUNTERS_QUERY = """
+    SELECT item_key, num_plays - max_overcount FROM heavy_hitters
+    WHERE dimension = :dimension AND period = :period AND period_start = :period_start
+    """
+TOTAL_QUERY = """
+    SELECT num_plays, max_overcount FROM heavy_hitters_totals
+    WHERE dimension = :dimension AND period = :period AND period_start = :period_start
+    """
+DELETE_COUNTERS_QUERY = """
+    DELETE FROM heavy_hitters WHERE dimension = :dimension AND period = :period AND period_start = :period_start
+    """
+INSERT_COUNTER_QUERY = """
+    INSERT INTO heavy_hitters(dimension, period, period_start, item_key, num_plays, max_overcount)
+    VALUES (:dimension, :period, :period_start, :item_key, :num_plays, :max_overcount)
+    """
+SET_TOTAL_QUERY = """
+    INSERT OR REPLACE INTO heavy_hitters_totals(dimension, period, period_start, num_plays, max_overcount)
+    VALUES (:dimension, :period, :period_start, :num_plays, :max_overcount)
+    """
+
+
+def get_period_starts(period, dates):
+    '''(str, ndarray) -> ndarray
+    Given a period and an array of dates, this function returns the first date of the window of that period each date falls in, in YYYY-mm-dd format.
+    '''
+    if period not in PERIODS:
+        raise ValueError("Invalid period: " + str(period))
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    if period == "week":
+        # 1970-01-01 was a Thursday, so this is the number of days since the Sunday of each date's week
+        starts = dates - (dates.astype(np.int64) + 4) % 7
+    else:
+        starts = dates.astype("datetime64[Y]" if period == "year" else "datetime64[M]").astype("datetime64[D]")
+    return(starts.astype("<U10"))
+
+
+def get_window_bounds(period, date):
+    '''(str, str) -> str, str
+    Given a period and a date, this function returns the first and last dates of the window of that period the date falls in.
+    '''
+    start = np.datetime64(get_period_starts(period, [date])[0], "D")
+    if period == "week":
+        end = start + 6
+    else:
+        unit = "Y" if period == "year" else "M"
+        end = (start.astype("datetime64[" + unit + "]") + 1).astype("datetime64[D]") - 1
+    return(str(start), str(end))
+
+
+def merge_counters(item_keys, counts, new_item_keys, new_counts, capacity):
+    '''(ndarray, ndarray, ndarray, ndarray, int) -> ndarray, ndarray, int
+    This function adds the number of plays of each of a batch of items to a window's counters, keeping at most capacity counters, as in the Misra-Gries
+    frequent items summary (the counterpart of Space-Saving, which merges a whole batch at once). The counts are added together, and if there are then more items
+    than counters, the count of the item just outside the top capacity items is taken off every count and the items left with none are dropped.
+    Each count is then at most the amount taken off the window so far under the item's true number of plays. The kept items, their counts and the amount
+    taken off are returned.
+    '''
+    item_keys, positions = np.unique(np.concatenate([item_keys, new_item_keys]), return_inverse=True)
+    counts = np.bincount(positions, weights=np.concatenate([counts, new_counts])).astype(np.int64)
+    if len(counts) <= capacity:
+        return(item_keys, counts, 0)
+    taken_off = int(np.partition(counts, len(counts) - capacity - 1)[len(counts) - capacity - 1])
+    counts = counts - taken_off
+    kept = counts > 0
+    return(item_keys[kept], counts[kept], taken_off)
+
+
+def count_plays(conn, plays, capacity):
+    '''(sqlalchemy.engine.Connection, dict of ndarray, int) -> Nonetype
+    Given the keys and dates of plays that have not been counted yet, this function adds them to the counters and totals of every dimension and window they fall in.
+    Only the counters of the windows the plays fall in are read and written. Each counter is stored with the most its count can be over by,
+    since the count stored is the highest number of plays the item can have had.
+    '''
+    for period in PERIODS:
+        period_starts = get_period_starts(period, plays["date_played"])
+        for period_start in np.unique(period_starts):
+            in_window = period_starts == period_start
+            for table, key in ROLLUP_DIMENSIONS:
+                params = {"dimension": table, "period": period, "period_start": str(period_start)}
+                rows = conn.exec_driver_sql(COUNTERS_QUERY, params).all()
+                num_plays, max_overcount = conn.exec_driver_sql(TOTAL_QUERY, params).one_or_none() or (0, 0)
+                new_item_keys, new_counts = np.unique(plays[key][in_window], return_counts=True)
+                item_keys, counts, taken_off = merge_counters(np.array([row[0] for row in rows], dtype=np.int64), np.array([row[1] for row in rows], dtype=np.int64),
+                                                              new_item_keys, new_counts, capacity)
+                max_overcount += taken_off
+                conn.exec_driver_sql(DELETE_COUNTERS_QUERY, params)
+                conn.exec_driver_sql(INSERT_COUNTER_QUERY, [dict(params, item_key=int(item_key), num_plays=int(count) + max_overcount, max_overcount=max_overcount)
+                                                            for item_key, count in zip(item_keys, counts)])
+                conn.exec_driver_sql(SET_TOTAL_QUERY, dict(params, num_plays=num_plays + int(in_window.sum()), max_overcount=max_overcount))
+
+
+def get_play_arrays(rows):
+    '''(list of tuple) -> dict of ndarray
+    This function returns the keys and dates of the given rows of plays as arrays.
+    '''
+    columns = list(zip(*rows))
+    return({"track_key": np.array(columns[1], dtype=np.int64), "artist_key": np.array(columns[2], dtype=np.int64),
+            "album_key": np.array(columns[3], dtype=np.int64), "date_played": np.array(columns[4], dtype="datetime64[D]")})
+
+
+def is_enabled(conn):
+    '''(sqlalchemy.engine.Connection) -> Boolean
+    This function returns whether the counters are kept up to date as plays are loaded into the database.
+    '''
+    return(bool(get_state(conn, ENABLED_STATE, 0)))
+
+
+def get_new_plays(conn, rows):
+    '''(sqlalchemy.engine.Connection, list of dict) -> list of int
+    Given the rows of a batch of tracks about to be loaded, this function returns the times played of those that are not in the database yet,
+    which are the plays the batch will add.
+    '''
+    played_at = sorted({int(row["played_at"]) for row in rows})
+    existing = {row[0] for row in conn.exec_driver_sql(EXISTING_PLAYS_QUERY, {"played_at": json.dumps(played_at)})}
+    return([time_played for time_played in played_at if time_played not in existing])
+
+
+def count_new_plays(conn, new_played_at):
+    '''(sqlalchemy.engine.Connection, list of int) -> Nonetype
+    Given the times played of plays that have just been loaded, this function adds them to the counters, inside the transaction that loaded them.
+    '''
+    if not new_played_at:
+        return
+    rows = conn.exec_driver_sql(PLAY_KEYS_QUERY, {"played_at": json.dumps(new_played_at)}).all()
+    if rows:
+        count_plays(conn, get_play_arrays(rows), get_state(conn, CAPACITY_STATE, CAPACITY))
+
+
+def build_heavy_hitters(database_location=None, capacity=CAPACITY, chunk_size=BUILD_CHUNK_SIZE):
+    '''(str, int, int) -> int
+    This function counts every play in the given database (the default database if none is given) into new counters with the given capacity for each window,
+    reading the plays a chunk at a time, oldest first, and then keeps the counters up to date as plays are loaded. The number of plays counted is returned.
+    '''
+    num_counted = 0
+    with get_engine(database_location).begin() as conn:
+        conn.exec_driver_sql("DELETE FROM heavy_hitters")
+        conn.exec_driver_sql("DELETE FROM heavy_hitters_totals")
+        after = -1
+        while True:
+            rows = conn.exec_driver_sql(PLAYS_CHUNK_QUERY, {"after": after, "limit": chunk_size}).all()
+            if not rows:
+                break
+            count_plays(conn, get_play_arrays(rows), capacity)
+            num_counted += len(rows)
+            after = rows[-1][0]
+        set_state(conn, ENABLED_STATE, 1)
+        set_state(conn, CAPACITY_STATE, capacity)
+        increment_generation(conn)
+    return(num_counted)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Count the approximate most played tracks, artists and albums of every year, month and week of your listening history, "
+                                                     "and keep them up to date as tracks are loaded.")
+    arg_parser.add_argument("--database", default=None, help="the database location (default: " + database.DATABASE_LOCATION + ")")
+    arg_parser.add_argument("--capacity", type=int, default=CAPACITY, help="the number of counters kept for each window (default: " + str(CAPACITY) + ")")
+    args = arg_parser.parse_args()
+    print("Counted " + str(build_heavy_hitters(args.database, args.capacity)) + " plays.")
@@ -0,0 +1,229 @@
+from SpotifyHistory.archive import refresh_archive
+from SpotifyHistory.etl_data import NAME_ID_PREFIX, TRACK_COLUMNS, convert_times_played, convert_durations, load_track_batches
+from SpotifyHistory.instrumentation import traced
+import argparse
+import codecs
+import collections
+import concurrent.futures
+import glob
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+
+# the pattern matching the files of audio plays in Spotify's extended streaming history export
+HISTORY_FILE_PATTERN = "Streaming_History_Audio_*.json"
+
+# the number of records transformed and loaded together, and the number of characters read from a file at a time
+CHUNK_SIZE = 10000
+READ_SIZE = 1 << 20
+
+# the characters allowed between the elements of a json array
+ARRAY_SEPARATOR = re.compile(r"[\s,]*")
+
+# the export only records the second each play ended, so a play of the same track loaded from the Spotify API is taken to be the same play
+# if it ended less than the time the track was played for apart, and at least this many milliseconds apart
+MATCH_WINDOW_MS = 1000
+
+# find the plays of a chunk that were already loaded from the Spotify API, which are recorded to the millisecond. Plays already loaded from the export
+# are recorded to the second and are only the same play at exactly the same time, which is already ignored as the same key
+MATCHING_PLAYS_QUERY = """
+    SELECT b.key
+    FROM json_each(:plays) AS b
+    JOIN tracks AS t ON t.track_id = json_extract(b.value, '$[1]')
+    WHERE EXISTS (
+        SELECT 1 FROM plays AS p
+        WHERE p.track_key = t.track_key AND p.played_at % 1000 <> 0
+            AND p.played_at > json_extract(b.value, '$[0]') - json_extract(b.value, '$[2]')
+            AND p.played_at < json_extract(b.value, '$[0]') + json_extract(b.value, '$[2]')
+    )
+    """
+# the artists and albums stored under their Spotify ids, the most played artist last where several share a name
+EXISTING_ARTISTS_QUERY = """
+    SELECT ar.artist_name, ar.artist_key, ar.artist_id
+    FROM artists AS ar
+    LEFT JOIN artists_counts AS c ON c.artist_key = ar.artist_key
+    WHERE ar.artist_id NOT LIKE :prefix || '%'
+    ORDER BY COALESCE(c.num_plays, 0)
+    """
+EXISTING_ALBUMS_QUERY = """
+    SELECT album_name, album_key, album_id FROM albums WHERE album_id NOT LIKE :prefix || '%'
+    """
+ALBUM_PLAYED_BY_QUERY = """
+    SELECT 1 FROM plays WHERE album_key = ? AND artist_key = ? LIMIT 1
+    """
+
+
+def find_history_files(paths):
+    '''(list of str) -> list of str
+    Given a list of files and directories, this function returns the files of the streaming history export, searching each directory for them.
+    '''
+    history_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            history_files.extend(sorted(glob.glob(os.path.join(path, "**", HISTORY_FILE_PATTERN), recursive=True)))
+        else:
+            history_files.append(path)
+    return(history_files)
+
+
+def read_json_array_chunk(path, offset=None, num_records=CHUNK_SIZE, read_size=READ_SIZE):
+    '''(str, int, int, int) -> list of dict, int
+    This function reads up to the given number of elements of the json array stored in the given file, starting from the given byte offset
+    (the start of the array if none is given) and reading only a block of the file at a time, so that memory use does not grow with the size of the file.
+    The elements are returned with the byte offset the next ones start from, or None once the end of the array has been reached.
+    '''
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    records = []
+    with open(path, "rb") as f:
+        # the byte offset of the start of the buffer, which is only worked out again when the buffer is cut
+        base = offset or 0
+        f.seek(base)
+        buffer = utf8.decode(f.read(read_size))
+        pos = 0
+        if offset is None:
+            pos = len(buffer) - len(buffer.lstrip())
+            if not buffer.startswith("[", pos):
+                raise ValueError(path + " does not contain a json array.")
+            pos += 1
+        while len(records) < num_records:
+            pos = ARRAY_SEPARATOR.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return(records, None)
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            # if the element runs past the end of the buffer, keep what is left of the buffer and read the next block
+            except json.JSONDecodeError:
+                block = f.read(read_size)
+                if not block:
+                    raise
+                base += len(buffer[:pos].encode("utf-8"))
+                buffer = buffer[pos:] + utf8.decode(block)
+                pos = 0
+                continue
+            records.append(record)
+    return(records, base + len(buffer[:pos].encode("utf-8")))
+
+
+def transform_streaming_history(records):
+    '''(list of dict) -> Dataframe
+    Given records from the streaming history export, this function transforms the plays of tracks into a dataframe with the same columns
+    as today's tracks, skipping podcasts, audiobooks and anything else that is not a track. The export does not include artist or album ids or release dates,
+    so the artists and albums are identified by their names instead, until reconcile_with_history matches them to the ids already stored.
+    '''
+    records = [record for record in records if record.get("spotify_track_uri") and record.get("master_metadata_track_name")]
+    track_dict = {}
+    track_dict["track_name"] = [record["master_metadata_track_name"] for record in records]
+    track_dict["artist_name"] = [record["master_metadata_album_artist_name"] for record in records]
+    track_dict["album_name"] = [record["master_metadata_album_album_name"] for record in records]
+    track_dict["track_id"] = [record["spotify_track_uri"].split(":")[-1] for record in records]
+    track_dict["artist_id"] = [NAME_ID_PREFIX + str(artist_name) for artist_name in track_dict["artist_name"]]
+    track_dict["album_id"] = [NAME_ID_PREFIX + str(artist_name) + "/" + str(album_name) for artist_name, album_name in zip(track_dict["artist_name"], track_dict["album_name"])]
+    track_dict["release_date"] = [None] * len(records)
+    played_at, date_time_played, date_played, time_played = convert_times_played([record["ts"] for record in records])
+    track_dict["played_at"] = played_at
+    track_dict["date_time_played"] = date_time_played
+    track_dict["date_played"] = date_played
+    track_dict["time_played"] = time_played
+    # the duration of each play is the time the track was actually played for
+    duration_in_ms = np.array([record["ms_played"] for record in records], dtype=np.int64)
+    track_dict["duration_in_ms"] = duration_in_ms
+    track_dict["duration"] = convert_durations(duration_in_ms)
+    return(pd.DataFrame(track_dict, columns=TRACK_COLUMNS))
+
+
+def reconcile_with_history(conn, rows):
+    '''(sqlalchemy.engine.Connection, list of dict) -> list of dict
+    Given the rows of a chunk of the export about to be loaded, this function drops the plays that were already loaded from the Spotify API
+    and returns the rest. The artists and albums the export only identifies by name are given the ids they are already stored under, where an artist
+    of that name has been loaded from the Spotify API, and an album of that name has been played by that artist.
+    '''
+    plays = [[int(row["played_at"]), row["track_id"], max(int(row["duration_in_ms"]), MATCH_WINDOW_MS)] for row in rows]
+    matched = {row[0] for row in conn.exec_driver_sql(MATCHING_PLAYS_QUERY, {"plays": json.dumps(plays)})}
+    rows = [row for i, row in enumerate(rows) if i not in matched]
+    artists = {artist_name: (artist_key, artist_id) for artist_name, artist_key, artist_id in conn.exec_driver_sql(EXISTING_ARTISTS_QUERY, {"prefix": NAME_ID_PREFIX})}
+    albums = collections.defaultdict(list)
+    for album_name, album_key, album_id in conn.exec_driver_sql(EXISTING_ALBUMS_QUERY, {"prefix": NAME_ID_PREFIX}):
+        albums[album_name].append((album_key, album_id))
+    # look up each album once per artist, checking which of the albums with its name that artist has been played on
+    album_ids = {}
+    for row in rows:
+        if row["artist_name"] not in artists:
+            continue
+        artist_key, row["artist_id"] = artists[row["artist_name"]]
+        album = (artist_key, row["album_name"])
+        if album not in album_ids:
+            album_ids[album] = next((album_id for album_key, album_id in albums.get(row["album_name"], [])
+                                     if conn.exec_driver_sql(ALBUM_PLAYED_BY_QUERY, (album_key, artist_key)).first()), None)
+        if album_ids[album] is not None:
+            row["album_id"] = album_ids[album]
+    return(rows)
+
+
+def transform_history_chunk(path, offset=None, chunk_size=CHUNK_SIZE):
+    '''(str, int, int) -> str, Dataframe, int
+    This function reads and transforms the chunk of records starting at the given byte offset of the given file of the streaming history export,
+    returning the path, the dataframe of the chunk and the offset of the next chunk, or None if it was the last. It is run in a separate process
+    for each chunk, so that only a chunk of any file is held in memory or sent back at once.
+    '''
+    records, next_offset = read_json_array_chunk(path, offset, chunk_size)
+    return(path, transform_streaming_history(records), next_offset)
+
+
+@traced
+def import_streaming_history(paths, processes=None, chunk_size=CHUNK_SIZE):
+    '''(list of str, int, int) -> int
+    This function imports every file of the streaming history export found in the given files and directories into the complete listening history.
+    The files are read and transformed a chunk at a time in a pool of processes, with only a few more chunks in progress than there are processes
+    so that memory stays bounded however large the files are. Each chunk is loaded in its own transaction as soon as it arrives, while the next chunk
+    of its file is read. The total number of plays added is returned.
+    '''
+    history_files = find_history_files(paths)
+    if not history_files:
+        print("No streaming history files found.")
+        return(0)
+    processes = processes or os.cpu_count() or 1
+    total_added = 0
+    num_done = 0
+    num_chunks = collections.Counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = set()
+        remaining = iter(history_files)
+        while True:
+            # keep at most two chunks per process read or being read, starting on the next file whenever one has been read to the end
+            while len(pending) < processes * 2:
+                path = next(remaining, None)
+                if path is None:
+                    break
+                pending.add(executor.submit(transform_history_chunk, path, None, chunk_size))
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path, chunk_df, next_offset = future.result()
+                # start reading the next chunk of the file before this one is loaded
+                if next_offset is not None:
+                    pending.add(executor.submit(transform_history_chunk, path, next_offset, chunk_size))
+                else:
+                    num_done += 1
+                num_added = load_track_batches([chunk_df], reconcile=reconcile_with_history) if len(chunk_df) else 0
+                total_added += num_added
+                num_chunks[path] += 1
+                print("[" + str(num_done) + "/" + str(len(history_files)) + " files] " + os.path.basename(path) + ", chunk " + str(num_chunks[path]) + ": "
+                      + str(len(chunk_df)) + " tracks read, " + str(num_added) + " new plays added")
+    # bring the columnar archive up to date once every file has been loaded, rather than after each chunk
+    if total_added:
+        refresh_archive()
+    print("Imported " + str(total_added) + " plays from " + str(len(history_files)) + " files.")
+    return(total_added)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Import Spotify's extended streaming history export into your listening history.")
+    arg_parser.add_argument("paths", nargs="+", help="the " + HISTORY_FILE_PATTERN + " files, or the folders containing them")
+    arg_parser.add_argument("--processes", type=int, default=None, help="the number of files to parse at once (default: the number of CPUs)")
+    arg_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="the number of plays transformed and loaded together")
+    args = arg_parser.parse_args()
+    import_streaming_history(args.paths, args.processes, args.chunk_size)
@@ -0,0 +1,122 @@
+from SpotifyHistory.etl_data import extract_todays_tracks, transform_todays_tracks, load_todays_tracks
+from SpotifyHistory.spotify_api import refresh_access_token
+from SpotifyHistory.enrich import enrich_loaded_tracks
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+
+# the file listing the accounts to ingest, a json list of profiles each with a "name", "client_id", "client_secret" and "refresh_token",
+# and optionally the "database" its listening history is stored in
+PROFILES_LOCATION = "profiles.json"
+
+# the listening history of each profile is kept in its own database unless the profile names one
+PROFILE_DATABASE_LOCATION = "sqlite:///my_listening_history_{name}.sqlite"
+
+# the number of accounts ingested at once
+MAX_WORKERS = 4
+
+# the characters allowed in a profile's name, since it becomes part of the name of its database file
+PROFILE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def load_profiles(path=PROFILES_LOCATION):
+    '''(str) -> list of dict
+    This function reads the profiles of the accounts to ingest from the given file, checking that each has what is needed to ingest it.
+    '''
+    with open(path) as f:
+        profiles = json.load(f)
+    names = set()
+    for profile in profiles:
+        missing = [key for key in ("name", "client_id", "client_secret", "refresh_token") if not profile.get(key)]
+        if missing:
+            raise ValueError("Profile " + str(profile.get("name")) + " is missing " + ", ".join(missing) + ".")
+        if not PROFILE_NAME_PATTERN.match(profile["name"]):
+            raise ValueError("Invalid profile name: " + profile["name"])
+        if profile["name"] in names:
+            raise ValueError("Duplicate profile name: " + profile["name"])
+        names.add(profile["name"])
+    return(profiles)
+
+
+def save_profiles(profiles, path=PROFILES_LOCATION):
+    '''(list of dict, str) -> Nonetype
+    This function writes the profiles back to the given file, e.g. after Spotify has replaced a refresh token, readable only by the current user
+    since it holds each account's credentials.
+    '''
+    temp_path = path + ".tmp"
+    with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(profiles, f, indent=4)
+    os.replace(temp_path, path)
+
+
+def get_profile_database(profile):
+    '''(dict) -> str
+    This function returns the location of the database holding the given profile's listening history.
+    '''
+    return(profile.get("database") or PROFILE_DATABASE_LOCATION.format(name=profile["name"]))
+
+
+def ingest_profile(profile):
+    '''(dict) -> dict
+    This function extracts, transforms and loads the tracks played by the given profile's account since its last load into the profile's own database,
+    and fetches the metadata of anything never seen before, returning the number of new plays added, or the error that stopped the ingestion. A refresh token replaced by Spotify is stored in the profile.
+    '''
+    result = {"name": profile["name"], "plays_added": None, "error": None}
+    try:
+        token = refresh_access_token(profile["client_id"], profile["client_secret"], profile["refresh_token"])
+        if "access_token" not in token:
+            result["error"] = "Could not refresh the access token: " + str(token.get("error_description") or token.get("error"))
+            return(result)
+        if token.get("refresh_token"):
+            profile["refresh_token"] = token["refresh_token"]
+        database_location = get_profile_database(profile)
+        raw_data = extract_todays_tracks(token["access_token"], database_location=database_location)
+        track_df, data_valid = transform_todays_tracks(raw_data)
+        result["plays_added"] = load_todays_tracks(track_df, database_location) if data_valid else 0
+        if data_valid:
+            enrich_loaded_tracks(token["access_token"], raw_data, database_location)
+    # an error ingesting one account is reported without stopping the others
+    except Exception as error:
+        result["error"] = type(error).__name__ + ": " + str(error)
+    return(result)
+
+
+def ingest_profiles(profiles, max_workers=MAX_WORKERS):
+    '''(list of dict, int) -> list of dict
+    This function ingests every profile's account concurrently in a bounded pool of threads, each of which reuses its own pooled keep-alive connections
+    to Spotify and backs off on its own when its account is rate limited. The result of each profile is returned in the order the profiles were given.
+    '''
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(ingest_profile, profiles))
+    return(results)
+
+
+def ingest_profiles_file(path=PROFILES_LOCATION, max_workers=MAX_WORKERS):
+    '''(str, int) -> list of dict
+    This function ingests every profile in the given file, saving any refresh tokens Spotify replaced so that the next run can use them,
+    and returns the result of each profile.
+    '''
+    profiles = load_profiles(path)
+    refresh_tokens = [profile["refresh_token"] for profile in profiles]
+    results = ingest_profiles(profiles, max_workers)
+    if [profile["refresh_token"] for profile in profiles] != refresh_tokens:
+        save_profiles(profiles, path)
+    return(results)
+
+
+def format_result(result):
+    '''(dict) -> str
+    This function describes the outcome of ingesting a profile.
+    '''
+    return(result["name"] + ": " + (result["error"] or str(result["plays_added"]) + " new plays loaded"))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Add the tracks played since the last load by every account in the profiles file to its own listening history.")
+    arg_parser.add_argument("--profiles", default=PROFILES_LOCATION, help="the profiles file (default: " + PROFILES_LOCATION + ")")
+    arg_parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="the number of accounts ingested at once (default: " + str(MAX_WORKERS) + ")")
+    args = arg_parser.parse_args()
+    for result in ingest_profiles_file(args.profiles, args.workers):
+        print(format_result(result))
@@ -0,0 +1,221 @@
+import argparse
+import atexit
+import contextlib
+import contextvars
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+
+# the file a json line is appended to as each span ends, and the file the profile of the whole run is saved to, if these environment variables are set
+METRICS_LOCATION_VARIABLE = "SPOTIFY_HISTORY_METRICS"
+PROFILE_LOCATION_VARIABLE = "SPOTIFY_HISTORY_PROFILE"
+
+# the counters every span records, even when nothing was counted, and the number of decimal places times in milliseconds are kept to
+SPAN_COUNTERS = ("sql_statements", "sql_ms")
+DECIMAL_PLACES = 3
+
+# the spans that are open in the current thread, innermost last. Each thread starts with none, so the spans of threads run concurrently are kept apart
+_open_spans = contextvars.ContextVar("open_spans", default=())
+
+# the metrics file, the id of this run written with every span and the profiler, each None until they are enabled, and the lock held while a span is written
+_state = {"metrics_file": None, "run": None, "profiler": None}
+_write_lock = threading.Lock()
+
+
+def is_enabled():
+    '''() -> Boolean
+    This function returns whether spans are being written to a metrics file.
+    '''
+    return(_state["metrics_file"] is not None)
+
+
+def enable_metrics(path):
+    '''(str) -> Nonetype
+    This function starts appending a json line to the given file as each span ends, counting the SQL statements run by every engine and the time they take.
+    '''
+    import sqlalchemy
+    if is_enabled():
+        return
+    _state["metrics_file"] = open(path, "a", buffering=1)
+    _state["run"] = str(os.getpid()) + "-" + str(time.time_ns())
+    sqlalchemy.event.listen(sqlalchemy.engine.Engine, "before_cursor_execute", before_cursor_execute)
+    sqlalchemy.event.listen(sqlalchemy.engine.Engine, "after_cursor_execute", after_cursor_execute)
+    atexit.register(disable_metrics)
+
+
+def disable_metrics():
+    '''() -> Nonetype
+    This function stops writing spans and closes the metrics file.
+    '''
+    import sqlalchemy
+    if not is_enabled():
+        return
+    sqlalchemy.event.remove(sqlalchemy.engine.Engine, "before_cursor_execute", before_cursor_execute)
+    sqlalchemy.event.remove(sqlalchemy.engine.Engine, "after_cursor_execute", after_cursor_execute)
+    with _write_lock:
+        _state["metrics_file"].close()
+        _state["metrics_file"] = None
+
+
+def enable_profiling(path):
+    '''(str) -> Nonetype
+    This function profiles the rest of the run with cProfile, saving the statistics to the given file when the process exits,
+    which can be read with "python -m pstats". Only the thread that enabled the profiler is profiled.
+    '''
+    import cProfile
+    if _state["profiler"] is not None:
+        return
+    _state["profiler"] = cProfile.Profile()
+    _state["profiler"].enable()
+    atexit.register(save_profile, path)
+
+
+def save_profile(path):
+    '''(str) -> Nonetype
+    This function stops the profiler and saves its statistics to the given file.
+    '''
+    profiler = _state["profiler"]
+    if profiler is None:
+        return
+    profiler.disable()
+    profiler.dump_stats(path)
+    _state["profiler"] = None
+
+
+def record(**counts):
+    '''(**int or float) -> Nonetype
+    This function adds the given counts to every open span, so that each span also counts the work of the spans inside it.
+    '''
+    for open_span in _open_spans.get():
+        for name, count in counts.items():
+            open_span[name] = open_span.get(name, 0) + count
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    '''(sqlalchemy.engine.Connection, sqlite3.Cursor, str, object, sqlalchemy.engine.ExecutionContext, Boolean) -> Nonetype
+    This function notes the time each SQL statement starts, on a stack since a statement can be run while another is being executed.
+    '''
+    conn.info.setdefault("statement_start_times", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    '''(sqlalchemy.engine.Connection, sqlite3.Cursor, str, object, sqlalchemy.engine.ExecutionContext, Boolean) -> Nonetype
+    This function adds each SQL statement that has been run, the time it took and the number of rows it changed to the open spans.
+    '''
+    elapsed_ms = (time.perf_counter() - conn.info["statement_start_times"].pop()) * 1000
+    record(sql_statements=1, sql_ms=elapsed_ms, rows_changed=max(cursor.rowcount, 0))
+
+
+def get_result_size(result):
+    '''(object) -> dict
+    This function returns the number of rows in the result of a traced function and, for dataframes and arrays, the bytes they take up.
+    A tuple is taken to hold columns, e.g. labels and their values, so its number of rows is the length of its first column.
+    '''
+    if hasattr(result, "memory_usage") and hasattr(result, "columns"):
+        return({"rows": len(result), "result_bytes": int(result.memory_usage(index=True).sum())})
+    if hasattr(result, "nbytes"):
+        return({"rows": len(result) if result.ndim else 1, "result_bytes": int(result.nbytes)})
+    if isinstance(result, dict) and result and all(hasattr(values, "nbytes") for values in result.values()):
+        return({"rows": len(next(iter(result.values()))), "result_bytes": sum(int(values.nbytes) for values in result.values())})
+    if isinstance(result, tuple) and result and hasattr(result[0], "__len__") and not isinstance(result[0], str):
+        return({"rows": len(result[0])})
+    if isinstance(result, (list, dict)):
+        return({"rows": len(result)})
+    return({})
+
+
+def write_span(span_record):
+    '''(dict) -> Nonetype
+    This function appends a span that has ended to the metrics file as a json line.
+    '''
+    line = json.dumps(span_record, default=str)
+    with _write_lock:
+        if _state["metrics_file"] is not None:
+            _state["metrics_file"].write(line + "\n")
+
+
+@contextlib.contextmanager
+def span(name, **fields):
+    '''(str, **object) -> contextmanager of dict
+    This function times the code run inside it as a span with the given name and fields, counting the SQL statements, rows and bytes fetched within it,
+    and writes it to the metrics file when it ends, with the span it was run inside and the exception it ended with, if any. The dict yielded can be given
+    more fields, e.g. the number of rows read. If metrics are not enabled, nothing is counted or written.
+    '''
+    if not is_enabled():
+        yield {}
+        return
+    parents = _open_spans.get()
+    span_record = {"run": _state["run"], "span": name, "parent": parents[-1]["span"] if parents else None, "thread": threading.current_thread().name,
+                   "started_at": datetime.datetime.now().isoformat(timespec="milliseconds"), **fields, **{counter: 0 for counter in SPAN_COUNTERS}}
+    token = _open_spans.set(parents + (span_record,))
+    start = time.perf_counter()
+    try:
+        yield span_record
+    except BaseException as exception:
+        span_record["error"] = type(exception).__name__
+        raise
+    finally:
+        _open_spans.reset(token)
+        span_record["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        for field, value in span_record.items():
+            if isinstance(value, float):
+                span_record[field] = round(value, DECIMAL_PLACES)
+        write_span(span_record)
+
+
+def traced(function):
+    '''(function) -> function
+    This function wraps a stage of the ETL process or a query so that each call is written as a span named after its module and function,
+    with the number of rows it returned. When metrics are not enabled the function is called directly.
+    '''
+    name = function.__module__.rsplit(".", 1)[-1] + "." + function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not is_enabled():
+            return(function(*args, **kwargs))
+        with span(name) as span_record:
+            result = function(*args, **kwargs)
+            span_record.update(get_result_size(result))
+        return(result)
+    return(wrapper)
+
+
+def summarize_metrics(path, run=None):
+    '''(str, str) -> list of dict
+    This function reads the spans in the given metrics file (only those of the given run, if one is given) and returns, for each span name,
+    the number of calls, the total, median and slowest time in milliseconds and the total SQL statements and time, slowest in total first.
+    '''
+    spans = {}
+    with open(path) as f:
+        for line in f:
+            span_record = json.loads(line)
+            if run is None or span_record["run"] == run:
+                spans.setdefault(span_record["span"], []).append(span_record)
+    summary = []
+    for name, span_records in spans.items():
+        elapsed = sorted(span_record["elapsed_ms"] for span_record in span_records)
+        summary.append({"span": name, "calls": len(elapsed), "total_ms": round(sum(elapsed), DECIMAL_PLACES), "median_ms": elapsed[len(elapsed) // 2],
+                        "max_ms": elapsed[-1], "sql_statements": sum(span_record["sql_statements"] for span_record in span_records),
+                        "sql_ms": round(sum(span_record["sql_ms"] for span_record in span_records), DECIMAL_PLACES)})
+    return(sorted(summary, key=lambda row: row["total_ms"], reverse=True))
+
+
+# start writing metrics and profiling as soon as any traced module is imported, if a location has been set for them
+if os.getenv(METRICS_LOCATION_VARIABLE):
+    enable_metrics(os.getenv(METRICS_LOCATION_VARIABLE))
+if os.getenv(PROFILE_LOCATION_VARIABLE):
+    enable_profiling(os.getenv(PROFILE_LOCATION_VARIABLE))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Summarize the time spent in each stage and query from a metrics file, slowest in total first.")
+    arg_parser.add_argument("path", help="the metrics file written by setting " + METRICS_LOCATION_VARIABLE + " or passing --metrics to main.py")
+    arg_parser.add_argument("--run", default=None, help="only summarize the spans of this run (default: every run in the file)")
+    args = arg_parser.parse_args()
+    print("{:<48} {:>7} {:>12} {:>11} {:>11} {:>9} {:>11}".format("span", "calls", "total ms", "median ms", "max ms", "sql", "sql ms"))
+    for row in summarize_metrics(args.path, args.run):
+        print("{span:<48} {calls:>7} {total_ms:>12.1f} {median_ms:>11.2f} {max_ms:>11.2f} {sql_statements:>9} {sql_ms:>11.1f}".format(**row))
@@ -1,58 +1,64 @@
-from SpotifyHistory.etl_data import extract_todays_tracks, transform_todays_tracks, load_todays_tracks, get_access_token, authorize_user, convert_duration
-from SpotifyHistory.view_listening_history import get_days_history, get_most_listened, get_total_duration, plot_daily_duration, plot_weekly_comparison, get_num_songs_by_time, plot_num_songs_by_time
+from SpotifyHistory.instrumentation import traced
 import datetime
-import math
 import os
 import re
-from dotenv import load_dotenv
-from tabulate import tabulate
+
+# the modules that use pandas, sqlalchemy and matplotlib are imported by each option only when it is run,
+# so that the menu is displayed without waiting for libraries the chosen option may never use
+
+# the label of each hour of the day
+TIME_LABELS = ["12:00am", "1:00am", "2:00am", "3:00am", "4:00am", "5:00am", "6:00am", "7:00am", "8:00am", "9:00am", "10:00am", "11:00am",
+               "12:00pm", "1:00pm", "2:00pm", "3:00pm", "4:00pm", "5:00pm", "6:00pm", "7:00pm", "8:00pm", "9:00pm", "10:00pm", "11:00pm"]
 
 
 def main_menu():
-    '''() -> str
-    This function displays the menu options to the user, prompts for and returns the user's selection of one of these options.
+    '''() -> Nonetype
+    This function repeatedly displays the menu options to the user, prompts for the user's selection of one of these options and runs it,
+    until the user chooses to exit. Each option returns here once it is done, so nothing it displayed is kept between options.
     '''
-    # define the list of options
-    options = ['0', '1', '2', '3', '4', '5', '6']
-
-    # display the menu
-    os.system("cls")
-    print("MAIN MENU")
-    print("[1] - Add today's tracks to your all-time history")
-    print("[2] - View your listening history from a certain day")
-    print("[3] - View your most listened to tracks, artists or albums of all time")
-    print("[4] - View your favourite times of day to listen to music")
-    print("[5] - View your listening time for the current week")
-    print("[6] - Compare your last two full weeks of listening history")
-    print("[0] - Exit program")
-
-    # prompt for, store and return the user's selection, ensuring that the input is valid
-    run = True
-    while run:
-        inp = input("Please select one of the options above: ")
-        if inp in options:
-            run = False
-    os.system("cls")
-    if inp == '1':
-        etl_todays_tracks()
-    elif inp == '2':
-        view_days_history()
-    elif inp == '3':
-        view_most_listened()
-    elif inp == '4':
-        view_daily_listening_distribution()
-    elif inp == '5':
-        view_daily_duration_listened()
-    elif inp == '6':
-        compare_previous_two_weeks()
-    elif inp == '0':
-        quit()
+    # define the options and the function that runs each of them
+    options = {
+        '1': etl_todays_tracks,
+        '2': view_days_history,
+        '3': view_most_listened,
+        '4': view_daily_listening_distribution,
+        '5': view_daily_duration_listened,
+        '6': compare_previous_two_weeks,
+        '7': search_listening_history,
+        '8': view_sessions_and_streaks
+    }
+
+    while True:
+        # display the menu
+        os.system("cls")
+        print("MAIN MENU")
+        print("[1] - Add today's tracks to your all-time history")
+        print("[2] - View your listening history from a certain day")
+        print("[3] - View your most listened to tracks, artists, albums or genres of all time")
+        print("[4] - View your favourite times of day to listen to music")
+        print("[5] - View your listening time for the current week")
+        print("[6] - Compare your last two full weeks of listening history")
+        print("[7] - Search your tracks, artists and albums by name")
+        print("[8] - View your listening sessions and streaks")
+        print("[0] - Exit program")
+
+        # prompt for and store the user's selection, ensuring that the input is valid
+        run = True
+        while run:
+            inp = input("Please select one of the options above: ")
+            if inp in options or inp == '0':
+                run = False
+        os.system("cls")
+        if inp == '0':
+            return
+        options[inp]()
 
 
 def get_client_creds():
     '''() -> str, str
     This function reads and returns the client credential information from the .env file.
     '''
+    from dotenv import load_dotenv
     load_dotenv()
     client_id = os.getenv("CLIENT_ID")
     client_secret = os.getenv("CLIENT_SECRET")
@@ -74,96 +80,144 @@ def get_week_dates(date):
         date += datetime.timedelta(days=1)
 
 
+def get_week_durations(date):
+    '''(datetime.date) -> list of str, list of int
+    This function returns the dates of the week for the given date and the total time spent listening in milliseconds on each of them.
+    '''
+    from SpotifyHistory.view_listening_history import get_total_durations
+    week_dates = [d for d in get_week_dates(date)]
+    durations_in_ms = get_total_durations(week_dates[0], week_dates[6]).tolist()
+    return(week_dates, durations_in_ms)
+
+
+def get_two_week_durations(date):
+    '''(datetime.date) -> list of list of str, list of list of int
+    This function returns the dates of the two full weeks before the given date's week, starting with the earlier week,
+    and the total time spent listening in milliseconds on each of those dates.
+    '''
+    from SpotifyHistory.view_listening_history import get_total_durations
+    # set the offsets to calculate the dates for the past two weeks
+    offset = [14, 7]
+    # get the dates for each day in the past two full weeks
+    all_dates = [[d for d in get_week_dates(date - datetime.timedelta(days=offset[i]))] for i in range(len(offset))]
+    # get the duration listened for every day of both weeks at once and split the durations by week
+    durations_in_ms = get_total_durations(all_dates[0][0], all_dates[-1][6]).tolist()
+    all_durations_in_ms = [durations_in_ms[i*7:(i+1)*7] for i in range(len(offset))]
+    return(all_dates, all_durations_in_ms)
+
+
 def t_test(durations_one_wk_ago, durations_two_wks_ago):
     '''(list of int, list of int) -> float, float, str
     This function calculates the t-value and determines whether there is a significant difference in the user's last two full weeks of listening time.
     '''
+    from SpotifyHistory.compare_history import paired_t_tests
     # define the null and alternative hypotheses
     hypothesis_null = "Since the calculated t-value is less than the critical t-value, there is no significant difference in your weekly listening times."
     hypothesis_alt = "Since the calculated t-value is greater than the critical t-value, there is a significant difference in your weekly listening times."
-    # since these are undirected hypotheses, with a significance level of 0.05 and degrees of freedom of 7-1=6,
-    # the t_crit value is retreieved from column t_0.975, row 6 of the t-table
-    t_crit = 2.447
-    # calculate the mean of differences in listening times between the two weeks
-    daily_diffs = [dur_1 - dur_2 for (dur_1, dur_2) in zip(durations_one_wk_ago, durations_two_wks_ago)]
-    sample_mean = sum(daily_diffs)/len(daily_diffs)
-    # calculate the standard deviation, standard error and t_value
-    running_sum = 0
-    for diff in daily_diffs:
-        running_sum += (diff-sample_mean)**2
-    std_dev = math.sqrt(running_sum/(len(daily_diffs)-1))
-    std_error = std_dev/math.sqrt(len(daily_diffs))
-    t_stat = round(sample_mean/std_error, 3)
+    # run an undirected paired t-test at a significance level of 0.05, with the critical t-value calculated for the degrees of freedom of the days compared
+    results = paired_t_tests([durations_one_wk_ago], [durations_two_wks_ago])
+    t_stat = round(float(results["t_stat"][0]), 3)
+    t_crit = round(float(results["t_crit"][0]), 3)
     # define the correct hypothesis depending on the calculated t_value
-    result = hypothesis_null if abs(t_stat) < t_crit else hypothesis_alt
+    result = hypothesis_alt if results["significant"][0] else hypothesis_null
     # return the calculated t_value, critical value and outcome
     return(t_stat, t_crit, result)
 
 
+@traced
+def etl_tracks(access_token):
+    '''(str) -> int
+    Given a valid access token, this function extracts the tracks played since the last load, transforms them to the desired format and,
+    once the data is of a proper form, loads it into the database and fetches the metadata of any tracks, artists and albums never seen before.
+    The number of new plays loaded is returned, or None if the data was not valid.
+    '''
+    from SpotifyHistory.etl_data import extract_todays_tracks, transform_todays_tracks, load_todays_tracks
+    from SpotifyHistory.enrich import enrich_loaded_tracks
+    raw_data = extract_todays_tracks(access_token)
+    track_df, data_valid = transform_todays_tracks(raw_data)
+    if not data_valid:
+        return(None)
+    num_added = load_todays_tracks(track_df)
+    enrich_loaded_tracks(access_token, raw_data)
+    return(num_added)
+
+
 def etl_todays_tracks():
     '''() -> Nonetype
-    This function ensures that a valid authorization code and access token are provided and calls each function involved in the ETL process.
+    This function ensures that a valid access token is available, using the cached one or asking the user to authorize access if there is none,
+    and calls each function involved in the ETL process.
     '''
-    # store the client credential information
+    from SpotifyHistory.auth import get_cached_access_token
+    # store the client credential information and get an access token, returning to the main menu if the user quits authorizing access
     client_id, client_secret = get_client_creds()
-    bad_code = True
-    # prompt the user to provide a valid authorization code and ensure that a valid access token is granted
-    while bad_code:
-        auth_code = authorize_user(client_id)
-        if auth_code.lower() == 'quit':
-            bad_code = False
-            break
-        access_token, bad_code = get_access_token(client_id, client_secret, auth_code)
-    # using the valid access token, extract the data and transform it to the desired format
-    if auth_code.lower() != 'quit':
-        raw_data = extract_todays_tracks(access_token)
-        track_df, data_valid = transform_todays_tracks(raw_data)
-        # once the data is of a proper form, load the data into the database
-        if data_valid:
-            load_todays_tracks(track_df)
-            print("Today's tracks successfully loaded!")
-            input("Press [Enter] to return to the main menu: ")
-        else:
-            print("Today's tracks were not loaded!")
-            print("It looks like there were no new songs to add.")
-            print("Try listening to a few songs, then try again.")
-            print("Returning to main menu.")
-    main_menu()
+    access_token = get_cached_access_token(client_id, client_secret)
+    if access_token is None:
+        return
+    # using the valid access token, extract, transform and load the data
+    if etl_tracks(access_token) is not None:
+        print("Today's tracks successfully loaded!")
+        input("Press [Enter] to return to the main menu: ")
+    else:
+        print("Today's tracks were not loaded!")
+        print("It looks like there were no new songs to add.")
+        print("Try listening to a few songs, then try again.")
+        print("Returning to main menu.")
 
 
-def view_days_history():
-    '''() -> Nonetype
-    This function displays the user's complete listening history of a given day.
+def input_date(prompt, default=None):
+    '''(str, str) -> str
+    This function prompts for a date in YYYY-mm-dd format until a valid one is given, returning the default if nothing is entered and there is one,
+    or None if the user types 'quit'.
     '''
-    # ensure that the date provided is valid
-    run = True
-    while run:
-        inp_date = input("Please enter the date for which you would like to see your listening history in YYYY-mm-dd format (or type 'quit' to return to the main menu): ")
+    while True:
+        inp_date = input(prompt)
         if inp_date.lower() == 'quit':
-            main_menu()
-            run = False
+            return(None)
+        elif inp_date == "" and default is not None:
+            return(default)
         elif re.match('^[0-9]{4}-[0-1]{1}[0-9]{1}-[0-3]{1}[0-9]{1}$', inp_date):
-            run = False
+            return(inp_date)
         else:
             print("Invalid date provided.")
-    # output the user's listening history for the provided date
-    if inp_date != 'quit':
-        df = get_days_history(inp_date)
-        if df.empty:
-            print("There are no recorded songs for this date.")
-        else:
-            print(tabulate(df, headers="keys", tablefmt="fancy_outline"))
-        input("Press [Enter] to return to the main menu: ")
-        main_menu()
+
+
+def view_days_history():
+    '''() -> Nonetype
+    This function displays the user's complete listening history from a given day or range of days, optionally only the plays of a given artist or album,
+    a page at a time so that the first page is shown straight away however long the range is.
+    '''
+    from SpotifyHistory.view_listening_history import iter_history
+    from tabulate import tabulate
+    # ensure that the dates provided are valid
+    start_date = input_date("Please enter the date for which you would like to see your listening history in YYYY-mm-dd format (or type 'quit' to return to the main menu): ")
+    if start_date is None:
+        return
+    end_date = input_date("Please enter the last date to include in YYYY-mm-dd format, or press [Enter] to only see " + start_date + ": ", start_date)
+    if end_date is None:
+        return
+    artist = input("Enter part of an artist's name to only see their tracks, or press [Enter] to see every artist: ")
+    album = input("Enter part of an album's name to only see its tracks, or press [Enter] to see every album: ")
+    # output the user's listening history for the provided dates one page at a time, reading each page only once the previous one has been seen
+    num_pages = 0
+    for page in iter_history(start_date, end_date, artist, album):
+        if num_pages > 0 and input("Press [Enter] to see the next page, or type 'quit' to return to the main menu: ").lower() == 'quit':
+            return
+        print(tabulate(page, headers="keys", tablefmt="fancy_outline"))
+        num_pages += 1
+    if num_pages == 0:
+        print("There are no recorded songs for " + ("this date." if start_date == end_date else "these dates."))
+    input("Press [Enter] to return to the main menu: ")
 
 
 def view_most_listened():
     '''() -> Nonetype
-    This function displays the top 1, 5 or 10 of the user's most listened to tracks, artists or albums,
+    This function displays the top 1, 5 or 10 of the user's most listened to tracks, artists, albums or genres,
     depending on the user's input.
     '''
+    from SpotifyHistory.view_listening_history import get_most_listened, get_top_genres
+    from tabulate import tabulate
     # define the valied options available for user input
-    options = {'0': "", '1': "track_name", '2': "artist_name", '3': "album_name"}
+    options = {'0': "", '1': "track_name", '2': "artist_name", '3': "album_name", '4': "genre"}
     limit_options = {'1': 1, '2': 5, '3': 10}
 
     # display the user's options and ensure a valid input is provided
@@ -171,80 +225,109 @@ def view_most_listened():
     print("[1] - Tracks")
     print("[2] - Artists")
     print("[3] - Albums")
+    print("[4] - Genres")
     print("[0] - Return to main menu")
     run = True
     while run:
-        inp = input("Please select one of the options above (1, 2, 3 or 0): ")
+        inp = input("Please select one of the options above (1, 2, 3, 4 or 0): ")
         if inp in options:
             run = False
     
     # return to the main menu if the user so chooses
     if inp == '0':
-        main_menu()
+        return
     # otherwise, prompt the user for the number of records they would like to see
-    else:
-        print("Would you like to see the: ")
-        print("[1] - Top 1")
-        print("[2] - Top 5")
-        print("[3] - Top 10")
-        run = True
-        while run:
-            limit_inp = input("Please select one of the options above (1, 2, or 3): ")
-            if limit_inp in limit_options:
-                run = False
+    print("Would you like to see the: ")
+    print("[1] - Top 1")
+    print("[2] - Top 5")
+    print("[3] - Top 10")
+    run = True
+    while run:
+        limit_inp = input("Please select one of the options above (1, 2, or 3): ")
+        if limit_inp in limit_options:
+            run = False
 
-        # get and display the information of interest using the user's input
+    # get and display the information of interest using the user's input
+    if options[inp] == "genre":
+        most_listened_df = get_top_genres(limit_options[limit_inp])
+    else:
         most_listened_df = get_most_listened(options[inp], limit_options[limit_inp])
-        os.system('cls')
-        print(tabulate(most_listened_df, headers="keys" ,tablefmt="fancy_outline"))
-        input("Press [Enter] to return to the main menu: ")
-        main_menu()
+    os.system('cls')
+    print(tabulate(most_listened_df, headers="keys" ,tablefmt="fancy_outline"))
+    input("Press [Enter] to return to the main menu: ")
+
+
+def search_listening_history():
+    '''() -> Nonetype
+    This function repeatedly prompts for part of a name and displays the tracks, artists and albums whose names contain it,
+    or the closest names if none do, until the user types 'quit'.
+    '''
+    from SpotifyHistory.view_listening_history import search_names
+    from tabulate import tabulate
+    while True:
+        text = input("Please enter part of a track, artist or album name (or type 'quit' to return to the main menu): ")
+        if text.lower() == 'quit':
+            return
+        if not text.strip():
+            continue
+        search_df = search_names(text)
+        if search_df.empty:
+            search_df = search_names(text, fuzzy=True)
+            if not search_df.empty:
+                print("No names contain \"" + text + "\", so the closest names are shown instead.")
+        if search_df.empty:
+            print("No tracks, artists or albums match \"" + text + "\".")
+        else:
+            print(tabulate(search_df, headers="keys", tablefmt="fancy_outline"))
 
 
 def view_daily_listening_distribution():
     '''() -> Nonetype
     This function gets the data required and calls a function to output a bar chart showing the total number of songs played by time of day.
     '''
-    # store each hour of the day to be used in string comparison and as a label
-    times = ["00", "01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11",
-             "12", "13", "14", "15", "16", "17", "18", "19", "20", "21", "22", "23"]
-    time_labels = ["12:00am", "1:00am", "2:00am", "3:00am", "4:00am", "5:00am", "6:00am", "7:00am", "8:00am", "9:00am", "10:00am", "11:00am",
-             "12:00pm", "1:00pm", "2:00pm", "3:00pm", "4:00pm", "5:00pm", "6:00pm", "7:00pm", "8:00pm", "9:00pm", "10:00pm", "11:00pm"]
-    num_songs = []
-    # for each hour of the day, get the number of songs played
-    for time in times:
-        num_songs.append(get_num_songs_by_time(time))
+    from SpotifyHistory.view_listening_history import get_num_songs_by_hour, plot_num_songs_by_time
+    # get the number of songs played during each hour of the day
+    num_songs = get_num_songs_by_hour()
     # store and output the time of day with the most songs played
     fav_time_index = num_songs.index(max(num_songs))
-    print("Your favourite time to listen to music is around " + time_labels[fav_time_index] + " with " + str(max(num_songs)) + " songs.")
+    print("Your favourite time to listen to music is around " + TIME_LABELS[fav_time_index] + " with " + str(max(num_songs)) + " songs.")
     print("\nPlease close the graph to return to the main menu.")
     # output the bar chart showing the number of songs played by time of day
-    plot_num_songs_by_time(time_labels, num_songs)
-    main_menu()
+    plot_num_songs_by_time(TIME_LABELS, num_songs)
 
 
 def view_daily_duration_listened():
     '''() -> Nonetype
     This function gets the data required and calls a function to output a bar chart showing the user's daily time spent listening to music for the current week.
     '''
-    # store today's date
-    today = datetime.datetime.now().date()
-    # get and store the dates for the current week
-    week_dates = [d for d in get_week_dates(today)]
-    durations_in_ms = []
-    duration_labels = []
-    # for each day of the week, get the total time spent listening in milliseconds and convert to H:M:S
-    for date in week_dates:
-        duration_in_ms = get_total_duration(date)
-        durations_in_ms.append(duration_in_ms)
-        duration_labels.append(convert_duration(duration_in_ms))
+    from SpotifyHistory.etl_data import convert_duration
+    from SpotifyHistory.view_listening_history import plot_daily_duration
+    # get the dates and total time spent listening in milliseconds for each day of the current week and convert each to H:M:S
+    week_dates, durations_in_ms = get_week_durations(datetime.datetime.now().date())
+    duration_labels = [convert_duration(duration_in_ms) for duration_in_ms in durations_in_ms]
     # calculate and output the total listening time for the current week
     total_duration = convert_duration(sum(durations_in_ms))
     print("Your total listening for this week is currently " + total_duration)
     print("\nPlease close the graph to return to the main menu.")
     # output the bar graph
     plot_daily_duration(week_dates, durations_in_ms, duration_labels)
-    main_menu()
+
+
+def get_weekly_comparison(date):
+    '''(datetime.date) -> list of list of str, list of list of int, list of list of str, list of int, list of str
+    This function returns the dates of the two full weeks before the given date's week, starting with the earlier week, the time spent listening in milliseconds
+    on each of those dates and its label in H:M:S, and the difference in time spent listening on each day of the week between the later week and the earlier week
+    along with the label of each difference.
+    '''
+    from SpotifyHistory.etl_data import convert_duration
+    # get the dates and durations listened for each day in the past two full weeks, as well as the duration labels
+    all_dates, all_durations_in_ms = get_two_week_durations(date)
+    all_duration_labels = [[convert_duration(d) for d in durations] for durations in all_durations_in_ms]
+    # calculate and store the difference in time spent listening between one week ago and two weeks ago for each day of the week
+    duration_differences = [durations_one_wk_ago_i - durations_two_wks_ago_i for durations_one_wk_ago_i, durations_two_wks_ago_i in zip(all_durations_in_ms[1], all_durations_in_ms[0])]
+    # convert each difference from milliseconds to H:M:S
+    duration_difference_labels = [convert_duration(abs(d)) for d in duration_differences]
+    return(all_dates, all_durations_in_ms, all_duration_labels, duration_differences, duration_difference_labels)
 
 
 def compare_previous_two_weeks():
@@ -252,43 +335,13 @@ def compare_previous_two_weeks():
     This function gets the data required and calls a function to output a double bar chart showing the user's daily time spent listening to music for the past two weeks
     and a scatterplot comparing the time spent listening per day between the two weeks.
     '''
-    # store today's date and set the offsets to calculate the dates for the past two weeks
-    today = datetime.datetime.now().date()
-    offset = [14, 7]
-    # initialize the lists to store all the dates, durations spent listening and duration labels
-    all_dates = []
-    all_durations_in_ms = []
-    all_duration_labels = []
-    # get the date for each day in the past two full weeks
-    for i in range(len(offset)):
-        durations_in_ms = []
-        duration_labels = []
-        date = today - datetime.timedelta(days=offset[i])
-        week_dates = [d for d in get_week_dates(date)]
-        # get the duration listened and duration labels for each date
-        for d in week_dates:
-            duration_in_ms = get_total_duration(d)
-            durations_in_ms.append(duration_in_ms)
-            duration_labels.append(convert_duration(duration_in_ms))
-        # add all the data to the corresponding main list
-        all_dates.append(week_dates)
-        all_durations_in_ms.append(durations_in_ms)
-        all_duration_labels.append(duration_labels)
-
-    #################################################################################### TESTING ####################################################################################
-    #all_durations_in_ms = [[3600000, 4000000, 7200000, 8000000, 5400000, 3050000, 9250000], [7074553, 3959502, 4138418, 8523539, 9468900, 7746597, 3277002]]
-    #all_duration_labels = [["1:00:00", "1:06:40", "2:00:00", "2:13:20", "1:30:00", "50:50", "2:34:10"], ["1:57:54", "1:05:59", "1:08:58", "2:22:03", "2:37:48", "2:09:06", "54:37"]]
-    #################################################################################### TESTING ####################################################################################
-    
+    from SpotifyHistory.etl_data import convert_duration
+    from SpotifyHistory.view_listening_history import plot_weekly_comparison
+    # get the dates, durations and differences listened for each day in the past two full weeks, along with their labels
+    all_dates, all_durations_in_ms, all_duration_labels, duration_differences, duration_difference_labels = get_weekly_comparison(datetime.datetime.now().date())
     # split the durations of each week into separate lists
     durations_one_wk_ago = all_durations_in_ms[1]
     durations_two_wks_ago = all_durations_in_ms[0]
-    # calculate and store the difference in time spent listening between one week ago and two weeks ago for each day of the week
-    duration_differences = [durations_one_wk_ago_i - durations_two_wks_ago_i for durations_one_wk_ago_i, durations_two_wks_ago_i in zip(durations_one_wk_ago, durations_two_wks_ago)]
-    # convert each difference from milliseconds to H:M:S
-    duration_difference_labels = []
-    for d in duration_differences:
-        duration_difference_labels.append(convert_duration(abs(d)))
     # calculate and output the total weekly difference in time spent listening
     weekly_difference_ms = sum(duration_differences)
     weekly_difference = convert_duration(abs(weekly_difference_ms))
@@ -305,4 +358,49 @@ def compare_previous_two_weeks():
     print("\nPlease close the graph to return to the main menu.")
     # output the two graphs
     plot_weekly_comparison(all_dates, all_durations_in_ms, all_duration_labels, duration_differences, duration_difference_labels)
-    main_menu()
\ No newline at end of file
+
+
+def get_listening_calendar(date):
+    '''(datetime.date) -> list of str, list of int, dict, dict
+    This function returns the dates of the weeks shown on the listening calendar, ending with the given date's week, the time spent listening in milliseconds
+    on each of those dates, and the current streak of consecutive days with plays up to the given date and the longest streak of all time.
+    '''
+    from SpotifyHistory.view_listening_history import get_calendar_dates, get_total_durations, get_current_streak, get_listening_streaks
+    start_date, end_date = get_calendar_dates(date.isoformat())
+    durations = get_total_durations(start_date, end_date)
+    streaks_df = get_listening_streaks(1)
+    longest_streak = streaks_df.iloc[0].to_dict() if len(streaks_df) else {"start_date": None, "end_date": None, "num_days": 0}
+    return(list(durations.index), [int(d) for d in durations], get_current_streak(date.isoformat()), longest_streak)
+
+
+def get_session_lengths(date):
+    '''(datetime.date) -> list of float, float, str, str
+    This function returns the length in minutes of each listening session over the weeks shown on the listening calendar, ending with the given date's week,
+    the gap in minutes the sessions were split by and the first and last date of those weeks.
+    '''
+    from SpotifyHistory.view_listening_history import get_calendar_dates, get_sessions, get_session_summary
+    start_date, end_date = get_calendar_dates(date.isoformat())
+    session_lengths = get_sessions(start_date, end_date)["length_in_minutes"].tolist()
+    return(session_lengths, get_session_summary(start_date, end_date)["gap_minutes"], start_date, end_date)
+
+
+def view_sessions_and_streaks():
+    '''() -> Nonetype
+    This function displays a summary of the user's listening sessions, their current listening streak and their longest streaks,
+    then outputs a calendar of their time spent listening by day for the past year and a histogram of the lengths of their sessions over that year.
+    '''
+    from SpotifyHistory.view_listening_history import get_session_summary, get_listening_streaks, plot_listening_calendar, plot_session_lengths
+    from tabulate import tabulate
+    today = datetime.datetime.now().date()
+    # output the summary of every listening session and the streaks
+    summary = get_session_summary()
+    print("You have had " + str(summary["num_sessions"]) + " listening sessions (plays less than " + str(summary["gap_minutes"]) + " minutes apart), "
+          + "usually lasting " + str(summary["median_length_in_minutes"]) + " minutes with " + str(summary["mean_plays_per_session"]) + " plays on average. "
+          + "Your longest lasted " + str(summary["longest_length_in_minutes"]) + " minutes.")
+    day_dates, durations_in_ms, current_streak, longest_streak = get_listening_calendar(today)
+    print("Your current listening streak is " + str(current_streak["num_days"]) + " days. Your longest streaks are:")
+    print(tabulate(get_listening_streaks(5), headers="keys", tablefmt="fancy_outline"))
+    print("\nPlease close each graph to see the next one, or to return to the main menu after the last.")
+    # output the calendar and then the histogram of session lengths
+    plot_listening_calendar(day_dates, durations_in_ms, current_streak, longest_streak)
+    plot_session_lengths(*get_session_lengths(today))
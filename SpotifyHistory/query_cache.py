@@ -0,0 +1,74 @@
+from SpotifyHistory import database
+from SpotifyHistory.instrumentation import record
+import collections
+import copy
+import functools
+import os
+import sqlalchemy
+
+# the largest number of query results kept in memory, after which the least recently used result is evicted
+CACHE_SIZE = 256
+
+GET_DATABASE_STATE_QUERY = "SELECT name, value FROM etl_state WHERE name IN ('database_id', 'generation')"
+
+# the cached results, most recently used last, keyed by the absolute path and random id of the database, function name and arguments,
+# each stored with the generation of the database it was computed at. They are only kept in memory, for the life of the process
+_cache = collections.OrderedDict()
+
+
+@functools.lru_cache(maxsize=None)
+def get_database_path(database_location):
+    '''(str) -> str
+    This function returns the path of the file of the given database, as given in its location, or None if it is not stored in a file.
+    '''
+    return(sqlalchemy.engine.make_url(database_location).database)
+
+
+def get_database_state():
+    '''() -> tuple, int
+    This function returns the key of the database, made of the absolute path of its file and the random id stored in it when it was created,
+    and its generation, a counter that is increased every time tracks are loaded into it. Cached results are only reused for the same key, so that
+    results are never taken from another database, and only at the same generation, so that results are known to be out of date even if
+    the tracks were loaded by another process.
+    '''
+    # borrow the driver's connection from the pool just for the query, without starting a transaction, and hand it straight back
+    conn = database.get_engine().raw_connection()
+    try:
+        state = dict(conn.driver_connection.execute(GET_DATABASE_STATE_QUERY).fetchall())
+    finally:
+        conn.close()
+    path = get_database_path(database.DATABASE_LOCATION)
+    database_key = (os.path.abspath(path) if path and path != ":memory:" else database.DATABASE_LOCATION, state.get("database_id"))
+    return(database_key, state.get("generation", 0))
+
+
+def cached_query(function):
+    '''(function) -> function
+    This function wraps a read function of the listening history so that its result is reused for the same arguments until the database changes.
+    A copy of each cached result is returned so that callers can modify it freely.
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        database_key, generation = get_database_state()
+        key = (database_key, function.__name__, args, tuple(sorted(kwargs.items())))
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == generation:
+            _cache.move_to_end(key)
+            record(cache_hits=1)
+            return(copy.deepcopy(entry[1]))
+        record(cache_misses=1)
+        result = function(*args, **kwargs)
+        _cache[key] = (generation, result)
+        _cache.move_to_end(key)
+        # evict the least recently used results once the cache is full
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+        return(copy.deepcopy(result))
+    return(wrapper)
+
+
+def clear_query_cache():
+    '''() -> Nonetype
+    This function removes every cached result.
+    '''
+    _cache.clear()
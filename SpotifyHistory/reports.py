@@ -0,0 +1,94 @@
+from SpotifyHistory import database
+from SpotifyHistory.menu_functions import TIME_LABELS, get_week_durations, get_weekly_comparison, get_listening_calendar, get_session_lengths
+import argparse
+import concurrent.futures
+import datetime
+import os
+
+# the charts that can be rendered, and the image formats they can be saved as
+CHARTS = ("hourly", "week", "compare", "streaks", "sessions")
+IMAGE_FORMATS = ("png", "svg")
+
+# the size of each chart in inches, with room for the two plots of the comparison
+CHART_SIZES = {"hourly": (10, 6), "week": (10, 6), "compare": (14, 10), "streaks": (14, 5), "sessions": (10, 6)}
+
+# the folder the charts are saved to, with a folder for each profile when the charts of several users are rendered
+REPORTS_LOCATION = "reports"
+
+
+def get_chart(chart, date):
+    '''(str, datetime.date) -> function, tuple
+    This function returns the function that draws the given chart and the data it is drawn from, read from the current database,
+    for the week of the given date (or, for the comparison, the two full weeks before it, and for the streaks and sessions, the year of weeks up to it).
+    '''
+    from SpotifyHistory.etl_data import convert_duration
+    from SpotifyHistory.view_listening_history import get_num_songs_by_hour, draw_num_songs_by_time, draw_daily_duration, draw_weekly_comparison, \
+        draw_listening_calendar, draw_session_lengths
+    if chart == "hourly":
+        return(draw_num_songs_by_time, (TIME_LABELS, get_num_songs_by_hour()))
+    if chart == "week":
+        week_dates, durations_in_ms = get_week_durations(date)
+        return(draw_daily_duration, (week_dates, durations_in_ms, [convert_duration(d) for d in durations_in_ms]))
+    if chart == "compare":
+        return(draw_weekly_comparison, get_weekly_comparison(date))
+    if chart == "streaks":
+        return(draw_listening_calendar, get_listening_calendar(date))
+    if chart == "sessions":
+        return(draw_session_lengths, get_session_lengths(date))
+    raise ValueError("Invalid chart: " + str(chart))
+
+
+def render_report(task):
+    '''(dict) -> str
+    This function renders one chart to an image file without a display, given a task naming the database, chart, date, image format and file path.
+    It is run in a separate process for each task, so the database the view functions read from is simply switched to the task's database.
+    The path of the file is returned.
+    '''
+    from SpotifyHistory.view_listening_history import render_chart
+    database.DATABASE_LOCATION = task["database"]
+    draw, data = get_chart(task["chart"], task["date"])
+    os.makedirs(os.path.dirname(task["path"]) or ".", exist_ok=True)
+    render_chart(draw, *data, path=task["path"], image_format=task["format"], size=CHART_SIZES[task["chart"]])
+    return(task["path"])
+
+
+def get_report_tasks(charts, date, image_format="png", output_dir=REPORTS_LOCATION, profiles=None):
+    '''(list of str, datetime.date, str, str, list of dict) -> list of dict
+    This function returns a task for each of the given charts, for the default listening history or, if profiles are given, for each profile's listening history,
+    with each profile's charts saved in its own folder.
+    '''
+    from SpotifyHistory.ingest_profiles import get_profile_database
+    databases = [(output_dir, database.DATABASE_LOCATION)]
+    if profiles is not None:
+        databases = [(os.path.join(output_dir, profile["name"]), get_profile_database(profile)) for profile in profiles]
+    return([{"database": database_location, "chart": chart, "date": date, "format": image_format,
+             "path": os.path.join(folder, chart + "-" + date.isoformat() + "." + image_format)}
+            for folder, database_location in databases for chart in charts])
+
+
+def render_reports(tasks, processes=None):
+    '''(list of dict, int) -> list of str, list of str
+    This function renders every task's chart across a pool of processes, returning the paths of the files written and a description of each task that failed.
+    '''
+    paths = []
+    errors = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(render_report, task): task for task in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                paths.append(future.result())
+            except Exception as error:
+                errors.append(futures[future]["path"] + ": " + type(error).__name__ + ": " + str(error))
+    return(sorted(paths), errors)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Render charts of your listening history to image files without a display.")
+    arg_parser.add_argument("--charts", nargs="+", choices=CHARTS, default=list(CHARTS), help="the charts to render (default: all)")
+    arg_parser.add_argument("--date", type=datetime.date.fromisoformat, default=datetime.date.today(), help="any date in the week to chart (default: today)")
+    arg_parser.add_argument("--format", choices=IMAGE_FORMATS, default="png")
+    arg_parser.add_argument("--output-dir", default=REPORTS_LOCATION, help="the folder to save the charts to (default: " + REPORTS_LOCATION + ")")
+    arg_parser.add_argument("--processes", type=int, default=None, help="the number of charts rendered at once (default: the number of CPUs)")
+    args = arg_parser.parse_args()
+    paths, errors = render_reports(get_report_tasks(args.charts, args.date, args.format, args.output_dir), args.processes)
+    print("\n".join(paths + errors))
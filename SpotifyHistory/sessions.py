@@ -0,0 +1,129 @@
+from SpotifyHistory import database
+from SpotifyHistory.database import get_engine, get_state, set_state, increment_generation
+import argparse
+import numpy as np
+
+# the longest gap in minutes between the end of one play and the start of the next for both to be in the same listening session. Each play's played_at is
+# the time it ended, as in Spotify's recently played tracks and streaming history, so a play is taken to have started its duration before that
+SESSION_GAP_MINUTES = 30
+
+# the names of the ETL state values recording the gap the sessions were split by and the number of plays they cover, which tells whether any plays
+# were added or removed before the sessions being split again since they were last updated
+GAP_STATE = "session_gap_minutes"
+NUM_PLAYS_STATE = "sessions_num_plays"
+
+# split the plays from a session's first play onwards into sessions in one ordered scan: a play starts a new session if it started at least the gap
+# after the play before it ended, and numbering the starts with a running total gives every play the number of its session
+FILL_SESSIONS_QUERY = """
+    INSERT INTO listening_sessions(first_played_at, last_played_at, started_at, start_date, num_plays, total_duration)
+    SELECT MIN(played_at), MAX(played_at), MIN(CASE WHEN is_first THEN played_at - duration_in_ms END), MIN(CASE WHEN is_first THEN date_played END),
+        COUNT(*), SUM(duration_in_ms)
+    FROM (
+        SELECT played_at, duration_in_ms, date_played, is_first, SUM(is_first) OVER (ORDER BY played_at) AS session_num
+        FROM (
+            SELECT played_at, duration_in_ms, date_played,
+                CASE WHEN played_at - duration_in_ms - LAG(played_at) OVER (ORDER BY played_at) < :gap_ms THEN 0 ELSE 1 END AS is_first
+            FROM plays
+            WHERE played_at >= :from_played_at
+        )
+    )
+    GROUP BY session_num
+    """
+SESSION_BEFORE_QUERY = """
+    SELECT first_played_at, last_played_at, started_at, start_date, num_plays, total_duration
+    FROM listening_sessions
+    WHERE first_played_at <= :played_at
+    ORDER BY first_played_at DESC
+    LIMIT 1
+    """
+NUM_PLAYS_BETWEEN_QUERY = """
+    SELECT COUNT(*) FROM plays WHERE played_at BETWEEN :first_played_at AND :last_played_at
+    """
+GET_DURATION_QUERY = """
+    SELECT duration_in_ms FROM plays WHERE played_at = :played_at
+    """
+# the plays split again from a session's last play form a session starting with that play, which is merged into the session it carries on
+MERGE_SESSION_QUERY = """
+    UPDATE listening_sessions
+    SET first_played_at = :first_played_at, started_at = :started_at, start_date = :start_date, num_plays = num_plays + :num_plays - 1,
+        total_duration = total_duration + :total_duration - :last_duration
+    WHERE first_played_at = :last_played_at
+    """
+NUM_SESSION_PLAYS_FROM_QUERY = """
+    SELECT COALESCE(SUM(num_plays), 0) FROM listening_sessions WHERE first_played_at >= :from_played_at
+    """
+DELETE_SESSIONS_QUERY = """
+    DELETE FROM listening_sessions WHERE first_played_at >= :from_played_at
+    """
+NUM_PLAYS_QUERY = """
+    SELECT COALESCE(SUM(num_plays), 0) FROM daily_totals
+    """
+NUM_PLAYS_FROM_QUERY = """
+    SELECT COUNT(*) FROM plays WHERE played_at >= :from_played_at
+    """
+
+
+def update_sessions(conn, changed_from=None, rebuild=False):
+    '''(sqlalchemy.engine.Connection, int, Boolean) -> int
+    This function brings the listening sessions up to date with the plays, inside the transaction that changed them. Only the last session is still open,
+    since a play loaded later can only extend it or start new sessions after it, so the plays from its last play onwards are split into sessions again
+    and the first of them is merged into it. If plays as old as the given unix timestamp in milliseconds may have been added, e.g. by an import,
+    the sessions are split again from the one that timestamp falls in instead, from its first play if plays were added within it. If the plays before
+    that session are no longer exactly those the sessions covered, or rebuild is True, every session is recomputed. The number of sessions written is returned.
+    '''
+    gap_ms = int(get_state(conn, GAP_STATE, SESSION_GAP_MINUTES) * 60000)
+    num_plays = conn.exec_driver_sql(NUM_PLAYS_QUERY).scalar()
+    session = None
+    if not rebuild:
+        session = conn.exec_driver_sql(SESSION_BEFORE_QUERY, {"played_at": 2 ** 63 - 1 if changed_from is None else changed_from}).one_or_none()
+    from_played_at = -1
+    carry_on = False
+    if session is not None:
+        params = {"from_played_at": session.first_played_at}
+        num_plays_before = num_plays - conn.exec_driver_sql(NUM_PLAYS_FROM_QUERY, params).scalar()
+        if num_plays_before == get_state(conn, NUM_PLAYS_STATE, 0) - conn.exec_driver_sql(NUM_SESSION_PLAYS_FROM_QUERY, params).scalar():
+            from_played_at = session.first_played_at
+            # if the session still has exactly the plays it covers, carry it on from its last play rather than splitting all of it again
+            carry_on = conn.exec_driver_sql(NUM_PLAYS_BETWEEN_QUERY, session._asdict()).scalar() == session.num_plays
+    conn.exec_driver_sql(DELETE_SESSIONS_QUERY, {"from_played_at": from_played_at})
+    if carry_on:
+        last_duration = conn.exec_driver_sql(GET_DURATION_QUERY, {"played_at": session.last_played_at}).scalar()
+        num_written = conn.exec_driver_sql(FILL_SESSIONS_QUERY, {"from_played_at": session.last_played_at, "gap_ms": gap_ms}).rowcount
+        conn.exec_driver_sql(MERGE_SESSION_QUERY, dict(session._asdict(), last_duration=last_duration))
+    else:
+        num_written = conn.exec_driver_sql(FILL_SESSIONS_QUERY, {"from_played_at": from_played_at, "gap_ms": gap_ms}).rowcount
+    set_state(conn, NUM_PLAYS_STATE, num_plays)
+    return(max(num_written, 0))
+
+
+def rebuild_sessions(database_location=None, gap_minutes=SESSION_GAP_MINUTES):
+    '''(str, float) -> int
+    This function splits every play in the given database (the default database if none is given) into sessions again with the given gap in minutes,
+    which is then used as more plays are loaded, and returns the number of sessions.
+    '''
+    with get_engine(database_location).begin() as conn:
+        set_state(conn, GAP_STATE, gap_minutes)
+        num_sessions = update_sessions(conn, rebuild=True)
+        increment_generation(conn)
+    return(num_sessions)
+
+
+def get_streaks(dates):
+    '''(ndarray) -> ndarray, ndarray
+    Given the dates that had any plays, in order, this function returns the index of the first and last date of each streak of consecutive days
+    with plays, found in one pass by breaking the dates wherever the next date is not the day after.
+    '''
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    if len(dates) == 0:
+        return(np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+    breaks = np.flatnonzero(np.diff(dates) != np.timedelta64(1, "D"))
+    return(np.concatenate([[0], breaks + 1]), np.concatenate([breaks, [len(dates) - 1]]))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Split your listening history into listening sessions again, e.g. with a different gap between sessions.")
+    arg_parser.add_argument("--database", default=None, help="the database location (default: " + database.DATABASE_LOCATION + ")")
+    arg_parser.add_argument("--gap", type=float, default=SESSION_GAP_MINUTES,
+                            help="the most minutes between plays in the same session (default: " + str(SESSION_GAP_MINUTES) + ")")
+    args = arg_parser.parse_args()
+    print("Found " + str(rebuild_sessions(args.database, args.gap)) + " listening sessions.")
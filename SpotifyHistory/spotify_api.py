@@ -0,0 +1,159 @@
+from SpotifyHistory.instrumentation import span, record
+import base64
+import datetime
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+# the base urls of the Spotify accounts service and Web API, which can be pointed at a local stand-in server (see benchmarks/fake_spotify.py)
+ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com")
+API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+REDIRECT_URI = "http://localhost:8888/callback"
+
+# the seconds allowed to connect to the server and to wait for each response
+REQUEST_TIMEOUT = (5, 30)
+
+# the number of times a request is retried after a rate limit, server error or connection error, and the delays in seconds between the retries,
+# which double after each retry up to the maximum unless the server says how long to wait
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 60
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# the number of keep-alive connections kept open to each host by a session
+POOL_SIZE = 10
+
+# the session of each thread, since a session should not be shared between threads
+_sessions = threading.local()
+
+
+def get_session():
+    '''() -> requests.Session
+    This function returns the current thread's session, creating it the first time, so that every request made by a thread reuses its keep-alive connections.
+    '''
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _sessions.session = session
+    return(session)
+
+
+def get_retry_delay(response, attempt):
+    '''(requests.Response, int) -> float
+    This function returns the seconds to wait before retrying a failed request, using the Retry-After header of a rate limited response if there is one,
+    otherwise backing off exponentially with some jitter so that accounts being ingested together do not all retry at once.
+    '''
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return(float(response.headers["Retry-After"]))
+    delay = min(BACKOFF_SECONDS * 2 ** attempt, MAX_BACKOFF_SECONDS)
+    return(delay * random.uniform(0.5, 1))
+
+
+def send_request(method, url, **kwargs):
+    '''(str, str) -> requests.Response
+    This function sends a request with the current thread's session, retrying it after rate limits, server errors and connection errors.
+    The last response is returned once the request succeeds or the retries run out, and the last connection error is raised if no response was received.
+    Only the calling thread waits between retries, so one account being rate limited does not hold up the others.
+    '''
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    # time the request and count the attempts and bytes received, without the query string, which holds the ids and timestamps asked for
+    with span("spotify_api.send_request", method=method, endpoint=url.split("?")[0]):
+        for attempt in range(MAX_RETRIES + 1):
+            response = None
+            try:
+                response = get_session().request(method, url, **kwargs)
+                record(http_requests=1, bytes_fetched=len(response.content))
+                if response.status_code not in RETRY_STATUSES:
+                    return(response)
+            except (requests.ConnectionError, requests.Timeout):
+                record(http_requests=1)
+                if attempt == MAX_RETRIES:
+                    raise
+            if attempt < MAX_RETRIES:
+                time.sleep(get_retry_delay(response, attempt))
+    return(response)
+
+
+def get_json(response):
+    '''(requests.Response) -> dict
+    This function returns the json body of the given response, which for an error is Spotify's description of it. If the body is not json,
+    e.g. the html error page of a server error once the retries have run out, an HTTPError giving the status is raised instead.
+    '''
+    try:
+        return(response.json())
+    except ValueError:
+        response.raise_for_status()
+        raise requests.HTTPError("Spotify responded with status " + str(response.status_code) + " but no json from " + response.url.split("?")[0],
+                                 response=response)
+
+
+def request_token(client_id, client_secret, data):
+    '''(str, str, dict) -> dict
+    This function requests a token from the Spotify accounts service with the given grant and returns the json response,
+    which contains an error instead of an access token if the grant was refused.
+    '''
+    # encode the client credentials to base64
+    auth_base64 = str(base64.b64encode((client_id + ":" + client_secret).encode("utf-8")), "utf-8")
+    headers = {"Authorization": "Basic " + auth_base64, "Content-Type": "application/x-www-form-urlencoded"}
+    response = send_request("POST", ACCOUNTS_URL + "/api/token", headers=headers, data=data)
+    return(get_json(response))
+
+
+def get_token_from_code(client_id, client_secret, auth_code):
+    '''(str, str, str) -> dict
+    Given the client credentials and an authorization code, this function returns the access token, its lifetime and the refresh token granted for the code.
+    '''
+    return(request_token(client_id, client_secret, {"grant_type": "authorization_code", "code": auth_code, "redirect_uri": REDIRECT_URI}))
+
+
+def refresh_access_token(client_id, client_secret, refresh_token):
+    '''(str, str, str) -> dict
+    Given the client credentials and a refresh token, this function returns a new access token and its lifetime, along with a new refresh token if Spotify issued one.
+    '''
+    return(request_token(client_id, client_secret, {"grant_type": "refresh_token", "refresh_token": refresh_token}))
+
+
+def get_played_at(item):
+    '''(dict) -> int
+    This function returns the time the given recently played item was played as a unix timestamp in milliseconds.
+    '''
+    played_at = datetime.datetime.fromisoformat(item["played_at"].replace("Z", "+00:00"))
+    return(round(played_at.timestamp() * 1000))
+
+
+def get_recently_played(access_token, after):
+    '''(str, int) -> dict
+    This function returns the tracks played after the given unix timestamp in milliseconds, most recent first. Each page of results has the most recent plays
+    first and links to the page before it with a before cursor, which is no longer bounded by the timestamp, so the pages are followed back in time
+    until one reaches a play at or before the timestamp. An error response is returned as it is, so that it is reported when the data is transformed.
+    '''
+    headers = {"Accept": "application/json", "Authorization": "Bearer " + access_token}
+    url = API_URL + "/me/player/recently-played?limit=50&after=" + str(after)
+    raw_data = {"items": []}
+    while url:
+        page = get_json(send_request("GET", url, headers=headers))
+        if "items" not in page:
+            return(page)
+        items = [item for item in page["items"] if get_played_at(item) > after]
+        raw_data["items"].extend(items)
+        if len(items) < len(page["items"]):
+            break
+        url = page.get("next")
+    return(raw_data)
+
+
+def get_several(access_token, kind, ids):
+    '''(str, str, list of str) -> list of dict
+    This function returns Spotify's objects for the given ids of tracks, artists or albums (the kind, in the plural) in a single request,
+    with None in place of any id Spotify does not know. At most 50 ids (20 for albums) can be requested at once.
+    '''
+    headers = {"Accept": "application/json", "Authorization": "Bearer " + access_token}
+    response = send_request("GET", API_URL + "/" + kind, headers=headers, params={"ids": ",".join(ids)})
+    response.raise_for_status()
+    return(get_json(response)[kind])
@@ -1,79 +1,535 @@
-from SpotifyHistory.etl_data import DATABASE_LOCATION
+from SpotifyHistory.database import ROLLUP_DIMENSIONS, SEARCH_NAME_COLUMNS, get_engine
+from SpotifyHistory.etl_data import get_date_unix_timestamp
+from SpotifyHistory.query_cache import cached_query
+from SpotifyHistory.sessions import get_streaks
+from SpotifyHistory.instrumentation import traced, span
+import datetime
+import io
 import sqlalchemy
 import pandas as pd
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.lines import Line2D
 
+# matplotlib is imported by the chart functions themselves, since it is slow to import and most uses of this module never draw a chart
 
+# the columns that the user can rank their most listened to tracks, artists or albums by, and the table and key that identifies each of them
+MOST_LISTENED_COLUMNS = {"track_name": ("tracks", "track_key"), "artist_name": ("artists", "artist_key"), "album_name": ("albums", "album_key")}
+
+# the tables whose names can be searched, with the key and name column of each, and the shortest part of a name the trigram index can find
+SEARCH_TABLES = [(table, key, SEARCH_NAME_COLUMNS[table]) for table, key in ROLLUP_DIMENSIONS]
+MIN_SEARCH_LENGTH = 3
+
+# the queries used by the view functions, defined once with bound parameters so that each statement is compiled once and reused
+DAYS_HISTORY_QUERY = sqlalchemy.text("""
+    SELECT track_name, artist_name, album_name, release_date, date_played, time_played, duration
+    FROM complete_listening_history WHERE played_at >= :start_ms AND played_at < :end_ms ORDER BY played_at
+    """)
+HISTORY_CHUNK_QUERY = """
+    SELECT played_at, track_name, artist_name, album_name, release_date, date_played, time_played, duration
+    FROM complete_listening_history
+    WHERE played_at > :after AND played_at < :end_ms
+        AND (:artist IS NULL OR artist_name LIKE :artist ESCAPE '\\')
+        AND (:album IS NULL OR album_name LIKE :album ESCAPE '\\')
+    ORDER BY played_at
+    LIMIT :limit
+    """
+MOST_LISTENED_QUERIES = {column: sqlalchemy.text("""
+    SELECT d.{column}, c.num_plays AS num_of_listens
+    FROM {table}_counts AS c
+    JOIN {table} AS d ON d.{key} = c.{key}
+    ORDER BY c.num_plays DESC, d.{column}
+    LIMIT :limit
+    """.format(column=column, table=table, key=key)) for column, (table, key) in MOST_LISTENED_COLUMNS.items()}
+LEADERBOARD_QUERIES = {column: sqlalchemy.text("""
+    SELECT d.{column}, h.num_plays AS num_of_listens, h.num_plays - h.max_overcount AS min_num_of_listens
+    FROM heavy_hitters AS h
+    JOIN {table} AS d ON d.{key} = h.item_key
+    WHERE h.dimension = :dimension AND h.period = :period AND h.period_start = :period_start
+    ORDER BY h.num_plays DESC, d.{column}
+    LIMIT :limit
+    """.format(column=column, table=table, key=key)) for column, (table, key) in MOST_LISTENED_COLUMNS.items()}
+TOP_GENRES_QUERY = sqlalchemy.text("""
+    SELECT g.genre, SUM(c.num_plays) AS num_of_listens, SUM(c.total_duration) AS total_duration_in_ms
+    FROM tracks_counts AS c
+    JOIN tracks AS t ON t.track_key = c.track_key
+    JOIN (SELECT DISTINCT ta.track_id, ag.genre FROM track_artists AS ta JOIN artist_genres AS ag ON ag.artist_id = ta.artist_id) AS g ON g.track_id = t.track_id
+    GROUP BY g.genre
+    ORDER BY num_of_listens DESC, g.genre
+    LIMIT :limit
+    """)
+TOP_CREDITED_ARTISTS_QUERY = sqlalchemy.text("""
+    SELECT MIN(ta.artist_name) AS artist_name, SUM(c.num_plays) AS num_of_listens
+    FROM tracks_counts AS c
+    JOIN tracks AS t ON t.track_key = c.track_key
+    JOIN track_artists AS ta ON ta.track_id = t.track_id
+    GROUP BY ta.artist_id
+    ORDER BY num_of_listens DESC, artist_name
+    LIMIT :limit
+    """)
+NUM_SONGS_BY_TIME_QUERY = sqlalchemy.text("""
+    SELECT COALESCE(SUM(num_plays), 0) AS num_songs
+    FROM hourly_counts
+    WHERE hour_played = :hour
+    """)
+NUM_SONGS_BY_HOUR_QUERY = sqlalchemy.text("""
+    SELECT hour_played, weekday_played, num_plays AS num_songs
+    FROM hourly_counts
+    WHERE hour_played IS NOT NULL AND weekday_played IS NOT NULL
+    """)
+TOTAL_DURATION_QUERY = sqlalchemy.text("""
+    SELECT COALESCE(SUM(total_duration), 0) AS total_duration
+    FROM daily_totals
+    WHERE date_played = :date
+    """)
+TOTAL_DURATIONS_QUERY = sqlalchemy.text("""
+    SELECT date_played, total_duration
+    FROM daily_totals
+    WHERE date_played BETWEEN :start_date AND :end_date
+    """)
+
+SEARCH_COLUMNS = """
+    SELECT '{kind}' AS type, d.{name} AS name, COALESCE(c.num_plays, 0) AS num_of_listens, COALESCE(c.total_duration, 0) AS total_duration_in_ms,
+        strftime('%Y-%m-%d %H:%M:%S', c.first_played / 1000, 'unixepoch', 'localtime') AS first_played,
+        strftime('%Y-%m-%d %H:%M:%S', c.last_played / 1000, 'unixepoch', 'localtime') AS last_played
+    """
+SEARCH_QUERIES = {table: sqlalchemy.text(SEARCH_COLUMNS.format(kind=table[:-1], name=name) + """
+    FROM {table}_search AS s
+    JOIN {table} AS d ON d.{key} = s.rowid
+    LEFT JOIN {table}_counts AS c ON c.{key} = d.{key}
+    WHERE {table}_search MATCH :match
+    ORDER BY CASE WHEN :fuzzy THEN s.rank END, num_of_listens DESC, name
+    LIMIT :limit
+    """.format(table=table, key=key)) for table, key, name in SEARCH_TABLES}
+PREFIX_SEARCH_QUERIES = {table: sqlalchemy.text(SEARCH_COLUMNS.format(kind=table[:-1], name=name) + """
+    FROM {table} AS d
+    LEFT JOIN {table}_counts AS c ON c.{key} = d.{key}
+    WHERE d.{name} LIKE :pattern ESCAPE '\\'
+    ORDER BY num_of_listens DESC, name
+    LIMIT :limit
+    """.format(table=table, key=key, name=name)) for table, key, name in SEARCH_TABLES}
+SESSIONS_QUERY = sqlalchemy.text("""
+    SELECT strftime('%Y-%m-%d %H:%M:%S', started_at / 1000, 'unixepoch', 'localtime') AS start_time,
+        strftime('%Y-%m-%d %H:%M:%S', last_played_at / 1000, 'unixepoch', 'localtime') AS end_time,
+        num_plays, (last_played_at - started_at) / 60000.0 AS length_in_minutes, total_duration AS total_duration_in_ms
+    FROM listening_sessions
+    WHERE start_date BETWEEN :start_date AND :end_date
+    ORDER BY first_played_at
+    """)
+SESSION_GAP_QUERY = sqlalchemy.text("""
+    SELECT value FROM etl_state WHERE name = :name
+    """)
+DAILY_PLAYS_QUERY = sqlalchemy.text("""
+    SELECT date_played, num_plays, total_duration
+    FROM daily_totals
+    WHERE num_plays > 0
+    ORDER BY date_played
+    """)
+
+PLAY_COLUMNS_QUERY = """
+    SELECT {columns}
+    FROM plays
+    WHERE played_at >= :start_ms AND played_at < :end_ms
+    ORDER BY played_at
+    """
+DIMENSION_NAMES_QUERY = """
+    SELECT {key}, {column} FROM {table} WHERE {key} IN ({keys})
+    """
+
+# the number of plays read from the database at a time when browsing a range of the listening history
+HISTORY_CHUNK_SIZE = 50
+
+# the columns shown when browsing the listening history
+DAYS_HISTORY_COLUMNS = ["track_name", "artist_name", "album_name", "release_date", "date_played", "time_played", "duration"]
+
+# the lengths of time that get_total_durations can add up listening durations over
+GRANULARITIES = ("day", "week", "month")
+
+# the dates used in place of the start or end of a range that was not given
+FIRST_DATE = "0000-01-01"
+LAST_DATE = "9999-12-31"
+
+# the number of weeks shown on the listening calendar, and the number of bars the lengths of listening sessions are grouped into
+CALENDAR_WEEKS = 52
+SESSION_LENGTH_BINS = 30
+
+
+def get_date_range_bounds(start_date, end_date):
+    '''(str, str) -> dict
+    Given a start and end date (inclusive), this function returns the unix timestamps in milliseconds of midnight at the start of the range
+    and midnight after the end of the range, so that the range can be found by seeking the played_at key.
+    '''
+    day_after_end_date = (datetime.date.fromisoformat(end_date) + datetime.timedelta(days=1)).isoformat()
+    return({"start_ms": get_date_unix_timestamp(start_date), "end_ms": get_date_unix_timestamp(day_after_end_date)})
+
+
+@traced
+@cached_query
 def get_days_history(inp_date):
     '''(str) -> Dataframe
     Given a date, this function returns a dataframe containing the complete listening
     history for the provided date.
     '''
-    # define the query depending on the desired date
-    query = """
-        SELECT track_name, artist_name, album_name, release_date, date_played, time_played, duration
-        FROM complete_listening_history WHERE date_played = "{inp_date}" ORDER BY time_played
-    """.format(inp_date=inp_date)
-    # establish a connection to the database
-    engine = sqlalchemy.create_engine(DATABASE_LOCATION)
     # retrieve, increment the index and return the dataframe based on the above query
-    df = pd.read_sql_query(sql=query, con=engine)
+    df = pd.read_sql_query(sql=DAYS_HISTORY_QUERY, con=get_engine(), params=get_date_range_bounds(inp_date, inp_date))
     df.index += 1
     return(df)
 
 
-def get_most_listened(column, limit):
-    '''(str, int) -> Dataframe
+def get_name_pattern(name):
+    '''(str) -> str
+    Given part of a name, this function returns the pattern that matches any name containing it, ignoring case, or None if no name was given.
+    '''
+    if not name:
+        return(None)
+    return("%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+
+
+def iter_history(start_date, end_date, artist=None, album=None, chunk_size=HISTORY_CHUNK_SIZE):
+    '''(str, str, str, str, int) -> generator of Dataframe
+    Given a start and end date (inclusive), and optionally part of an artist or album name to filter by, this function yields the listening history
+    in that range a chunk of plays at a time, oldest first, numbered from 1 across the chunks. Each chunk is read with its own short query that seeks
+    the played_at key from where the last chunk ended, so only one chunk is held in memory, the first is returned as soon as it is read
+    and no read transaction is held open while the chunks are shown.
+    '''
+    bounds = get_date_range_bounds(start_date, end_date)
+    params = {"after": bounds["start_ms"] - 1, "end_ms": bounds["end_ms"], "artist": get_name_pattern(artist), "album": get_name_pattern(album),
+              "limit": int(chunk_size)}
+    num_read = 0
+    while True:
+        with span("view_listening_history.iter_history") as span_record, get_engine().connect() as conn:
+            rows = conn.exec_driver_sql(HISTORY_CHUNK_QUERY, params).all()
+            span_record["rows"] = len(rows)
+        if not rows:
+            return
+        df = pd.DataFrame([row[1:] for row in rows], columns=DAYS_HISTORY_COLUMNS)
+        df.index += num_read + 1
+        num_read += len(rows)
+        yield df
+        if len(rows) < chunk_size:
+            return
+        params["after"] = rows[-1][0]
+
+
+@traced
+def get_play_columns(columns, start_date=None, end_date=None):
+    '''(list of str, str, str) -> dict of ndarray
+    Given columns of the plays table and a start and end date (inclusive, the whole history by default), this function returns an array of each column
+    for the plays between the dates, oldest first. They are read from the columnar archive if it is up to date (see archive.py), without copying them
+    for the months of the archive that are read, and otherwise from the database.
+    '''
+    from SpotifyHistory.archive import ARCHIVE_COLUMNS, COLUMN_EXPRESSIONS, read_archive
+    columns = list(columns)
+    result = read_archive(columns, start_date, end_date)
+    if result is not None:
+        return(result)
+    query = PLAY_COLUMNS_QUERY.format(columns=", ".join(COLUMN_EXPRESSIONS[column] for column in columns))
+    with get_engine().connect() as conn:
+        # seek the played_at key rather than the date index, so that the plays are read in order without being sorted
+        bounds = {"start_ms": get_date_range_bounds(start_date, start_date)["start_ms"] if start_date else -1,
+                  "end_ms": get_date_range_bounds(end_date, end_date)["end_ms"] if end_date else 2 ** 63 - 1}
+        rows = conn.exec_driver_sql(query, bounds).all()
+    values = list(zip(*rows)) or [[] for column in columns]
+    return({column: np.array(column_values, dtype=ARCHIVE_COLUMNS[column]) for column, column_values in zip(columns, values)})
+
+
+@traced
+def get_most_listened_between(column, limit, start_date=None, end_date=None):
+    '''(str, int, str, str) -> Dataframe
+    Given a column in the dataframe, a limit and a start and end date (inclusive), this function returns a dataframe containing the tracks, artists or albums
+    listened to most between the dates, counted from the keys of the plays in that range, and only looking up the names of those that are returned.
+    '''
+    table, key = MOST_LISTENED_COLUMNS[column]
+    # count the plays of each key, and keep every key with at least as many plays as the one at the limit so that ties can be broken by name
+    counts = np.bincount(get_play_columns([key], start_date, end_date)[key])
+    order = np.argsort(-counts, kind="stable")
+    order = order[counts[order] > 0]
+    if len(order) > limit:
+        order = order[counts[order] >= counts[order[limit - 1]]]
+    with get_engine().connect() as conn:
+        names = dict(conn.exec_driver_sql(DIMENSION_NAMES_QUERY.format(key=key, column=column, table=table, keys=", ".join(str(int(k)) for k in order))).all()) if len(order) else {}
+    rows = sorted(((names.get(int(k)), int(counts[k])) for k in order), key=lambda row: (-row[1], row[0] or ""))[:limit]
+    most_listened_df = pd.DataFrame(rows, columns=[column, "num_of_listens"])
+    most_listened_df.index += 1
+    return(most_listened_df)
+
+
+@traced
+@cached_query
+def get_most_listened(column, limit, start_date=None, end_date=None):
+    '''(str, int, str, str) -> Dataframe
     Given a column in the dataframe and a limit, this function returns a dataframe containing the
-    top 1, 5 or 10 tracks, artists or albums listened to by the user. 
-    '''
-    # define the query depending on the desired column and limit
-    query = """
-        SELECT {column}, COUNT(*) AS num_of_listens FROM complete_listening_history
-        GROUP BY {column}
-        ORDER BY COUNT(*) DESC, {column}
-        LIMIT {limit}
-        """.format(column=column, limit=limit)
-    # establish a connection to the database
-    engine = sqlalchemy.create_engine(DATABASE_LOCATION)
-    # retrieve, increment the index and return the dataframe based on the above query
-    most_listened_df = pd.read_sql_query(sql=query, con=engine)
+    top 1, 5 or 10 tracks, artists or albums listened to by the user, throughout the listening history or between the given dates (inclusive).
+    '''
+    # the column cannot be a bound parameter, so only allow the columns that have a prepared query
+    if column not in MOST_LISTENED_QUERIES:
+        raise ValueError("Cannot rank listening history by column: " + str(column))
+    if start_date is not None or end_date is not None:
+        return(get_most_listened_between(column, int(limit), start_date, end_date))
+    # retrieve, increment the index and return the dataframe based on the query for the desired column
+    most_listened_df = pd.read_sql_query(sql=MOST_LISTENED_QUERIES[column], con=get_engine(), params={"limit": int(limit)})
+    most_listened_df.index += 1
+    return(most_listened_df)
+
+
+@traced
+def get_leaderboard(column, limit, period="all", date=None, exact=False):
+    '''(str, int, str, str, Boolean) -> Dataframe
+    Given a column in the dataframe, a limit, a period ("all", "year", "month" or "week") and a date, this function returns a dataframe containing the tracks,
+    artists or albums listened to most in the window of that period the date falls in (today's by default). The counts of a year, month or week are read from
+    the approximate most played counters (see heavy_hitters.py), with the fewest plays each could have had, unless exact is True, in which case the plays
+    in the window are counted instead.
+    '''
+    if column not in LEADERBOARD_QUERIES:
+        raise ValueError("Cannot rank listening history by column: " + str(column))
+    # work out today's date before the cache is looked up, so that a cached leaderboard is not reused for the day before
+    return(get_leaderboard_on(column, limit, period, date or datetime.date.today().isoformat(), exact))
+
+
+@cached_query
+def get_leaderboard_on(column, limit, period, date, exact):
+    '''(str, int, str, str, Boolean) -> Dataframe
+    This function returns the leaderboard of get_leaderboard for the window of the given period that the given date falls in.
+    '''
+    from SpotifyHistory.heavy_hitters import get_period_starts, get_window_bounds
+    # the all time counts are kept exactly in the summary tables, so they are never approximated
+    if exact or period == "all":
+        leaderboard_df = get_most_listened(column, limit, *(get_window_bounds(period, date) if period != "all" else (None, None)))
+        leaderboard_df["min_num_of_listens"] = leaderboard_df["num_of_listens"]
+        return(leaderboard_df)
+    params = {"dimension": MOST_LISTENED_COLUMNS[column][0], "period": period, "period_start": str(get_period_starts(period, [date])[0]), "limit": int(limit)}
+    leaderboard_df = pd.read_sql_query(sql=LEADERBOARD_QUERIES[column], con=get_engine(), params=params)
+    leaderboard_df.index += 1
+    return(leaderboard_df)
+
+
+@traced
+@cached_query
+def get_top_genres(limit):
+    '''(int) -> Dataframe
+    Given a limit, this function returns a dataframe of the genres listened to most, with the number of plays and total duration of each. A play counts towards
+    every genre of every artist credited on its track, so only tracks whose metadata has been fetched (see enrich.py) are included.
+    '''
+    top_genres_df = pd.read_sql_query(sql=TOP_GENRES_QUERY, con=get_engine(), params={"limit": int(limit)})
+    top_genres_df.index += 1
+    return(top_genres_df)
+
+
+@traced
+@cached_query
+def get_most_listened_credited_artists(limit):
+    '''(int) -> Dataframe
+    Given a limit, this function returns a dataframe of the artists listened to most, counting a play towards every artist credited on its track,
+    including featured artists, rather than only the album's artist. Only tracks whose metadata has been fetched (see enrich.py) are included.
+    '''
+    most_listened_df = pd.read_sql_query(sql=TOP_CREDITED_ARTISTS_QUERY, con=get_engine(), params={"limit": int(limit)})
     most_listened_df.index += 1
     return(most_listened_df)
 
 
+def get_search_match(text, fuzzy=False):
+    '''(str, Boolean) -> str
+    Given part of a name, this function returns the full-text query that finds every name containing it, or, if fuzzy is True, every name sharing
+    any three characters in a row with it, so that a misspelt name is still found. None is returned if it is too short to be found by the trigram index.
+    '''
+    text = text.strip().lower()
+    if len(text) < MIN_SEARCH_LENGTH:
+        return(None)
+    if not fuzzy:
+        return('"' + text.replace('"', '""') + '"')
+    trigrams = sorted({text[i:i + MIN_SEARCH_LENGTH] for i in range(len(text) - MIN_SEARCH_LENGTH + 1)})
+    return(" OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in trigrams))
+
+
+@traced
+@cached_query
+def search_names(text, tables=("tracks", "artists", "albums"), limit=10, fuzzy=False):
+    '''(str, tuple of str, int, Boolean) -> Dataframe
+    Given part of a name, this function returns a dataframe of the tracks, artists and albums (or only those of the given tables) whose names contain it,
+    ignoring case, with the number of times each was played, the total time it was listened to and when it was first and last played. Up to limit matches
+    of each table are returned, the most played first, found through the trigram index of the names (see database.py) rather than by reading every name.
+    If fuzzy is True, the names sharing the most of its three letter sequences are returned first instead, so that misspellings are matched. Text shorter
+    than three characters can only be matched at the start of a name, which reads every name.
+    '''
+    match = get_search_match(text, fuzzy)
+    dfs = []
+    with get_engine().connect() as conn:
+        for table, key, name in SEARCH_TABLES:
+            if table not in tables:
+                continue
+            if match is None:
+                result = conn.execute(PREFIX_SEARCH_QUERIES[table], {"pattern": (get_name_pattern(text.strip()) or "%")[1:], "limit": int(limit)})
+            else:
+                result = conn.execute(SEARCH_QUERIES[table], {"match": match, "fuzzy": fuzzy, "limit": int(limit)})
+            dfs.append(pd.DataFrame(result.all(), columns=list(result.keys())))
+    search_df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+    search_df.index += 1
+    return(search_df)
+
+
+@traced
+@cached_query
 def get_num_songs_by_time(time):
     '''(str) -> int
     Given the hour, this function returns the total number of songs that have been listened to at that hour throughout the user's listening history.
     '''
-    query = """
-        SELECT COUNT(*) AS num_songs
-        FROM complete_listening_history
-        WHERE time_played LIKE "{time}:__:__:___"
-        """.format(time=time)
-    # establish a connection to the database
-    engine = sqlalchemy.create_engine(DATABASE_LOCATION)
-    # store and return the sum of listening duration for the given date
-    num_songs = pd.read_sql_query(sql=query, con=engine)
-    return(num_songs["num_songs"][0])
+    # store and return the number of songs played during the given hour
+    with get_engine().connect() as conn:
+        num_songs = conn.execute(NUM_SONGS_BY_TIME_QUERY, {"hour": int(time)}).scalar()
+    return(num_songs)
+
+
+@traced
+@cached_query
+def get_num_songs_by_hour(by_weekday=False, start_date=None, end_date=None):
+    '''(Boolean, str, str) -> list of int or list of list of int
+    This function returns the total number of songs listened to during each hour of the day (midnight first) throughout the user's listening history,
+    or between the given dates (inclusive). If by_weekday is True, one such list is returned for each day of the week (Sunday first) instead.
+    '''
+    if start_date is not None or end_date is not None:
+        # the hourly counts cover the whole history, so count the plays in the range into every (day of week, hour) bucket at once,
+        # skipping the plays stored without an hour or day of the week
+        plays = get_play_columns(["hour_played", "weekday_played"], start_date, end_date)
+        known = (plays["hour_played"] >= 0) & (plays["weekday_played"] >= 0)
+        buckets = plays["weekday_played"][known].astype(np.int64) * 24 + plays["hour_played"][known]
+        num_songs = np.bincount(buckets, minlength=7 * 24).reshape(7, 24).tolist()
+    else:
+        # read the number of songs played in every (hour, day of week) bucket from the hourly counts, skipping the plays stored without an hour or day of the week
+        with get_engine().connect() as conn:
+            rows = conn.execute(NUM_SONGS_BY_HOUR_QUERY).all()
+        # fill in the buckets that were returned, leaving every hour with no songs at 0
+        num_songs = [[0] * 24 for i in range(7)]
+        for hour, weekday, count in rows:
+            num_songs[weekday][hour] = count
+    if by_weekday:
+        return(num_songs)
+    return([sum(day[hour] for day in num_songs) for hour in range(24)])
 
 
+@traced
+@cached_query
 def get_total_duration(date):
     '''(str) -> int
     Given a date, this function returns the total duration spent listening to music on that date in milliseconds.
     '''
-    query = """
-        SELECT COALESCE(SUM(duration_in_ms), 0) AS total_duration
-        FROM complete_listening_history
-        WHERE date_played = "{date}"
-        """.format(date=date)
-    # establish a connection to the database
-    engine = sqlalchemy.create_engine(DATABASE_LOCATION)
     # store and return the sum of listening duration for the given date
-    duration_in_ms = pd.read_sql_query(sql=query, con=engine)
-    return(duration_in_ms["total_duration"][0])
+    with get_engine().connect() as conn:
+        duration_in_ms = conn.execute(TOTAL_DURATION_QUERY, {"date": date}).scalar()
+    return(duration_in_ms)
+
+
+@traced
+@cached_query
+def get_total_durations(start_date, end_date, granularity="day"):
+    '''(str, str, str) -> Series
+    Given a start and end date (inclusive), this function returns the total duration spent listening to music in milliseconds for every day,
+    week (starting on Sunday) or month in that range, indexed by the first date of each period and with 0 for periods with no songs played.
+    '''
+    if granularity not in GRANULARITIES:
+        raise ValueError("Invalid granularity: " + str(granularity))
+    # look up the listening duration of every day in the range that has songs played from the daily totals
+    with get_engine().connect() as conn:
+        rows = conn.execute(TOTAL_DURATIONS_QUERY, {"start_date": start_date, "end_date": end_date}).all()
+    daily_durations = pd.Series({date: int(total) for date, total in rows}, dtype="int64")
+    # fill in every day without any songs played with a duration of 0
+    days = pd.date_range(start_date, end_date, freq="D")
+    daily_durations = daily_durations.reindex(days.strftime("%Y-%m-%d"), fill_value=0)
+    if granularity == "day":
+        return(daily_durations)
+    # otherwise, add up the days belonging to each week or month and label each period by its first date
+    if granularity == "week":
+        period_starts = days - pd.to_timedelta((days.weekday + 1) % 7, unit="D")
+    else:
+        period_starts = days.to_period("M").to_timestamp()
+    durations = daily_durations.groupby(period_starts.strftime("%Y-%m-%d")).sum()
+    return(durations)
+
+
+@traced
+@cached_query
+def get_sessions(start_date=None, end_date=None):
+    '''(str, str) -> Dataframe
+    Given a start and end date (inclusive, the whole history by default), this function returns a dataframe of the listening sessions that started
+    between the dates (see sessions.py), oldest first, with the local time each started and ended, its number of plays, its length in minutes
+    from the start of its first play to the end of its last and the total duration of its plays.
+    '''
+    sessions_df = pd.read_sql_query(sql=SESSIONS_QUERY, con=get_engine(), params={"start_date": start_date or FIRST_DATE, "end_date": end_date or LAST_DATE})
+    sessions_df.index += 1
+    return(sessions_df)
+
+
+@traced
+@cached_query
+def get_session_summary(start_date=None, end_date=None):
+    '''(str, str) -> dict
+    Given a start and end date (inclusive, the whole history by default), this function returns the number of listening sessions that started between
+    the dates, their median, mean and longest length in minutes, the mean number of plays per session and the gap in minutes the sessions were split by.
+    '''
+    from SpotifyHistory.sessions import GAP_STATE, SESSION_GAP_MINUTES
+    sessions_df = get_sessions(start_date, end_date)
+    lengths = sessions_df["length_in_minutes"].to_numpy(dtype=float)
+    with get_engine().connect() as conn:
+        gap_minutes = conn.execute(SESSION_GAP_QUERY, {"name": GAP_STATE}).scalar()
+    return({"num_sessions": len(lengths),
+            "median_length_in_minutes": round(float(np.median(lengths)), 1) if len(lengths) else 0,
+            "mean_length_in_minutes": round(float(lengths.mean()), 1) if len(lengths) else 0,
+            "longest_length_in_minutes": round(float(lengths.max()), 1) if len(lengths) else 0,
+            "mean_plays_per_session": round(float(sessions_df["num_plays"].mean()), 1) if len(lengths) else 0,
+            "gap_minutes": SESSION_GAP_MINUTES if gap_minutes is None else gap_minutes})
+
+
+@traced
+@cached_query
+def get_listening_streaks(limit=10):
+    '''(int) -> Dataframe
+    Given a limit, this function returns a dataframe of the longest streaks of consecutive days with any plays, longest and then most recent first,
+    with the first and last date of each, its number of days and its number of plays and total duration, found in one pass over the daily totals.
+    '''
+    with get_engine().connect() as conn:
+        rows = conn.execute(DAILY_PLAYS_QUERY).all()
+    dates = np.array([row[0] for row in rows], dtype="datetime64[D]")
+    starts, ends = get_streaks(dates)
+    # add up the plays and durations of each streak from the running totals at its first and last day
+    num_plays = np.concatenate([[0], np.cumsum([row[1] for row in rows], dtype=np.int64)])
+    durations = np.concatenate([[0], np.cumsum([row[2] for row in rows], dtype=np.int64)])
+    streaks_df = pd.DataFrame({"start_date": dates[starts].astype(str), "end_date": dates[ends].astype(str), "num_days": ends - starts + 1,
+                               "num_plays": num_plays[ends + 1] - num_plays[starts], "total_duration_in_ms": durations[ends + 1] - durations[starts]})
+    streaks_df = streaks_df.sort_values(["num_days", "start_date"], ascending=False, kind="stable").head(int(limit)).reset_index(drop=True)
+    streaks_df.index += 1
+    return(streaks_df)
+
+
+@traced
+def get_current_streak(date=None):
+    '''(str) -> dict
+    Given a date (today by default), this function returns the first and last date and the number of days of the streak of consecutive days with plays
+    that ends on the date, or on the day before if nothing has been played on the date yet, with 0 days if there is no such streak.
+    '''
+    # work out today's date before the cache is looked up, so that a cached streak is not reused for the day before
+    return(get_streak_ending(date or datetime.date.today().isoformat()))
+
+
+@cached_query
+def get_streak_ending(date):
+    '''(str) -> dict
+    This function returns the streak of get_current_streak for the given date.
+    '''
+    date = np.datetime64(date, "D")
+    with get_engine().connect() as conn:
+        dates = np.array([row[0] for row in conn.execute(DAILY_PLAYS_QUERY).all()], dtype="datetime64[D]")
+    dates = dates[dates <= date]
+    starts, ends = get_streaks(dates)
+    if len(dates) == 0 or dates[-1] < date - 1:
+        return({"start_date": None, "end_date": None, "num_days": 0})
+    return({"start_date": str(dates[starts[-1]]), "end_date": str(dates[-1]), "num_days": int(ends[-1] - starts[-1] + 1)})
+
+
+def get_calendar_dates(date, num_weeks=CALENDAR_WEEKS):
+    '''(str) -> str, str
+    Given a date, this function returns the Sunday num_weeks - 1 weeks before the week of the date and the Saturday at the end of the week of the date,
+    the first and last day shown on the listening calendar.
+    '''
+    date = datetime.date.fromisoformat(date)
+    saturday = date + datetime.timedelta(days=6 - (date.weekday() + 1) % 7)
+    return((saturday - datetime.timedelta(days=7 * num_weeks - 1)).isoformat(), saturday.isoformat())
 
 
 def add_value_labels(durations_in_ms, duration_labels, plot, double = False):
@@ -100,58 +556,56 @@ def add_value_labels_scatter(durations_in_ms, duration_labels, plot):
             plot.text(i, durations_in_ms[i] + 200000, duration_labels[i], color="black")
 
 
-def plot_num_songs_by_time(time_labels, num_songs):
-    '''(list of str, list of int) -> Nonetype
-    This function outputs a bar chart showing the total number of songs played by time of day.
+def draw_num_songs_by_time(fig, time_labels, num_songs):
+    '''(matplotlib.figure.Figure, list of str, list of int) -> Nonetype
+    This function draws a bar chart showing the total number of songs played by time of day on the given figure.
     '''
+    ax = fig.add_subplot()
     # make a bar chart where the x-coordinates are the times of the day and the height of each bar is the corresponding number of songs played
-    plt.bar(time_labels, num_songs)
+    ax.bar(time_labels, num_songs)
     # set the title and axis labels
-    plt.title("Total Number of Songs Listened by Time of Day")
-    plt.ylabel("Total Number of Songs")
-    plt.xlabel("Time of Day")
+    ax.set_title("Total Number of Songs Listened by Time of Day")
+    ax.set_ylabel("Total Number of Songs")
+    ax.set_xlabel("Time of Day")
     # rotate the x ticks to be vertical
-    plt.xticks(rotation=90)
+    ax.tick_params(axis="x", labelrotation=90)
     # label each of the bars with the corresponding number of songs
     for i in range(len(num_songs)):
         if num_songs[i] != 0:
-            plt.text(i, num_songs[i], num_songs[i])
-    # show the plot
-    plt.show()
+            ax.text(i, num_songs[i], num_songs[i])
 
 
-def plot_daily_duration(week_dates, durations_in_ms, duration_labels):
-    '''(list of str, list of int, list of str) -> Nonetype
-    This function outputs a bar chart showing the user's daily time spent listening to music for the given week.
+def draw_daily_duration(fig, week_dates, durations_in_ms, duration_labels):
+    '''(matplotlib.figure.Figure, list of str, list of int, list of str) -> Nonetype
+    This function draws a bar chart showing the user's daily time spent listening to music for the given week on the given figure.
     '''
     # store the days of the week in a list to be used as the x-axis labels
     days_of_week = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+    ax = fig.add_subplot()
     # make a bar chart where the x-coordinates are the days of the week and the height of each bar is the corresponding time spent listening to music
-    plt.bar(days_of_week, durations_in_ms)
+    ax.bar(days_of_week, durations_in_ms)
     # set the title and y-axis label
-    plt.title("Time Spent Listening By Day For " + week_dates[0] + " to " + week_dates[6])
-    plt.ylabel("Time Spent Listening")
+    ax.set_title("Time Spent Listening By Day For " + week_dates[0] + " to " + week_dates[6])
+    ax.set_ylabel("Time Spent Listening")
     # remove the y-axis ticks
-    ax = plt.gca()
     ax.set_yticks([])
     # add the value labels for each bar
     add_value_labels(durations_in_ms, duration_labels, ax)
-    # show the bar chart
-    plt.show()
-    
 
-def plot_weekly_comparison(all_dates, all_durations_in_ms, all_duration_labels, duration_differences, duration_difference_labels):
-    '''(list of str, list of int, list of str, list of int, list of str) -> Nonetype
-    This function outputs a double bar chart showing the user's daily time spent listening to music for the past two weeks
-    and a scatterplot comparing the time spent listening per day between the two weeks.
+
+def draw_weekly_comparison(fig, all_dates, all_durations_in_ms, all_duration_labels, duration_differences, duration_difference_labels):
+    '''(matplotlib.figure.Figure, list of str, list of int, list of str, list of int, list of str) -> Nonetype
+    This function draws a double bar chart showing the user's daily time spent listening to music for the past two weeks
+    and a scatterplot comparing the time spent listening per day between the two weeks on the given figure.
     '''
+    from matplotlib.lines import Line2D
     # store the days of the week in a list to be used as the x-axis labels
     days_of_week = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
     # set the locations for the bars along the x-axis and the width of the bars
     x = np.arange(len(days_of_week))
     width = 0.35
     # create a set of two subplots
-    fig, ax = plt.subplots(2,1)
+    ax = fig.subplots(2,1)
 
     # DOUBLE BAR CHART
     # plot the bars in the first subplot
@@ -196,5 +650,104 @@ def plot_weekly_comparison(all_dates, all_durations_in_ms, all_duration_labels,
                        Line2D([0],[0], marker='o', color='white', markerfacecolor='red', label="Listened Less Last Week")]
     ax[1].legend(handles=legend_elements)
 
-    # show the two subplots
-    plt.show()
\ No newline at end of file
+
+def draw_session_lengths(fig, session_lengths, gap_minutes, start_date, end_date):
+    '''(matplotlib.figure.Figure, list of float, float, str, str) -> Nonetype
+    This function draws a histogram of the lengths in minutes of the listening sessions that started between the given dates on the given figure,
+    marking the median length.
+    '''
+    ax = fig.add_subplot()
+    # group the session lengths into bars, and mark the median length with a dashed line
+    ax.hist(session_lengths, bins=SESSION_LENGTH_BINS, color="tab:blue")
+    if len(session_lengths):
+        median = float(np.median(session_lengths))
+        ax.axvline(median, color="grey", linestyle="--", label="Median: " + str(round(median)) + " minutes")
+        ax.legend()
+    # set the title and axis labels
+    ax.set_title("Length Of Listening Sessions From " + start_date + " to " + end_date + " (Plays Less Than " + str(gap_minutes) + " Minutes Apart)")
+    ax.set_xlabel("Session Length (Minutes)")
+    ax.set_ylabel("Number of Sessions")
+
+
+def draw_listening_calendar(fig, day_dates, durations_in_ms, current_streak, longest_streak):
+    '''(matplotlib.figure.Figure, list of str, list of int, dict, dict) -> Nonetype
+    This function draws a calendar of the time spent listening to music on each day of the given whole weeks, one column per week from Sunday to Saturday,
+    on the given figure, with the current and longest streaks of consecutive days with plays in the title.
+    '''
+    days_of_week = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+    ax = fig.add_subplot()
+    # arrange the minutes listened on each day into a grid with a row for each day of the week and a column for each week
+    minutes = np.asarray(durations_in_ms, dtype=float).reshape(-1, 7).T / 60000
+    image = ax.imshow(np.ma.masked_equal(minutes, 0), cmap="Greens", aspect="auto", interpolation="nearest")
+    fig.colorbar(image, ax=ax, label="Minutes Listened")
+    # label each row with its day of the week and every fourth column with the date of its Sunday
+    ax.set_yticks(range(7))
+    ax.set_yticklabels(days_of_week)
+    ax.set_xticks(range(0, minutes.shape[1], 4))
+    ax.set_xticklabels(day_dates[0::28], rotation=90)
+    ax.set_title("Time Spent Listening By Day For " + day_dates[0] + " to " + day_dates[-1] + "\nCurrent Streak: " + str(current_streak["num_days"])
+                 + " Days, Longest Streak: " + str(longest_streak["num_days"]) + " Days"
+                 + (" (" + longest_streak["start_date"] + " to " + longest_streak["end_date"] + ")" if longest_streak["num_days"] else ""))
+
+
+def show_chart(draw, *args):
+    '''(function, ...) -> Nonetype
+    This function draws a chart with the given draw function and arguments on a new pyplot figure, shows it and releases it once it has been closed.
+    '''
+    from matplotlib import pyplot as plt
+    fig = plt.figure()
+    draw(fig, *args)
+    plt.show()
+    plt.close(fig)
+
+
+def render_chart(draw, *args, path=None, image_format="png", size=(10, 6), dpi=100):
+    '''(function, ..., str, str, tuple of float, int) -> bytes
+    This function draws a chart with the given draw function and arguments on a standalone figure, without pyplot or a display, and saves it as a png or svg
+    to the given path, or returns the image as bytes if no path is given. Nothing is kept once the chart has been rendered.
+    '''
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=size, dpi=dpi, layout="tight")
+    draw(fig, *args)
+    if path is not None:
+        fig.savefig(path, format=image_format)
+        return(None)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=image_format)
+    return(buffer.getvalue())
+
+
+def plot_num_songs_by_time(time_labels, num_songs):
+    '''(list of str, list of int) -> Nonetype
+    This function outputs a bar chart showing the total number of songs played by time of day.
+    '''
+    show_chart(draw_num_songs_by_time, time_labels, num_songs)
+
+
+def plot_daily_duration(week_dates, durations_in_ms, duration_labels):
+    '''(list of str, list of int, list of str) -> Nonetype
+    This function outputs a bar chart showing the user's daily time spent listening to music for the given week.
+    '''
+    show_chart(draw_daily_duration, week_dates, durations_in_ms, duration_labels)
+
+
+def plot_weekly_comparison(all_dates, all_durations_in_ms, all_duration_labels, duration_differences, duration_difference_labels):
+    '''(list of str, list of int, list of str, list of int, list of str) -> Nonetype
+    This function outputs a double bar chart showing the user's daily time spent listening to music for the past two weeks
+    and a scatterplot comparing the time spent listening per day between the two weeks.
+    '''
+    show_chart(draw_weekly_comparison, all_dates, all_durations_in_ms, all_duration_labels, duration_differences, duration_difference_labels)
+
+
+def plot_session_lengths(session_lengths, gap_minutes, start_date, end_date):
+    '''(list of float, float, str, str) -> Nonetype
+    This function outputs a histogram of the lengths of the user's listening sessions between the given dates.
+    '''
+    show_chart(draw_session_lengths, session_lengths, gap_minutes, start_date, end_date)
+
+
+def plot_listening_calendar(day_dates, durations_in_ms, current_streak, longest_streak):
+    '''(list of str, list of int, dict, dict) -> Nonetype
+    This function outputs a calendar of the user's time spent listening to music by day, with their current and longest listening streaks.
+    '''
+    show_chart(draw_listening_calendar, day_dates, durations_in_ms, current_streak, longest_streak)
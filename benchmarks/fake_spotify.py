@@ -0,0 +1,222 @@
+import argparse
+import datetime
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+# the number of plays generated for each account, how far apart they are in minutes and the number of distinct tracks they are drawn from
+NUM_PLAYS = 500
+PLAY_GAP_MINUTES = 4
+NUM_TRACKS = 200
+
+# the most items returned in one page, as for the real endpoint
+PAGE_LIMIT = 50
+
+# the genres given to the artists
+GENRES = ["pop", "rock", "indie rock", "hip hop", "jazz", "classical", "electronic", "folk", "r&b", "metal"]
+
+
+def get_artist(artist_num):
+    '''(int) -> dict
+    This function returns the full artist object of the given artist.
+    '''
+    return({"id": "artist" + str(artist_num), "name": "Artist " + str(artist_num), "popularity": artist_num * 7 % 100,
+            "followers": {"total": artist_num * 1013}, "genres": [GENRES[artist_num % len(GENRES)], GENRES[artist_num * 3 % len(GENRES)]]})
+
+
+def get_album(album_num):
+    '''(int) -> dict
+    This function returns the simplified album object of the given album.
+    '''
+    return({"id": "album" + str(album_num), "name": "Album " + str(album_num), "release_date": str(2000 + album_num % 25) + "-01-01",
+            "album_type": "album", "total_tracks": 10, "artists": [{"id": "artist" + str(album_num // 2), "name": "Artist " + str(album_num // 2)}]})
+
+
+def get_track(track_num):
+    '''(int) -> dict
+    This function returns the full track object of the given track, with a featured artist on every third track.
+    '''
+    album = get_album(track_num // 10)
+    artists = list(album["artists"])
+    if track_num % 3 == 0:
+        artists.append({"id": "artist" + str(track_num % 50 + 100), "name": "Artist " + str(track_num % 50 + 100)})
+    return({"id": "track" + str(track_num), "name": "Track " + str(track_num), "duration_ms": 120000 + track_num * 997 % 180000,
+            "popularity": track_num % 100, "explicit": track_num % 4 == 0, "album": album, "artists": artists})
+
+
+def get_object(kind, object_id):
+    '''(str, str) -> dict
+    This function returns the object of the given kind ("tracks", "artists" or "albums") and id, or None if there is no such object.
+    '''
+    prefix = kind[:-1]
+    if not object_id.startswith(prefix) or not object_id[len(prefix):].isdigit():
+        return(None)
+    num = int(object_id[len(prefix):])
+    if kind == "tracks":
+        return(get_track(num))
+    if kind == "artists":
+        return(get_artist(num))
+    return(dict(get_album(num), label="Label " + str(num % 7), popularity=num % 100))
+
+
+def get_plays(user, now_ms):
+    '''(str, int) -> list of dict
+    This function returns the plays of the given user's account, oldest first, generated the same way every time so that repeated runs see the same history.
+    '''
+    rng = random.Random(user)
+    end_ms = now_ms - now_ms % (PLAY_GAP_MINUTES * 60000)
+    plays = []
+    for i in range(NUM_PLAYS):
+        played_at = end_ms - (NUM_PLAYS - i) * PLAY_GAP_MINUTES * 60000 + rng.randrange(1000)
+        plays.append({
+            "played_at": datetime.datetime.fromtimestamp(played_at / 1000, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            "played_at_ms": played_at,
+            "track": get_track(rng.randrange(NUM_TRACKS))
+        })
+    return(plays)
+
+
+class FakeSpotifyHandler(http.server.BaseHTTPRequestHandler):
+    '''A stand-in for the Spotify accounts service token endpoint and the recently played, tracks, artists and albums endpoints of the Web API.'''
+
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, body, headers=None):
+        '''(int, dict, dict) -> Nonetype
+        This method sends the given json response, keeping the connection open.
+        '''
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def is_rate_limited(self):
+        '''() -> Boolean
+        This method counts the request and sends a rate limited response to every nth request, if the server was started with a rate limit.
+        '''
+        server = self.server
+        with server.lock:
+            server.num_requests += 1
+            limited = server.rate_limit_every and server.num_requests % server.rate_limit_every == 0
+            if limited:
+                server.num_rate_limited += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if limited:
+            self.send_json(429, {"error": {"status": 429, "message": "API rate limit exceeded"}}, {"Retry-After": str(server.retry_after)})
+        return(limited)
+
+    def do_POST(self):
+        '''() -> Nonetype
+        This method grants tokens for an authorization code or a refresh token. A refresh token of "refresh-<user>" is accepted for any user,
+        and an authorization code of any value other than "bad" is exchanged for the refresh token of the user named by the code.
+        '''
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        if self.is_rate_limited():
+            return
+        if urllib.parse.urlparse(self.path).path != "/api/token" or not self.headers.get("Authorization", "").startswith("Basic "):
+            self.send_json(400, {"error": "invalid_client"})
+            return
+        grant_type = form.get("grant_type", [""])[0]
+        if grant_type == "authorization_code" and form.get("code", ["bad"])[0] != "bad":
+            user = form["code"][0]
+            self.send_json(200, {"access_token": "access-" + user, "token_type": "Bearer", "expires_in": 3600, "refresh_token": "refresh-" + user})
+        elif grant_type == "refresh_token" and form.get("refresh_token", [""])[0].startswith("refresh-"):
+            user = form["refresh_token"][0][len("refresh-"):]
+            self.send_json(200, {"access_token": "access-" + user, "token_type": "Bearer", "expires_in": 3600})
+        else:
+            self.send_json(400, {"error": "invalid_grant", "error_description": "Invalid authorization code"})
+
+    def do_GET(self):
+        '''() -> Nonetype
+        This method returns a page of the recently played tracks of the user named by the access token, or the tracks, artists or albums with the given ids.
+        As for the real endpoint, the most recent plays after (or before) the given unix timestamp in milliseconds come first, and the next page
+        goes back in time from the oldest play on the page with a before cursor, no longer bounded by the after timestamp.
+        '''
+        if self.is_rate_limited():
+            return
+        url = urllib.parse.urlparse(self.path)
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer access-"):
+            self.send_json(401, {"error": {"status": 401, "message": "Invalid access token"}})
+            return
+        query = urllib.parse.parse_qs(url.query)
+        # return the objects for several ids at once, up to the same limits as the real endpoints
+        kind = url.path[len("/v1/"):]
+        if kind in ("tracks", "artists", "albums"):
+            ids = query.get("ids", [""])[0].split(",")
+            if len(ids) > (20 if kind == "albums" else 50):
+                self.send_json(400, {"error": {"status": 400, "message": "Too many ids requested"}})
+                return
+            with self.server.lock:
+                self.server.num_objects_requested += len(ids)
+            self.send_json(200, {kind: [get_object(kind, object_id) for object_id in ids]})
+            return
+        if url.path != "/v1/me/player/recently-played":
+            self.send_json(404, {"error": {"status": 404, "message": "Service not found"}})
+            return
+        limit = min(int(query.get("limit", [PAGE_LIMIT])[0]), PAGE_LIMIT)
+        plays = get_plays(authorization[len("Bearer access-"):], self.server.now_ms)
+        if "before" in query:
+            plays = [play for play in plays if play["played_at_ms"] < int(query["before"][0])]
+        elif "after" in query:
+            plays = [play for play in plays if play["played_at_ms"] > int(query["after"][0])]
+        page = plays[:-limit - 1:-1]
+        items = [{"track": play["track"], "played_at": play["played_at"]} for play in page]
+        next_url = None
+        cursors = None
+        if page:
+            cursors = {"after": str(page[0]["played_at_ms"]), "before": str(page[-1]["played_at_ms"])}
+        if len(plays) > limit:
+            next_url = "http://" + self.headers["Host"] + url.path + "?" + urllib.parse.urlencode({"before": page[-1]["played_at_ms"], "limit": limit})
+        self.send_json(200, {"items": items, "next": next_url, "cursors": cursors, "limit": limit})
+
+    def log_message(self, format, *args):
+        '''(str) -> Nonetype
+        This method keeps the server quiet unless it was started with --verbose.
+        '''
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(port=0, rate_limit_every=0, retry_after=1, latency=0, verbose=False):
+    '''(int, int, int, float, Boolean) -> http.server.ThreadingHTTPServer
+    This function creates the stand-in server on the given port (any free port if 0), rate limiting every nth request if rate_limit_every is given
+    and delaying each response by the given latency in seconds.
+    '''
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), FakeSpotifyHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.num_requests = 0
+    server.num_rate_limited = 0
+    server.num_objects_requested = 0
+    server.rate_limit_every = rate_limit_every
+    server.retry_after = retry_after
+    server.latency = latency
+    server.verbose = verbose
+    server.now_ms = int(time.time() * 1000)
+    return(server)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run a local stand-in for the Spotify endpoints used by ingestion. Point the program at it with "
+                                                     "SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:PORT and SPOTIFY_API_URL=http://127.0.0.1:PORT/v1.")
+    arg_parser.add_argument("--port", type=int, default=8900, help="the port to listen on (default: 8900)")
+    arg_parser.add_argument("--rate-limit-every", type=int, default=0, help="respond to every nth request with 429 Too Many Requests")
+    arg_parser.add_argument("--retry-after", type=int, default=1, help="the Retry-After seconds sent with each 429 response (default: 1)")
+    arg_parser.add_argument("--latency", type=float, default=0, help="the seconds to wait before each response")
+    arg_parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = arg_parser.parse_args()
+    server = make_server(args.port, args.rate_limit_every, args.retry_after, args.latency, args.verbose)
+    print("Serving on http://127.0.0.1:" + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(str(server.num_requests) + " requests served, " + str(server.num_rate_limited) + " rate limited.")
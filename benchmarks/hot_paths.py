@@ -0,0 +1,192 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from synthetic import REPOSITORY_ROOT, DATA_LOCATION, SEED, SIZES, get_database, make_recently_played
+
+# the file each run of the benchmark is appended to, and the run that later runs are compared with. Both hold absolute timings of the machine
+# they were measured on, so neither is kept in git, and each machine stores its own baseline with --save-baseline
+HISTORY_LOCATION = os.path.join(REPOSITORY_ROOT, "benchmarks", "hot_paths_history.jsonl")
+BASELINE_LOCATION = os.path.join(REPOSITORY_ROOT, "benchmarks", "hot_paths_baseline.json")
+
+# the number of plays in the recently played response that is transformed, and in each batch that is loaded
+PAYLOAD_SIZE = 1000
+
+# a function is slower than the baseline if its median latency is more than TOLERANCE times the baseline's,
+# unless it is slower by less than MIN_REGRESSION_MS, which is within the noise of timing very fast functions
+TOLERANCE = 1.5
+MIN_REGRESSION_MS = 2.0
+
+
+def get_cases(database_location, payload):
+    '''(str, dict) -> list of tuple
+    This function returns the name of each function benchmarked against the given database, a function that calls it and the number of plays each call processes
+    (None when the call does not process a known number of plays). The dates the views are run for are chosen from the end of the history.
+    '''
+    from SpotifyHistory import view_listening_history as views
+    from SpotifyHistory import menu_functions as menu
+    from SpotifyHistory.compare_history import compare_periods
+    from SpotifyHistory.database import get_engine
+    from SpotifyHistory.etl_data import transform_todays_tracks, load_todays_tracks
+    with get_engine(database_location).connect() as conn:
+        last_date, num_plays = conn.exec_driver_sql("SELECT MAX(date_played), COUNT(*) FROM plays").one()
+    date = datetime.date.fromisoformat(last_date)
+    year_start = (date - datetime.timedelta(days=364)).isoformat()
+    month_start = (date - datetime.timedelta(days=30)).isoformat()
+    track_df = transform_todays_tracks(payload)[0]
+    # each load adds the same tracks again, a day after the last load, so that every call inserts new plays
+    loads = {"num": 0}
+    last_played_at = int(track_df["played_at"].max())
+    load_span = last_played_at - int(track_df["played_at"].min()) + 86400000
+
+    def load():
+        loads["num"] += 1
+        batch = track_df.copy()
+        batch["played_at"] = batch["played_at"] - int(batch["played_at"].min()) + last_played_at + loads["num"] * load_span
+        return(load_todays_tracks(batch, database_location))
+
+    def first_page():
+        return(next(views.iter_history(year_start, last_date), None))
+
+    return([
+        ("transform_todays_tracks", lambda: transform_todays_tracks(payload), len(payload["items"])),
+        ("load_todays_tracks", load, len(payload["items"])),
+        ("get_days_history", lambda: views.get_days_history(last_date), None),
+        ("iter_history first page (year)", first_page, None),
+        ("get_play_columns (all)", lambda: views.get_play_columns(["track_key", "duration_in_ms"]), num_plays),
+        ("get_most_listened tracks", lambda: views.get_most_listened("track_name", 10), None),
+        ("get_most_listened artists", lambda: views.get_most_listened("artist_name", 10), None),
+        ("get_most_listened albums", lambda: views.get_most_listened("album_name", 10), None),
+        ("get_most_listened tracks (month)", lambda: views.get_most_listened("track_name", 10, month_start, last_date), None),
+        ("get_leaderboard tracks (month, exact)", lambda: views.get_leaderboard("track_name", 10, "month", last_date, True), None),
+        ("search_names", lambda: views.search_names("track 12"), None),
+        ("search_names (short prefix)", lambda: views.search_names("al"), None),
+        ("search_names (fuzzy)", lambda: views.search_names("trak 12", fuzzy=True), None),
+        ("get_sessions (month)", lambda: views.get_sessions(month_start, last_date), None),
+        ("get_session_summary", lambda: views.get_session_summary(), None),
+        ("get_listening_streaks", lambda: views.get_listening_streaks(10), None),
+        ("get_current_streak", lambda: views.get_current_streak(last_date), None),
+        ("get_top_genres", lambda: views.get_top_genres(10), None),
+        ("get_most_listened_credited_artists", lambda: views.get_most_listened_credited_artists(10), None),
+        ("get_num_songs_by_time", lambda: views.get_num_songs_by_time("20"), None),
+        ("get_num_songs_by_hour", lambda: views.get_num_songs_by_hour(), None),
+        ("get_num_songs_by_hour (year)", lambda: views.get_num_songs_by_hour(False, year_start, last_date), None),
+        ("get_total_duration", lambda: views.get_total_duration(last_date), None),
+        ("get_total_durations (year, day)", lambda: views.get_total_durations(year_start, last_date), None),
+        ("get_total_durations (year, week)", lambda: views.get_total_durations(year_start, last_date, "week"), None),
+        ("get_total_durations (year, month)", lambda: views.get_total_durations(year_start, last_date, "month"), None),
+        ("compare_periods (all weeks)", lambda: compare_periods(), None),
+        ("menu: get_week_durations", lambda: menu.get_week_durations(date), None),
+        ("menu: get_weekly_comparison", lambda: menu.get_weekly_comparison(date), None),
+        ("menu: get_listening_calendar", lambda: menu.get_listening_calendar(date), None),
+        ("menu: t_test", lambda: menu.t_test(*reversed(menu.get_two_week_durations(date)[1])), None)
+    ])
+
+
+def measure(function, num_plays, repeat):
+    '''(function, int, int) -> dict
+    This function calls the given function repeat times, clearing the query cache before each call so that every call does its work, and returns the median,
+    95th and 99th percentile and mean latency in milliseconds, the number of plays processed per second (or calls per second if the number of plays is unknown)
+    and the peak memory allocated by one more call, traced separately since tracing slows every allocation down.
+    '''
+    from SpotifyHistory.query_cache import clear_query_cache
+    latencies = []
+    for _ in range(repeat):
+        clear_query_cache()
+        start = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - start) * 1000)
+    clear_query_cache()
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    mean_ms = float(np.mean(latencies))
+    p50_ms, p95_ms, p99_ms = np.percentile(latencies, [50, 95, 99])
+    return({"p50_ms": round(float(p50_ms), 3), "p95_ms": round(float(p95_ms), 3), "p99_ms": round(float(p99_ms), 3), "mean_ms": round(mean_ms, 3),
+            "throughput": round((num_plays or 1) / (mean_ms / 1000), 1), "throughput_unit": "plays/s" if num_plays else "calls/s",
+            "peak_memory_mb": round(peak_bytes / 1e6, 3)})
+
+
+def run_benchmark(sizes, repeat=20, seed=SEED, data_location=DATA_LOCATION):
+    '''(list of int, int, int, str) -> dict
+    This function runs every benchmark against a copy of the synthetic database of each of the given sizes, generating any database that has not been generated yet,
+    and returns the results of each function at each size.
+    '''
+    from SpotifyHistory import database
+    payload = make_recently_played(PAYLOAD_SIZE, seed)
+    results = {}
+    for num_plays in sizes:
+        path = get_database(num_plays, seed, data_location)[len("sqlite:///"):]
+        with tempfile.TemporaryDirectory() as folder:
+            # the loads add plays, so run against a copy to leave the generated database as it was
+            copy = os.path.join(folder, os.path.basename(path))
+            shutil.copy(path, copy)
+            database.DATABASE_LOCATION = "sqlite:///" + copy
+            results[str(num_plays)] = {}
+            for name, function, num_processed in get_cases(database.DATABASE_LOCATION, payload):
+                results[str(num_plays)][name] = measure(function, num_processed, repeat)
+                print("{:>9} {:<40} {:>10.2f} ms".format(num_plays, name, results[str(num_plays)][name]["p50_ms"]), flush=True)
+            database.dispose_engines()
+    return(results)
+
+
+def compare_with_baseline(results, baseline, tolerance=TOLERANCE):
+    '''(dict, dict, float) -> list of str
+    This function returns a description of every function whose median latency has regressed from the baseline, at each size both were run at,
+    and of every function the baseline has no result for at such a size, since a function added without one would never be checked.
+    '''
+    regressions = []
+    for size, cases in results.items():
+        if size not in baseline:
+            continue
+        for name, result in cases.items():
+            previous = baseline[size].get(name)
+            if previous is None:
+                regressions.append(size + " plays, " + name + ": " + str(result["p50_ms"]) + " ms, not in the baseline (run with --save-baseline to add it)")
+                continue
+            if result["p50_ms"] > previous["p50_ms"] * tolerance and result["p50_ms"] - previous["p50_ms"] > MIN_REGRESSION_MS:
+                regressions.append(size + " plays, " + name + ": " + str(result["p50_ms"]) + " ms, baseline " + str(previous["p50_ms"]) + " ms")
+    return(regressions)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the ETL and view functions against synthetic listening histories, comparing the results with a stored baseline.")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES[:2], help="the numbers of plays to benchmark at, up to " + str(SIZES[-1]) + " (default: 10000 100000)")
+    arg_parser.add_argument("--repeat", type=int, default=20, help="the number of times each function is timed (default: 20)")
+    arg_parser.add_argument("--seed", type=int, default=SEED, help="the seed the synthetic data is generated from (default: " + str(SEED) + ")")
+    arg_parser.add_argument("--data-dir", default=DATA_LOCATION, help="the folder the generated databases are kept in (default: " + DATA_LOCATION + ")")
+    arg_parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="how many times slower than the baseline counts as a regression (default: " + str(TOLERANCE) + ")")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline that later runs are compared with")
+    arg_parser.add_argument("--no-record", action="store_true", help="do not append the results to " + os.path.basename(HISTORY_LOCATION))
+    args = arg_parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.repeat, args.seed, args.data_dir)
+    record = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(), "machine": platform.machine(),
+              "seed": args.seed, "repeat": args.repeat, "results": results}
+    if not args.no_record:
+        with open(HISTORY_LOCATION, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    if args.save_baseline:
+        with open(BASELINE_LOCATION, "w") as f:
+            json.dump(record, f, indent=1)
+        print("Saved the baseline to " + BASELINE_LOCATION)
+        sys.exit(0)
+    # compare the run with the baseline, if one has been stored
+    try:
+        with open(BASELINE_LOCATION) as f:
+            baseline = json.load(f)["results"]
+    except OSError:
+        print("No baseline has been stored on this machine yet. Run with --save-baseline to store one.")
+        sys.exit(0)
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    print("\n".join(["Regressions from the baseline:"] + regressions) if regressions else "No regressions from the baseline.")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,104 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# the root of the repository, which each code path is imported from
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the file each run of the benchmark is appended to, so that the startup time can be tracked over time
+HISTORY_LOCATION = os.path.join(REPOSITORY_ROOT, "benchmarks", "startup_history.jsonl")
+
+# the modules imported by each code path of main.py before it does any work
+CODE_PATHS = {
+    "help": ["main"],
+    "menu": ["main", "SpotifyHistory.menu_functions"],
+    "ingest": ["main", "SpotifyHistory.etl_data"],
+    "import": ["main", "SpotifyHistory.import_history"],
+    "view": ["main", "SpotifyHistory.view_listening_history", "tabulate"],
+    "plot": ["main", "SpotifyHistory.view_listening_history", "matplotlib.pyplot"]
+}
+
+# the most time in milliseconds each code path may spend importing modules: the slowest median of 8 runs of 5 measurements each
+# (python 3.11, help 13, menu 13, ingest 910, import 914, view 926 and plot 1696 ms) with 25% headroom, rounded up to 50 ms
+BUDGETS_MS = {"help": 50, "menu": 50, "ingest": 1150, "import": 1150, "view": 1200, "plot": 2150}
+
+# the slow libraries that each code path must never import, since it does not use them
+FORBIDDEN_IMPORTS = {
+    "help": ["pandas", "numpy", "sqlalchemy", "matplotlib", "tabulate", "requests"],
+    "menu": ["pandas", "numpy", "sqlalchemy", "matplotlib", "tabulate", "requests"],
+    "ingest": ["matplotlib", "tabulate"],
+    "import": ["matplotlib", "tabulate", "requests"],
+    "view": ["matplotlib", "requests"],
+    "plot": ["requests"]
+}
+
+
+def measure_imports(modules, startup_modules=frozenset()):
+    '''(list of str, set of str) -> float, float, set of str
+    This function imports the given modules in a new python process and returns the total time spent importing them in milliseconds as reported by -X importtime,
+    leaving out the given modules that the interpreter imports while starting up, the wall time of the process in milliseconds and the names of every module that was imported.
+    '''
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+                            cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    import_us = 0
+    imported = set()
+    # each line is "import time: self [us] | cumulative | name", with the name indented by how deeply it was imported
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("imported package"):
+            continue
+        _, cumulative, name = line.split("|")
+        # only the modules imported directly add to the total, since their cumulative times include everything they imported,
+        # leaving out the modules imported by the interpreter itself before the code path starts
+        if not name.startswith("  ") and name.strip() not in startup_modules:
+            import_us += int(cumulative)
+        imported.add(name.strip())
+    return(import_us / 1000, wall_ms, imported)
+
+
+def run_benchmark(repeat=5, budget_scale=1.0):
+    '''(int, float) -> dict
+    This function measures each code path the given number of times, keeping the median, and returns the results of each code path
+    along with whether it stayed within its budget and imported none of its forbidden libraries.
+    '''
+    # find the modules imported by the interpreter itself, such as site and encodings, which no code path can avoid
+    startup_modules = measure_imports(["sys"])[2] - {"sys"}
+    results = {}
+    for code_path, modules in CODE_PATHS.items():
+        measurements = [measure_imports(modules, startup_modules) for _ in range(repeat)]
+        import_ms = statistics.median(m[0] for m in measurements)
+        wall_ms = statistics.median(m[1] for m in measurements)
+        imported = measurements[0][2]
+        forbidden = [library for library in FORBIDDEN_IMPORTS[code_path] if library in imported]
+        budget_ms = BUDGETS_MS[code_path] * budget_scale
+        results[code_path] = {"import_ms": round(import_ms, 1), "wall_ms": round(wall_ms, 1), "budget_ms": budget_ms,
+                              "forbidden_imports": forbidden, "passed": import_ms <= budget_ms and not forbidden}
+    return(results)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Measure the time each code path of main.py spends importing modules against its budget.")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="the number of times each code path is measured (default: 5)")
+    arg_parser.add_argument("--budget-scale", type=float, default=1.0, help="multiply every budget by this, for slower machines (default: 1.0)")
+    arg_parser.add_argument("--no-record", action="store_true", help="do not append the results to " + os.path.basename(HISTORY_LOCATION))
+    args = arg_parser.parse_args()
+
+    results = run_benchmark(args.repeat, args.budget_scale)
+    print("{:<8} {:>10} {:>10} {:>10}  {}".format("path", "import ms", "wall ms", "budget ms", "result"))
+    for code_path, result in results.items():
+        status = "ok" if result["passed"] else "OVER BUDGET" if not result["forbidden_imports"] else "imports " + ", ".join(result["forbidden_imports"])
+        print("{:<8} {:>10} {:>10} {:>10}  {}".format(code_path, result["import_ms"], result["wall_ms"], result["budget_ms"], status))
+
+    # record the run so that regressions in startup time can be seen over time
+    if not args.no_record:
+        record = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(), "results": results}
+        with open(HISTORY_LOCATION, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    sys.exit(0 if all(result["passed"] for result in results.values()) else 1)
@@ -0,0 +1,156 @@
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import numpy as np
+
+# the benchmarks are run as scripts from this folder, so make the package importable from the root of the repository
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_ROOT)
+
+from fake_spotify import get_track
+
+# the folder the generated databases are kept in between runs, since the largest take minutes to generate
+DATA_LOCATION = os.path.join(tempfile.gettempdir(), "spotify_history_benchmarks")
+
+# the sizes of listening history the benchmarks are run at
+SIZES = [10000, 100000, 1000000, 10000000]
+
+# the seed every dataset is generated from by default, so that every run of the benchmarks sees exactly the same plays
+SEED = 2024
+
+# the number of distinct tracks listened to for each play in the history, the fewest tracks in any history, and the skew of how often each track is played,
+# where a higher exponent concentrates the plays on fewer tracks (listening histories are far from uniform)
+TRACKS_PER_PLAY = 0.03
+MIN_TRACKS = 200
+ZIPF_EXPONENT = 1.2
+
+# the average number of plays per day, which sets how many years the history spans, and the date the history ends on
+PLAYS_PER_DAY = 60
+END_DATE = "2025-12-31"
+
+# the number of plays generated and inserted at a time, so that memory stays bounded at every size
+CHUNK_SIZE = 200000
+
+
+def get_num_tracks(num_plays):
+    '''(int) -> int
+    This function returns the number of distinct tracks in a history of the given number of plays.
+    '''
+    return(max(MIN_TRACKS, int(num_plays * TRACKS_PER_PLAY)))
+
+
+def generate_plays(num_plays, seed=SEED, chunk_size=CHUNK_SIZE):
+    '''(int, int, int) -> generator of ndarray, ndarray
+    This function yields the unix timestamps in milliseconds and track numbers of a synthetic history of the given number of plays, oldest first,
+    a chunk at a time. The plays are spread over enough days to average PLAYS_PER_DAY, clustered in the afternoon and evening, and the tracks follow a Zipf distribution.
+    The same seed always gives the same plays.
+    '''
+    rng = np.random.default_rng(seed)
+    num_tracks = get_num_tracks(num_plays)
+    num_days = max(1, num_plays // PLAYS_PER_DAY)
+    end_ms = int(datetime.datetime.fromisoformat(END_DATE).replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    # give every play its own millisecond, since the time played is the key of each play, and space the plays out evenly over the days
+    step_ms = num_days * 86400000 // num_plays
+    start_ms = end_ms - num_plays * step_ms
+    # shuffle which track each rank of the Zipf distribution is, so that the most played tracks are not simply the first ones
+    track_of_rank = rng.permutation(num_tracks)
+    for chunk_start in range(0, num_plays, chunk_size):
+        n = min(chunk_size, num_plays - chunk_start)
+        played_at = start_ms + (chunk_start + np.arange(n, dtype=np.int64)) * step_ms + rng.integers(0, max(1, step_ms // 2), n)
+        ranks = np.minimum(rng.zipf(ZIPF_EXPONENT, n), num_tracks) - 1
+        yield(played_at, track_of_rank[ranks])
+
+
+def make_recently_played(num_plays, seed=SEED, end_ms=None):
+    '''(int, int, int) -> dict
+    This function returns a synthetic response of the recently played endpoint with the given number of plays, oldest first, ending at the given unix timestamp
+    in milliseconds (now by default), with the same track objects as the stand-in server in fake_spotify.py.
+    '''
+    rng = np.random.default_rng(seed)
+    end_ms = end_ms or int(datetime.datetime.now().timestamp() * 1000)
+    played_at = end_ms - (num_plays - np.arange(num_plays, dtype=np.int64)) * 240000 + rng.integers(0, 1000, num_plays)
+    tracks = np.minimum(rng.zipf(ZIPF_EXPONENT, num_plays), MIN_TRACKS) - 1
+    items = [{"track": get_track(int(track)),
+              "played_at": datetime.datetime.fromtimestamp(int(ms) / 1000, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"}
+             for ms, track in zip(played_at, tracks)]
+    return({"items": items, "next": None, "limit": num_plays})
+
+
+def get_track_rows(num_tracks):
+    '''(int) -> list of tuple, list of tuple, list of tuple
+    This function returns the rows of the tracks, artists and albums tables for the given number of tracks, keyed by the track, artist and album numbers plus one,
+    with the same ids and names as the track objects of fake_spotify.py.
+    '''
+    num_albums = (num_tracks - 1) // 10 + 1
+    num_artists = (num_albums - 1) // 2 + 1
+    tracks = [(track_num + 1, "track" + str(track_num), "Track " + str(track_num)) for track_num in range(num_tracks)]
+    albums = [(album_num + 1, "album" + str(album_num), "Album " + str(album_num), str(2000 + album_num % 25) + "-01-01") for album_num in range(num_albums)]
+    artists = [(artist_num + 1, "artist" + str(artist_num), "Artist " + str(artist_num)) for artist_num in range(num_artists)]
+    return(tracks, artists, albums)
+
+
+def populate_database(path, num_plays, seed=SEED, chunk_size=CHUNK_SIZE):
+    '''(str, int, int, int) -> str
+    This function creates a database at the given path holding a synthetic history of the given number of plays, with the schema of the latest migration,
+    and returns its location. The plays are inserted directly in chunks, with the trigger that keeps the summary tables up to date dropped while they are
+    inserted and the summary tables and listening sessions filled in once at the end, which is far quicker than loading them a batch at a time.
+    '''
+    from SpotifyHistory.database import get_engine, dispose_engines, fill_rollup_tables, set_state, increment_generation
+    from SpotifyHistory.etl_data import get_local_timezone
+    from SpotifyHistory.sessions import update_sessions
+    import pandas as pd
+    if os.path.exists(path):
+        os.remove(path)
+    database_location = "sqlite:///" + path
+    num_tracks = get_num_tracks(num_plays)
+    tracks, artists, albums = get_track_rows(num_tracks)
+    timezone = get_local_timezone()
+    with get_engine(database_location).begin() as conn:
+        trigger_sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'plays_rollups'").scalar()
+        conn.exec_driver_sql("DROP TRIGGER plays_rollups")
+        conn.exec_driver_sql("INSERT INTO tracks(track_key, track_id, track_name) VALUES (?, ?, ?)", tracks)
+        conn.exec_driver_sql("INSERT INTO artists(artist_key, artist_id, artist_name) VALUES (?, ?, ?)", artists)
+        conn.exec_driver_sql("INSERT INTO albums(album_key, album_id, album_name, release_date) VALUES (?, ?, ?, ?)", albums)
+        for played_at, track_nums in generate_plays(num_plays, seed, chunk_size):
+            # work out the local date, hour and day of the week of every play at once, the same way the loader does
+            local = pd.Series(pd.to_datetime(played_at, unit="ms", utc=True)).dt.tz_convert(timezone)
+            album_nums = track_nums // 10
+            rows = zip(played_at.tolist(), (track_nums + 1).tolist(), (album_nums // 2 + 1).tolist(), (album_nums + 1).tolist(),
+                       local.dt.strftime("%Y-%m-%d").tolist(), local.dt.hour.tolist(), ((local.dt.weekday + 1) % 7).tolist(),
+                       (120000 + track_nums * 997 % 180000).tolist())
+            conn.exec_driver_sql("""
+                INSERT INTO plays(played_at, track_key, artist_key, album_key, date_played, hour_played, weekday_played, duration_in_ms)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, list(rows))
+        conn.exec_driver_sql(trigger_sql)
+        fill_rollup_tables(conn)
+        update_sessions(conn, rebuild=True)
+        set_state(conn, "last_played_at", conn.exec_driver_sql("SELECT MAX(played_at) FROM plays").scalar())
+        increment_generation(conn, plays_changed=True)
+
+    dispose_engines()
+    return(database_location)
+
+
+def get_database(num_plays, seed=SEED, data_location=DATA_LOCATION):
+    '''(int, int, str) -> str
+    This function returns the location of a database holding the synthetic history of the given number of plays, generating it only if it has not been generated before.
+    '''
+    path = os.path.join(data_location, "synthetic_" + str(num_plays) + "_" + str(seed) + ".sqlite")
+    if not os.path.exists(path):
+        os.makedirs(data_location, exist_ok=True)
+        populate_database(path + ".partial", num_plays, seed)
+        os.replace(path + ".partial", path)
+    return("sqlite:///" + path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate databases of synthetic listening history for the benchmarks.")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES[:2], help="the numbers of plays to generate (default: 10000 100000)")
+    arg_parser.add_argument("--seed", type=int, default=SEED, help="the seed the plays are generated from (default: " + str(SEED) + ")")
+    arg_parser.add_argument("--data-dir", default=DATA_LOCATION, help="the folder to keep the databases in (default: " + DATA_LOCATION + ")")
+    args = arg_parser.parse_args()
+    for num_plays in args.sizes:
+        print(get_database(num_plays, args.seed, args.data_dir))
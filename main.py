@@ -1,5 +1,444 @@
-from SpotifyHistory.menu_functions import *
+from SpotifyHistory.instrumentation import span, enable_metrics, enable_profiling
+from SpotifyHistory.menu_functions import main_menu, get_client_creds, etl_tracks, get_week_durations, get_two_week_durations, t_test, TIME_LABELS
+import argparse
+import datetime
+import json
+import sys
+
+# each command imports the modules it needs when it is run, so that a command never waits for pandas, sqlalchemy, matplotlib or tabulate
+# unless it uses them (see benchmarks/startup.py for the time budget of each command's imports)
+
+# the columns that can be ranked by the top command
+TOP_COLUMNS = {"tracks": "track_name", "artists": "artist_name", "albums": "album_name"}
+
+# the number of plays shown on each page of the history command
+HISTORY_PAGE_SIZE = 50
+
+# the rankings that need the metadata fetched by the enrich command, instead of a column
+TOP_METADATA_RANKINGS = ("genres", "credited-artists")
+
+
+def output(args, data, text):
+    '''(argparse.Namespace, object, str) -> Nonetype
+    This function prints the data as json if the --json option was given, otherwise it prints the text.
+    '''
+    if args.json:
+        print(json.dumps(data, default=lambda value: value.item() if hasattr(value, "item") else str(value)))
+    else:
+        print(text)
+
+
+def parse_date(date):
+    '''(str) -> datetime.date
+    This function converts a date in YYYY-mm-dd format given on the command line to a date.
+    '''
+    try:
+        return(datetime.date.fromisoformat(date))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid date provided: " + date)
+
+
+def get_date_range(args):
+    '''(argparse.Namespace) -> str, str
+    This function returns the --start-date and --end-date given on the command line in YYYY-mm-dd format, with None for either that was not given.
+    '''
+    return(tuple(date.isoformat() if date else None for date in (args.start_date, args.end_date)))
+
+
+def add_date_range_arguments(parser):
+    '''(argparse.ArgumentParser) -> Nonetype
+    This function adds the --start-date and --end-date options to a command that can be limited to a range of dates.
+    '''
+    parser.add_argument("--start-date", type=parse_date, default=None, help="the first date to include (default: the start of your history)")
+    parser.add_argument("--end-date", type=parse_date, default=None, help="the last date to include (default: the end of your history)")
+
+
+def run_ingest(args):
+    '''(argparse.Namespace) -> int
+    This function extracts, transforms and loads the tracks played since the last load, using the authorization code given or, if there is none,
+    the cached access or refresh token, only asking the user to authorize access if neither works and --no-input was not given.
+    '''
+    from SpotifyHistory.etl_data import get_access_token
+    from SpotifyHistory.auth import get_cached_access_token
+    client_id, client_secret = get_client_creds()
+    if args.code:
+        access_token, bad_code = get_access_token(client_id, client_secret, args.code)
+    else:
+        access_token = get_cached_access_token(client_id, client_secret, interactive=not args.no_input)
+        bad_code = access_token is None
+    if bad_code:
+        print("No access token could be obtained. Run the ingest command without --no-input to authorize access.")
+        return(1)
+    num_added = etl_tracks(access_token)
+    output(args, {"plays_added": num_added}, "No new tracks were loaded." if num_added is None else str(num_added) + " new plays loaded.")
+    return(0 if num_added is not None else 1)
+
+
+def run_ingest_all(args):
+    '''(argparse.Namespace) -> int
+    This function ingests every account in the profiles file concurrently, each into its own listening history.
+    '''
+    from SpotifyHistory.ingest_profiles import ingest_profiles_file, format_result
+    results = ingest_profiles_file(args.profiles, args.workers)
+    output(args, results, "\n".join(format_result(result) for result in results))
+    return(0 if not any(result["error"] for result in results) else 1)
+
+
+def run_import(args):
+    '''(argparse.Namespace) -> int
+    This function imports Spotify's extended streaming history export.
+    '''
+    from SpotifyHistory.import_history import import_streaming_history
+    num_added = import_streaming_history(args.paths, args.processes)
+    if args.json:
+        output(args, {"plays_added": num_added}, "")
+    return(0)
+
+
+def run_history(args):
+    '''(argparse.Namespace) -> int
+    This function outputs the listening history from the given date, or range of dates, a page at a time as each page is read,
+    waiting for the user between pages if the output is a terminal. With --json, the plays are written as a json array as they are read.
+    '''
+    from SpotifyHistory.view_listening_history import iter_history
+    from tabulate import tabulate
+    start_date = args.date.isoformat()
+    end_date = (args.end_date or args.date).isoformat()
+    pages = iter_history(start_date, end_date, args.artist, args.album, args.page_size)
+    num_pages = 0
+    if args.json:
+        print("[", end="")
+    for page in pages:
+        if args.json:
+            print((", " if num_pages else "") + ", ".join(json.dumps(row, default=str) for row in page.to_dict("records")), end="", flush=True)
+        else:
+            if num_pages > 0 and sys.stdin.isatty() and sys.stdout.isatty() and not args.no_pager:
+                if input("Press [Enter] to see the next page, or type 'quit' to stop: ").lower() == 'quit':
+                    break
+            print(tabulate(page, headers="keys", tablefmt="fancy_outline"), flush=True)
+        num_pages += 1
+    if args.json:
+        print("]")
+    elif num_pages == 0:
+        print("There are no recorded songs for " + ("this date." if start_date == end_date else "these dates."))
+    return(0)
+
+
+def run_top(args):
+    '''(argparse.Namespace) -> int
+    This function outputs the most listened to tracks, artists, albums, genres or artists including those featured on tracks.
+    '''
+    from SpotifyHistory.view_listening_history import get_most_listened, get_top_genres, get_most_listened_credited_artists
+    from tabulate import tabulate
+    if args.column in TOP_METADATA_RANKINGS and (args.start_date or args.end_date):
+        print("The " + args.column + " ranking covers your whole listening history, so it cannot be limited to a range of dates.")
+        return(1)
+    if args.column == "genres":
+        df = get_top_genres(args.limit)
+    elif args.column == "credited-artists":
+        df = get_most_listened_credited_artists(args.limit)
+    else:
+        df = get_most_listened(TOP_COLUMNS[args.column], args.limit, *get_date_range(args))
+    output(args, df.to_dict("records"), tabulate(df, headers="keys", tablefmt="fancy_outline"))
+    return(0)
+
+
+def run_search(args):
+    '''(argparse.Namespace) -> int
+    This function outputs the tracks, artists and albums whose names contain the given text, with how often and when each was played,
+    showing the closest names instead if none contain it.
+    '''
+    from SpotifyHistory.view_listening_history import search_names
+    from tabulate import tabulate
+    text = " ".join(args.text)
+    df = search_names(text, tuple(args.type), args.limit, args.fuzzy)
+    if df.empty and not args.fuzzy:
+        df = search_names(text, tuple(args.type), args.limit, True)
+        if not df.empty and not args.json:
+            print("No names contain \"" + text + "\", so the closest names are shown instead.")
+    if df.empty and not args.json:
+        print("No tracks, artists or albums match \"" + text + "\".")
+        return(0)
+    output(args, df.to_dict("records"), tabulate(df, headers="keys", tablefmt="fancy_outline"))
+    return(0)
+
+
+def run_leaderboard(args):
+    '''(argparse.Namespace) -> int
+    This function outputs the most listened to tracks, artists or albums of the year, month or week of the given date, or of all time,
+    from the approximate most played counters, building them first if --build was given.
+    '''
+    from SpotifyHistory.database import get_engine
+    from SpotifyHistory.heavy_hitters import build_heavy_hitters, is_enabled
+    from SpotifyHistory.view_listening_history import get_leaderboard
+    from tabulate import tabulate
+    if args.build:
+        print("Counted " + str(build_heavy_hitters()) + " plays.")
+    with get_engine().connect() as conn:
+        enabled = is_enabled(conn)
+    if not enabled and not args.exact and args.period != "all":
+        print("The most played counters have not been built. Run the leaderboard command with --build first, or use --exact.")
+        return(1)
+    df = get_leaderboard(TOP_COLUMNS[args.column], args.limit, args.period, args.date.isoformat() if args.date else None, args.exact)
+    output(args, df.to_dict("records"), tabulate(df, headers="keys", tablefmt="fancy_outline"))
+    return(0)
+
+
+def run_enrich(args):
+    '''(argparse.Namespace) -> int
+    This function fetches the metadata of every track, artist and album in the listening history that has not been fetched yet.
+    '''
+    from SpotifyHistory.auth import get_cached_access_token
+    from SpotifyHistory.enrich import enrich_metadata
+    access_token = get_cached_access_token(*get_client_creds(), interactive=not args.no_input)
+    if access_token is None:
+        print("No access token could be obtained. Run the enrich command without --no-input to authorize access.")
+        return(1)
+    num_fetched = enrich_metadata(access_token)
+    output(args, num_fetched, "Fetched the metadata of " + ", ".join(str(num) + " " + kind for kind, num in num_fetched.items()) + ".")
+    return(0)
+
+
+def run_hourly(args):
+    '''(argparse.Namespace) -> int
+    This function outputs the number of songs played during each hour of the day, or of each day of the week if --by-weekday was given.
+    '''
+    from SpotifyHistory.view_listening_history import get_num_songs_by_hour
+    from tabulate import tabulate
+    num_songs = get_num_songs_by_hour(args.by_weekday, *get_date_range(args))
+    if args.by_weekday:
+        days_of_week = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+        data = {day: dict(zip(TIME_LABELS, counts)) for day, counts in zip(days_of_week, num_songs)}
+        text = tabulate([[day] + counts for day, counts in zip(days_of_week, num_songs)], headers=[""] + TIME_LABELS, tablefmt="fancy_outline")
+    else:
+        data = dict(zip(TIME_LABELS, num_songs))
+        text = tabulate(list(zip(TIME_LABELS, num_songs)), headers=["Time of Day", "Number of Songs"], tablefmt="fancy_outline")
+    output(args, data, text)
+    return(0)
+
+
+def run_week(args):
+    '''(argparse.Namespace) -> int
+    This function outputs the time spent listening on each day of the week of the given date.
+    '''
+    from SpotifyHistory.etl_data import convert_duration
+    from tabulate import tabulate
+    week_dates, durations_in_ms = get_week_durations(args.date)
+    data = {"dates": dict(zip(week_dates, durations_in_ms)), "total_duration_in_ms": sum(durations_in_ms)}
+    rows = [[date, convert_duration(duration_in_ms)] for date, duration_in_ms in zip(week_dates, durations_in_ms)]
+    text = tabulate(rows, headers=["Date", "Time Spent Listening"], tablefmt="fancy_outline") + "\nTotal: " + convert_duration(sum(durations_in_ms))
+    output(args, data, text)
+    return(0)
+
+
+def run_compare(args):
+    '''(argparse.Namespace) -> int
+    This function compares the time spent listening in the two full weeks before the week of the given date.
+    '''
+    from SpotifyHistory.etl_data import convert_duration
+    from tabulate import tabulate
+    all_dates, all_durations_in_ms = get_two_week_durations(args.date)
+    t_stat, t_crit, result = t_test(all_durations_in_ms[1], all_durations_in_ms[0])
+    data = {"weeks": [dict(zip(dates, durations)) for dates, durations in zip(all_dates, all_durations_in_ms)],
+            "t_stat": t_stat, "t_crit": t_crit, "result": result}
+    rows = [[dates_0, convert_duration(duration_0), dates_1, convert_duration(duration_1)]
+            for dates_0, duration_0, dates_1, duration_1 in zip(all_dates[0], all_durations_in_ms[0], all_dates[1], all_durations_in_ms[1])]
+    text = (tabulate(rows, headers=["Date", "Time Spent Listening", "Date", "Time Spent Listening"], tablefmt="fancy_outline")
+            + "\nt-stat: " + str(t_stat) + "\nt_crit: " + str(t_crit) + "\n" + result)
+    output(args, data, text)
+    return(0)
+
+
+def run_trend(args):
+    '''(argparse.Namespace) -> int
+    This function compares every week or month, or block of consecutive weeks or months, of the listening history with the one before it.
+    '''
+    from SpotifyHistory.compare_history import compare_periods
+    from tabulate import tabulate
+    start_date, end_date = get_date_range(args)
+    df = compare_periods(start_date, end_date, args.period, args.window)
+    if args.significant_only:
+        df = df[df["significant"]]
+    output(args, df.to_dict("records"), "There is not enough listening history to compare." if df.empty else tabulate(df, headers="keys", tablefmt="fancy_outline", showindex=False))
+    return(0)
+
+
+def run_sessions(args):
+    '''(argparse.Namespace) -> int
+    This function outputs a summary of the listening sessions that started in the given range of dates (the whole history by default) and the longest of them,
+    splitting every play into sessions again first if a new --gap was given.
+    '''
+    from SpotifyHistory.sessions import rebuild_sessions
+    from SpotifyHistory.view_listening_history import get_sessions, get_session_summary
+    from tabulate import tabulate
+    if args.gap is not None:
+        print("Found " + str(rebuild_sessions(gap_minutes=args.gap)) + " listening sessions.")
+    summary = get_session_summary(*get_date_range(args))
+    longest_df = get_sessions(*get_date_range(args)).sort_values("length_in_minutes", ascending=False, kind="stable").head(args.longest)
+    text = tabulate(list(summary.items()), tablefmt="fancy_outline") + "\n" + tabulate(longest_df, headers="keys", tablefmt="fancy_outline", showindex=False)
+    output(args, {"summary": summary, "longest": longest_df.to_dict("records")}, text)
+    return(0)
+
+
+def run_streaks(args):
+    '''(argparse.Namespace) -> int
+    This function outputs the current streak of consecutive days with plays up to the given date and the longest streaks of the whole history.
+    '''
+    from SpotifyHistory.view_listening_history import get_current_streak, get_listening_streaks
+    from tabulate import tabulate
+    current_streak = get_current_streak(args.date.isoformat() if args.date else None)
+    streaks_df = get_listening_streaks(args.limit)
+    text = ("Current streak: " + str(current_streak["num_days"]) + " days" + (" (since " + current_streak["start_date"] + ")" if current_streak["num_days"] else "")
+            + "\n" + tabulate(streaks_df, headers="keys", tablefmt="fancy_outline"))
+    output(args, {"current": current_streak, "longest": streaks_df.to_dict("records")}, text)
+    return(0)
+
+
+def run_archive(args):
+    '''(argparse.Namespace) -> int
+    This function creates or brings up to date the columnar archive of the listening history.
+    '''
+    from SpotifyHistory.archive import sync_archive, get_archive_location
+    stats = sync_archive(rebuild=args.rebuild)
+    output(args, stats, "Wrote " + str(stats["months_written"]) + " months (" + str(stats["plays_read"]) + " plays) and removed "
+           + str(stats["months_removed"]) + " months of " + get_archive_location() + ".")
+    return(0)
+
+
+def run_render(args):
+    '''(argparse.Namespace) -> int
+    This function renders charts of the listening history, or of each profile's listening history, to image files across a pool of processes.
+    '''
+    from SpotifyHistory.reports import get_report_tasks, render_reports
+    from SpotifyHistory.ingest_profiles import load_profiles
+    profiles = load_profiles(args.profiles) if args.profiles else None
+    paths, errors = render_reports(get_report_tasks(args.charts, args.date, args.format, args.output_dir, profiles), args.processes)
+    output(args, {"paths": paths, "errors": errors}, "\n".join(paths + errors))
+    return(0 if not errors else 1)
+
+
+def get_arg_parser():
+    '''() -> argparse.ArgumentParser
+    This function defines the commands that can be run without the menu.
+    '''
+    today = datetime.date.today()
+    arg_parser = argparse.ArgumentParser(description="Manage and view your Spotify listening history. Run without a command to open the menu.")
+    arg_parser.add_argument("--json", action="store_true", help="output the results as json")
+    arg_parser.add_argument("--metrics", default=None, help="append the time, SQL statements and rows of each stage and query to this json lines file "
+                                                            "(summarize it with \"python -m SpotifyHistory.instrumentation\")")
+    arg_parser.add_argument("--profile", default=None, help="profile the run with cProfile and save the statistics to this file (read it with \"python -m pstats\")")
+    subparsers = arg_parser.add_subparsers(dest="command")
+
+    ingest_parser = subparsers.add_parser("ingest", help="add the tracks played since the last load to your history")
+    ingest_parser.add_argument("--code", help="the authorization code from the callback url (otherwise the cached token is used)")
+    ingest_parser.add_argument("--no-input", action="store_true", help="fail instead of asking for authorization if there is no usable cached token")
+    ingest_parser.set_defaults(run=run_ingest)
+
+    ingest_all_parser = subparsers.add_parser("ingest-all", help="add the tracks played since the last load by every account in a profiles file")
+    ingest_all_parser.add_argument("--profiles", default="profiles.json", help="the profiles file (default: profiles.json)")
+    ingest_all_parser.add_argument("--workers", type=int, default=4, help="the number of accounts ingested at once (default: 4)")
+    ingest_all_parser.set_defaults(run=run_ingest_all)
+
+    import_parser = subparsers.add_parser("import", help="import Spotify's extended streaming history export")
+    import_parser.add_argument("paths", nargs="+", help="the Streaming_History_Audio_*.json files, or the folders containing them")
+    import_parser.add_argument("--processes", type=int, default=None, help="the number of files to parse at once")
+    import_parser.set_defaults(run=run_import)
+
+    history_parser = subparsers.add_parser("history", help="view your listening history from a certain day or range of days")
+    history_parser.add_argument("date", type=parse_date, help="the date, or the first date of the range, in YYYY-mm-dd format")
+    history_parser.add_argument("end_date", type=parse_date, nargs="?", default=None, help="the last date of the range (default: only the first date)")
+    history_parser.add_argument("--artist", default=None, help="only show the tracks of artists whose name contains this")
+    history_parser.add_argument("--album", default=None, help="only show the tracks of albums whose name contains this")
+    history_parser.add_argument("--page-size", type=int, default=HISTORY_PAGE_SIZE, help="the number of plays read and shown at a time (default: "
+                                + str(HISTORY_PAGE_SIZE) + ")")
+    history_parser.add_argument("--no-pager", action="store_true", help="show every page without waiting in between")
+    history_parser.set_defaults(run=run_history)
+
+    top_parser = subparsers.add_parser("top", help="view your most listened to tracks, artists or albums")
+    top_parser.add_argument("column", choices=list(TOP_COLUMNS) + list(TOP_METADATA_RANKINGS))
+    top_parser.add_argument("--limit", type=int, default=10, help="the number to show (default: 10)")
+    add_date_range_arguments(top_parser)
+    top_parser.set_defaults(run=run_top)
+
+    search_parser = subparsers.add_parser("search", help="find tracks, artists and albums by part of their name")
+    search_parser.add_argument("text", nargs="+", help="part of the name to search for")
+    search_parser.add_argument("--type", nargs="+", choices=["tracks", "artists", "albums"], default=["tracks", "artists", "albums"],
+                               help="only search these (default: all)")
+    search_parser.add_argument("--limit", type=int, default=10, help="the most matches to show of each (default: 10)")
+    search_parser.add_argument("--fuzzy", action="store_true", help="show the names most alike the text first, even if none contain it exactly")
+    search_parser.set_defaults(run=run_search)
+
+    leaderboard_parser = subparsers.add_parser("leaderboard", help="view your most listened to tracks, artists or albums of a year, month or week")
+    leaderboard_parser.add_argument("column", choices=list(TOP_COLUMNS))
+    leaderboard_parser.add_argument("--period", choices=["all", "year", "month", "week"], default="month", help="the window to rank (default: month)")
+    leaderboard_parser.add_argument("--date", type=parse_date, default=None, help="any date in the window (default: today)")
+    leaderboard_parser.add_argument("--limit", type=int, default=10, help="the number to show (default: 10)")
+    leaderboard_parser.add_argument("--exact", action="store_true", help="count the plays in the window instead of using the approximate counters")
+    leaderboard_parser.add_argument("--build", action="store_true", help="count the whole history into the approximate counters first, and keep them up to date from then on")
+    leaderboard_parser.set_defaults(run=run_leaderboard)
+
+    enrich_parser = subparsers.add_parser("enrich", help="fetch the metadata (genres, featured artists, popularity) of tracks not seen before")
+    enrich_parser.add_argument("--no-input", action="store_true", help="fail instead of asking for authorization if there is no usable cached token")
+    enrich_parser.set_defaults(run=run_enrich)
+
+    hourly_parser = subparsers.add_parser("hourly", help="view the number of songs you have played by time of day")
+    hourly_parser.add_argument("--by-weekday", action="store_true", help="count each day of the week separately")
+    add_date_range_arguments(hourly_parser)
+    hourly_parser.set_defaults(run=run_hourly)
+
+    week_parser = subparsers.add_parser("week", help="view your listening time for a week")
+    week_parser.add_argument("--date", type=parse_date, default=today, help="any date in the week (default: today)")
+    week_parser.set_defaults(run=run_week)
+
+    compare_parser = subparsers.add_parser("compare", help="compare the two full weeks before a week")
+    compare_parser.add_argument("--date", type=parse_date, default=today, help="any date in the week after the two weeks (default: today)")
+    compare_parser.set_defaults(run=run_compare)
+
+    trend_parser = subparsers.add_parser("trend", help="compare each week or month of your history with the one before it using paired t-tests")
+    trend_parser.add_argument("--period", choices=["week", "month"], default="week", help="compare weeks (paired by day of the week) or months (paired by day of the month)")
+    trend_parser.add_argument("--window", type=int, default=1, help="the number of consecutive weeks or months compared with as many before them (default: 1)")
+    add_date_range_arguments(trend_parser)
+    trend_parser.add_argument("--significant-only", action="store_true", help="only show the significant differences")
+    trend_parser.set_defaults(run=run_trend)
+
+    sessions_parser = subparsers.add_parser("sessions", help="view a summary of your listening sessions, runs of plays with only short gaps between them")
+    sessions_parser.add_argument("--longest", type=int, default=10, help="the number of longest sessions to show (default: 10)")
+    sessions_parser.add_argument("--gap", type=float, default=None, help="split your history into sessions again with this many minutes as the longest gap "
+                                                                         "between plays in a session, used from then on (default: keep the current gap)")
+    add_date_range_arguments(sessions_parser)
+    sessions_parser.set_defaults(run=run_sessions)
+
+    streaks_parser = subparsers.add_parser("streaks", help="view your current and longest streaks of consecutive days listening")
+    streaks_parser.add_argument("--date", type=parse_date, default=None, help="the date the current streak runs up to (default: today)")
+    streaks_parser.add_argument("--limit", type=int, default=10, help="the number of longest streaks to show (default: 10)")
+    streaks_parser.set_defaults(run=run_streaks)
+
+    archive_parser = subparsers.add_parser("archive", help="create or update the columnar copy of your listening history used for fast whole-history reads")
+    archive_parser.add_argument("--rebuild", action="store_true", help="rewrite every month instead of only the months that have changed")
+    archive_parser.set_defaults(run=run_archive)
+
+    render_parser = subparsers.add_parser("render", help="render charts to image files without a display")
+    render_parser.add_argument("--charts", nargs="+", choices=["hourly", "week", "compare", "streaks", "sessions"], default=["hourly", "week", "compare", "streaks", "sessions"],
+                               help="the charts to render (default: all)")
+    render_parser.add_argument("--date", type=parse_date, default=today, help="any date in the week to chart (default: today)")
+    render_parser.add_argument("--format", choices=["png", "svg"], default="png")
+    render_parser.add_argument("--output-dir", default="reports", help="the folder to save the charts to (default: reports)")
+    render_parser.add_argument("--profiles", default=None, help="render the charts of every account in this profiles file, each in its own folder")
+    render_parser.add_argument("--processes", type=int, default=None, help="the number of charts rendered at once (default: the number of CPUs)")
+    render_parser.set_defaults(run=run_render)
+    return(arg_parser)
 
 
 if __name__ == "__main__":
-    main_menu()
\ No newline at end of file
+    args = get_arg_parser().parse_args()
+    if args.metrics:
+        enable_metrics(args.metrics)
+    if args.profile:
+        enable_profiling(args.profile)
+    if args.command is None:
+        main_menu()
+    else:
+        # time the whole command as the span every stage and query it runs is counted in
+        with span("main." + args.command):
+            exit_code = args.run(args)
+        sys.exit(exit_code)
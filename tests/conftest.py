@@ -0,0 +1,63 @@
+from SpotifyHistory import database, spotify_api
+from SpotifyHistory.etl_data import transform_todays_tracks, load_track_batches
+from SpotifyHistory.query_cache import clear_query_cache
+from benchmarks.fake_spotify import make_server
+import datetime
+import threading
+import pytest
+
+
+def make_item(played_at, track_num, duration_ms=180000):
+    '''(int, int, int) -> dict
+    This function returns an item of the recently played endpoint for the given track number played at the given unix timestamp in milliseconds,
+    with three tracks to an album and two albums to an artist.
+    '''
+    album_num = track_num // 3
+    artist_num = album_num // 2
+    return({"played_at": datetime.datetime.fromtimestamp(played_at / 1000, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            "track": {"id": "track" + str(track_num), "name": "Track " + str(track_num), "duration_ms": duration_ms,
+                      "album": {"id": "album" + str(album_num), "name": "Album " + str(album_num), "release_date": "2020-01-01",
+                                "artists": [{"id": "artist" + str(artist_num), "name": "Artist " + str(artist_num)}]}}})
+
+
+def to_unix_timestamp(date_time):
+    '''(str) -> int
+    This function returns the unix timestamp in milliseconds of the given UTC date and time.
+    '''
+    return(int(datetime.datetime.fromisoformat(date_time).replace(tzinfo=datetime.timezone.utc).timestamp() * 1000))
+
+
+@pytest.fixture
+def database_location(tmp_path, monkeypatch):
+    '''A new database in a temporary folder, made the default database for the test.'''
+    location = "sqlite:///" + str(tmp_path / "history.sqlite")
+    monkeypatch.setattr(database, "DATABASE_LOCATION", location)
+    clear_query_cache()
+    yield location
+    database.dispose_engines()
+    clear_query_cache()
+
+
+@pytest.fixture
+def load_plays(database_location):
+    '''A function loading the plays given as (UTC date and time, track number) or (UTC date and time, track number, duration in ms) into the test database
+    as the recently played endpoint would return them, returning the number of plays added.'''
+    def load(plays):
+        items = [make_item(to_unix_timestamp(play[0]), *play[1:]) for play in plays]
+        track_df, valid = transform_todays_tracks({"items": items})
+        assert valid
+        return(load_track_batches([track_df], database_location))
+    return(load)
+
+
+@pytest.fixture
+def fake_spotify(monkeypatch):
+    '''The local stand-in for the Spotify endpoints (see benchmarks/fake_spotify.py), which every request of the test is sent to.'''
+    server = make_server(retry_after=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:" + str(server.server_address[1])
+    monkeypatch.setattr(spotify_api, "ACCOUNTS_URL", url)
+    monkeypatch.setattr(spotify_api, "API_URL", url + "/v1")
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,53 @@
+from SpotifyHistory.archive import ARCHIVE_COLUMNS, get_archive_location, load_manifest, sync_archive, read_archive
+from SpotifyHistory.database import get_engine, get_state
+import numpy as np
+
+# every column of the plays, as read from the database
+PLAYS_QUERY = "SELECT " + ", ".join(ARCHIVE_COLUMNS) + " FROM plays ORDER BY played_at"
+
+
+def assert_archive_matches_database(database_location):
+    '''(str) -> Nonetype
+    This function checks that every column of the archive of the given database holds the same plays as the database.
+    '''
+    with get_engine(database_location).connect() as conn:
+        rows = conn.exec_driver_sql(PLAYS_QUERY).all()
+    archived = read_archive(list(ARCHIVE_COLUMNS), database_location=database_location)
+    assert archived is not None
+    for column, values in zip(ARCHIVE_COLUMNS, zip(*rows)):
+        np.testing.assert_array_equal(archived[column], np.array(values, dtype=ARCHIVE_COLUMNS[column]))
+
+
+def test_archive_matches_database_as_plays_are_loaded(load_plays, database_location):
+    load_plays([("2024-01-10 12:00:00", 1), ("2024-01-20 12:00:00", 2), ("2024-02-05 12:00:00", 3)])
+    sync_archive(database_location)
+    assert_archive_matches_database(database_location)
+    # append to the latest month, then start a new one, then load older plays into a month already compressed
+    for plays in ([("2024-02-06 12:00:00", 4)], [("2024-03-01 12:00:00", 5)], [("2024-01-15 12:00:00", 6), ("2023-12-31 12:00:00", 7)]):
+        load_plays(plays)
+        assert read_archive(["played_at"], database_location=database_location) is None
+        sync_archive(database_location)
+        assert_archive_matches_database(database_location)
+    partitions = load_manifest(get_archive_location(database_location))["partitions"]
+    assert {month: partition["compressed"] for month, partition in partitions.items()} == {"2023-12": True, "2024-01": True, "2024-02": True, "2024-03": False}
+
+
+def test_archive_reads_the_plays_between_dates(load_plays, database_location):
+    load_plays([("2024-01-10 12:00:00", 1), ("2024-01-20 12:00:00", 2), ("2024-02-05 12:00:00", 3), ("2024-03-05 12:00:00", 4)])
+    sync_archive(database_location)
+    archived = read_archive(["track_key", "date_played"], "2024-01-15", "2024-02-05", database_location)
+    with get_engine(database_location).connect() as conn:
+        track_keys = [row[0] for row in conn.exec_driver_sql("SELECT track_key FROM plays WHERE date_played BETWEEN '2024-01-15' AND '2024-02-05' ORDER BY played_at")]
+    assert archived["track_key"].tolist() == track_keys
+
+
+def test_loading_plays_already_stored_leaves_the_archive_up_to_date(load_plays, database_location):
+    plays = [("2024-01-10 12:00:00", 1), ("2024-02-05 12:00:00", 2)]
+    load_plays(plays)
+    sync_archive(database_location)
+    with get_engine(database_location).connect() as conn:
+        generation = get_state(conn, "generation")
+    assert load_plays(plays) == 0
+    with get_engine(database_location).connect() as conn:
+        assert get_state(conn, "generation") == generation
+    assert_archive_matches_database(database_location)
@@ -0,0 +1,57 @@
+from SpotifyHistory import auth
+from SpotifyHistory.auth import capture_auth_code, get_cached_access_token, load_token_cache, save_token
+from SpotifyHistory.spotify_api import get_token_from_code
+import json
+import os
+import socket
+import stat
+import threading
+import urllib.parse
+import urllib.request
+
+
+def test_tokens_are_reused_then_refreshed_once_expired(fake_spotify, tmp_path):
+    path = str(tmp_path / "tokens.json")
+    assert get_cached_access_token("id", "secret", interactive=False, path=path) is None
+    save_token("id", get_token_from_code("id", "secret", "alice"), path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    num_requests = fake_spotify.num_requests
+    assert get_cached_access_token("id", "secret", interactive=False, path=path) == "access-alice"
+    assert fake_spotify.num_requests == num_requests
+    # an access token about to expire is refreshed, keeping the refresh token since Spotify did not issue a new one
+    tokens = load_token_cache(path)
+    tokens["id"]["expires_at"] -= 3600 - auth.EXPIRY_MARGIN_SECONDS
+    with open(path, "w") as f:
+        json.dump(tokens, f)
+    assert get_cached_access_token("id", "secret", interactive=False, path=path) == "access-alice"
+    assert fake_spotify.num_requests == num_requests + 1
+    assert load_token_cache(path)["id"]["refresh_token"] == "refresh-alice"
+
+
+def test_the_authorization_code_is_captured_on_the_redirect_uri(monkeypatch):
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    redirect_uri = "http://localhost:" + str(port) + "/callback"
+    monkeypatch.setattr(auth, "REDIRECT_URI", redirect_uri)
+    responses = []
+    browsers = []
+
+    def redirect(url):
+        '''(str) -> Nonetype
+        This function stands in for the browser, sending a redirect with the wrong state and then the one Spotify would send once access is granted.
+        '''
+        state = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)["state"][0]
+
+        def send():
+            for query in ({"code": "forged", "state": "other"}, {"code": "alice", "state": state}):
+                try:
+                    responses.append(urllib.request.urlopen(redirect_uri + "?" + urllib.parse.urlencode(query), timeout=5).status)
+                except urllib.error.HTTPError as error:
+                    responses.append(error.code)
+        browsers.append(threading.Thread(target=send, daemon=True))
+        browsers[0].start()
+    monkeypatch.setattr(auth.webbrowser, "open", redirect)
+    assert capture_auth_code("id", timeout=10) == "alice"
+    browsers[0].join(5)
+    assert responses == [404, 200]
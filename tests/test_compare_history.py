@@ -0,0 +1,23 @@
+from SpotifyHistory.compare_history import get_t_critical, paired_t_tests
+import math
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("df, t_critical", [(1, 12.706), (6, 2.447), (13, 2.160), (30, 2.042), (120, 1.980)])
+def test_t_critical_matches_t_table(df, t_critical):
+    assert get_t_critical(df) == pytest.approx(t_critical, abs=1e-3)
+
+
+def test_t_critical_needs_a_degree_of_freedom():
+    assert math.isnan(get_t_critical(0))
+
+
+def test_paired_t_test_of_a_week():
+    later = np.array([[60.0, 45.0, 80.0, 30.0, 90.0, 75.0, 50.0]])
+    earlier = np.array([[40.0, 50.0, 60.0, 20.0, 70.0, 45.0, 35.0]])
+    result = paired_t_tests(later, earlier)
+    differences = later[0] - earlier[0]
+    assert result["df"][0] == 6
+    assert result["t_stat"][0] == pytest.approx(differences.mean() / (differences.std(ddof=1) / math.sqrt(7)))
+    assert result["significant"][0] == (abs(result["t_stat"][0]) >= get_t_critical(6))
@@ -0,0 +1,57 @@
+from SpotifyHistory import database
+from SpotifyHistory.database import MIGRATIONS, get_engine, migrate_database
+from SpotifyHistory.etl_data import load_track_batches
+import sqlalchemy
+
+# a play of a local file, which has no Spotify ids, and a play of a track from Spotify, as stored before the history was normalized
+VERSION_3_PLAYS = """
+    INSERT INTO complete_listening_history(played_at, track_name, artist_name, album_name, track_id, artist_id, album_id,
+        date_played, time_played, hour_played, weekday_played, duration_in_ms)
+    VALUES (1704103200000, 'Demo', 'Me', 'Tapes', NULL, NULL, NULL, '2024-01-01', '10:00:00:000', 10, 1, 120000),
+        (1704106800000, 'Track 1', 'Artist 0', 'Album 0', 'track1', 'artist0', 'album0', '2024-01-01', '11:00:00:000', 11, 1, 180000)
+    """
+
+
+def test_new_database_is_migrated_to_the_latest_version(database_location):
+    with get_engine().connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA user_version").scalar() == len(MIGRATIONS)
+        tables = {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+        assert database.get_state(conn, "database_id") is not None
+    assert {"plays", "tracks", "artists", "albums", "complete_listening_history", "etl_state", "daily_totals", "hourly_counts",
+            "listening_sessions", "heavy_hitters"} <= tables
+
+
+def test_migrating_again_changes_nothing(database_location):
+    engine = get_engine()
+    with engine.connect() as conn:
+        database_id = database.get_state(conn, "database_id")
+    migrate_database(engine)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA user_version").scalar() == len(MIGRATIONS)
+        assert database.get_state(conn, "database_id") == database_id
+
+
+def test_old_database_keeps_every_play_through_the_migrations(database_location):
+    # bring a database up to version 3 by itself, before the default engine migrates it the rest of the way
+    engine = sqlalchemy.create_engine(database_location)
+    with engine.begin() as conn:
+        for migration in MIGRATIONS[:3]:
+            migration(conn)
+        conn.exec_driver_sql("PRAGMA user_version = 3")
+        conn.exec_driver_sql(VERSION_3_PLAYS)
+    engine.dispose()
+    with get_engine().connect() as conn:
+        plays = conn.exec_driver_sql("SELECT played_at, track_name, artist_id FROM complete_listening_history ORDER BY played_at").all()
+        num_counted = conn.exec_driver_sql("SELECT SUM(num_plays) FROM tracks_counts").scalar()
+        num_in_sessions = conn.exec_driver_sql("SELECT SUM(num_plays) FROM listening_sessions").scalar()
+    assert [tuple(play) for play in plays] == [(1704103200000, "Demo", database.NAME_ID_PREFIX + "Me"), (1704106800000, "Track 1", "artist0")]
+    assert num_counted == num_in_sessions == 2
+
+
+def test_plays_without_spotify_ids_are_loaded(database_location):
+    row = {"played_at": 1704103200000, "track_name": "Demo", "artist_name": "Me", "album_name": "Tapes", "track_id": None, "artist_id": None,
+           "album_id": None, "release_date": None, "date_played": "2024-01-01", "time_played": "10:00:00:000", "duration_in_ms": 120000}
+    assert load_track_batches([[row], [dict(row, played_at=1704106800000)]], database_location) == 2
+    with get_engine().connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM complete_listening_history WHERE track_name = 'Demo'").scalar() == 2
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM tracks").scalar() == 1
@@ -0,0 +1,37 @@
+from SpotifyHistory import enrich
+from SpotifyHistory.database import NAME_ID_PREFIX, get_engine
+from SpotifyHistory.etl_data import load_track_batches
+
+# a play of a local file, which has no Spotify ids
+LOCAL_FILE_ROW = {"played_at": 1704103200000, "track_name": "Demo", "artist_name": "Me", "album_name": "Tapes", "track_id": None, "artist_id": None,
+                  "album_id": None, "release_date": None, "date_played": "2024-01-01", "time_played": "10:00:00:000", "duration_in_ms": 120000}
+
+
+def fake_get_several(requested):
+    '''(dict) -> function
+    This function returns a stand-in for get_several that records the ids requested of each kind in the given dictionary and returns an object for each,
+    crediting a featured artist on every track.
+    '''
+    def get_several(access_token, kind, ids):
+        requested.setdefault(kind, []).extend(ids)
+        if kind == "tracks":
+            return([{"id": track_id, "popularity": 50, "explicit": False, "artists": [{"id": "artist0", "name": "Artist 0"}, {"id": "featured", "name": "Featured"}]}
+                    for track_id in ids])
+        return([{"id": object_id, "popularity": 10} for object_id in ids])
+    return(get_several)
+
+
+def test_enrich_fetches_every_unseen_id_once_and_never_made_up_ones(load_plays, database_location, monkeypatch):
+    load_plays([("2024-01-01 11:00:00", 0), ("2024-01-01 12:00:00", 1)])
+    load_track_batches([[LOCAL_FILE_ROW]], database_location)
+    requested = {}
+    monkeypatch.setattr(enrich, "get_several", fake_get_several(requested))
+    assert enrich.enrich_metadata("token", database_location) == {"tracks": 2, "artists": 2, "albums": 1}
+    assert {kind: sorted(ids) for kind, ids in requested.items()} == {"tracks": ["track0", "track1"], "artists": ["artist0", "featured"], "albums": ["album0"]}
+    assert not any(object_id.startswith(NAME_ID_PREFIX) for ids in requested.values() for object_id in ids)
+    # everything has been fetched, so nothing is requested again
+    requested.clear()
+    assert enrich.enrich_metadata("token", database_location) == {"tracks": 0, "artists": 0, "albums": 0}
+    assert requested == {}
+    with get_engine(database_location).connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM track_artists WHERE track_id = 'track1'").scalar() == 2
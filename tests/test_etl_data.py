@@ -0,0 +1,62 @@
+from SpotifyHistory.database import get_engine
+from SpotifyHistory.etl_data import TRACK_COLUMNS, convert_times_played, convert_to_local_time, convert_to_unix_timestamp, convert_durations, convert_duration, \
+    load_track_batches, extract_todays_tracks, transform_todays_tracks, load_todays_tracks, get_last_played_at
+from benchmarks.fake_spotify import get_plays
+import time
+import pandas as pd
+import pytest
+
+# times played around the daylight saving changes of New York and the new year, to the millisecond and to the second
+TIMES_PLAYED = ["2024-03-10T06:59:59.999Z", "2024-03-10T07:00:00.000Z", "2024-11-03T05:30:00.123Z", "2024-11-03T06:30:00Z",
+                "2023-12-31T23:59:59.500Z", "2024-07-01T12:00:00Z"]
+
+
+@pytest.fixture(params=["UTC", "America/New_York", ":America/New_York", "EST+5", "EST5EDT", "Asia/Kolkata"])
+def local_timezone(request, monkeypatch):
+    '''Each of the given values of TZ, set for the process for the test.'''
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_times_are_converted_at_once_the_same_way_as_one_at_a_time(local_timezone):
+    played_at, date_time_played, date_played, time_played = convert_times_played(TIMES_PLAYED)
+    for i, time_played_utc in enumerate(TIMES_PLAYED):
+        assert played_at[i] == convert_to_unix_timestamp(time_played_utc)
+        assert (date_time_played[i], date_played[i], time_played[i]) == convert_to_local_time(time_played_utc)
+
+
+def test_durations_are_converted_at_once_the_same_way_as_one_at_a_time():
+    durations_ms = [0, 9999, 60000, 185000, 185000, 3599999, 3600000, 3723000]
+    assert list(convert_durations(durations_ms)) == [convert_duration(duration_ms) for duration_ms in durations_ms]
+
+
+def test_loaded_local_dates_and_hours_match_sqlite(local_timezone, database_location):
+    played_at, date_time_played, date_played, time_played = convert_times_played(TIMES_PLAYED)
+    rows = [{"played_at": played_at[i], "track_name": "Track 1", "artist_name": "Artist 0", "album_name": "Album 0", "track_id": "track1",
+             "artist_id": "artist0", "album_id": "album0", "release_date": None, "date_time_played": date_time_played[i], "date_played": date_played[i],
+             "time_played": time_played[i], "duration_in_ms": 1000, "duration": "0:01"} for i in range(len(TIMES_PLAYED))]
+    load_track_batches([pd.DataFrame(rows, columns=TRACK_COLUMNS)], database_location)
+    with get_engine(database_location).connect() as conn:
+        stored = conn.exec_driver_sql("""
+            SELECT date_played = date(played_at / 1000, 'unixepoch', 'localtime'),
+                hour_played = CAST(strftime('%H', played_at / 1000, 'unixepoch', 'localtime') AS INT)
+            FROM plays
+            """).all()
+    assert len(stored) == len(TIMES_PLAYED) and all(all(row) for row in stored)
+
+
+def test_extraction_follows_every_page_back_to_the_last_play_loaded(fake_spotify, database_location):
+    plays = get_plays("alice", fake_spotify.now_ms)
+    raw_data = extract_todays_tracks("access-alice", plays[-120]["played_at_ms"], database_location)
+    # the 119 plays after the one given span three pages, and are returned most recent first
+    assert [item["played_at"] for item in raw_data["items"]] == [play["played_at"] for play in reversed(plays[-119:])]
+    assert fake_spotify.num_requests == 3
+    track_df, valid = transform_todays_tracks(raw_data)
+    assert valid and load_todays_tracks(track_df, database_location) == 119
+    assert get_last_played_at(database_location) == plays[-1]["played_at_ms"]
+    # the next extraction starts from the high-water mark, so it takes a single request and finds nothing new
+    assert extract_todays_tracks("access-alice", database_location=database_location) == {"items": []}
+    assert fake_spotify.num_requests == 4
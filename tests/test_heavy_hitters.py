@@ -0,0 +1,65 @@
+from SpotifyHistory.database import ROLLUP_DIMENSIONS, get_engine
+from SpotifyHistory.heavy_hitters import PERIODS, build_heavy_hitters, get_period_starts
+from SpotifyHistory.view_listening_history import get_leaderboard
+import collections
+import random
+
+# the number of counters kept for each window, small enough that most tracks do not get one
+TEST_CAPACITY = 4
+
+
+def get_random_plays(seed, num_plays, start_day):
+    '''(int, int, int) -> list of tuple
+    This function returns the given number of plays, eight a day from the given day of January 2024 on, of tracks drawn so that a few are played
+    far more than the rest.
+    '''
+    rng = random.Random(seed)
+    return([("2024-01-{:02d} {:02d}:{:02d}:00".format(start_day + i // 8, 8 + i % 8, rng.randrange(60)), min(int(rng.paretovariate(1.2)) - 1, 40))
+            for i in range(num_plays)])
+
+
+def get_exact_counts(database_location):
+    '''(str) -> dict
+    This function returns the number of plays of every track, artist and album in each window of each period, counted from every play in the database.
+    '''
+    with get_engine(database_location).connect() as conn:
+        rows = conn.exec_driver_sql("SELECT track_key, artist_key, album_key, date_played FROM plays").all()
+    counts = collections.defaultdict(collections.Counter)
+    for period in PERIODS:
+        for row, period_start in zip(rows, get_period_starts(period, [row[3] for row in rows])):
+            for i, (table, key) in enumerate(ROLLUP_DIMENSIONS):
+                counts[(table, period, str(period_start))][row[i]] += 1
+    return(counts)
+
+
+def test_counters_bound_the_true_counts_as_plays_are_loaded(load_plays, database_location):
+    load_plays(get_random_plays(1, 80, 1))
+    assert build_heavy_hitters(database_location, capacity=TEST_CAPACITY) == 80
+    # the counters are kept up to date as more plays are loaded, including plays already stored
+    load_plays(get_random_plays(2, 80, 11))
+    load_plays(get_random_plays(2, 80, 11) + get_random_plays(3, 40, 21))
+    exact_counts = get_exact_counts(database_location)
+    with get_engine(database_location).connect() as conn:
+        counters = conn.exec_driver_sql("SELECT dimension, period, period_start, item_key, num_plays, max_overcount FROM heavy_hitters").all()
+        totals = {tuple(row[:3]): (row[3], row[4]) for row in conn.exec_driver_sql("SELECT * FROM heavy_hitters_totals")}
+    assert set(totals) == set(exact_counts)
+    kept = collections.defaultdict(dict)
+    for dimension, period, period_start, item_key, num_plays, max_overcount in counters:
+        kept[(dimension, period, period_start)][item_key] = (num_plays, max_overcount)
+    for window, counts in exact_counts.items():
+        num_plays, max_overcount = totals[window]
+        assert num_plays == sum(counts.values()) and max_overcount <= num_plays / (TEST_CAPACITY + 1)
+        assert len(kept[window]) <= TEST_CAPACITY
+        for item_key, (item_num_plays, item_max_overcount) in kept[window].items():
+            assert item_num_plays - item_max_overcount <= counts[item_key] <= item_num_plays
+        # anything played more often than the most a count can be over by is sure to have a counter
+        assert all(item_key in kept[window] for item_key, count in counts.items() if count > max_overcount)
+
+
+def test_the_top_of_a_month_matches_the_exact_leaderboard(load_plays, database_location):
+    load_plays(get_random_plays(4, 200, 1))
+    build_heavy_hitters(database_location, capacity=TEST_CAPACITY)
+    approximate_df = get_leaderboard("track_name", 1, "month", "2024-01-15")
+    exact_df = get_leaderboard("track_name", 1, "month", "2024-01-15", exact=True)
+    assert approximate_df["track_name"].tolist() == exact_df["track_name"].tolist()
+    assert approximate_df["min_num_of_listens"][1] <= exact_df["num_of_listens"][1] <= approximate_df["num_of_listens"][1]
@@ -0,0 +1,63 @@
+from SpotifyHistory.database import NAME_ID_PREFIX, get_engine
+from SpotifyHistory.etl_data import convert_to_local_time, convert_to_unix_timestamp, convert_duration
+from SpotifyHistory.import_history import read_json_array_chunk, transform_streaming_history, import_streaming_history
+import json
+
+# records of the streaming history export: tracks with names outside ascii, played across a new year and for over an hour, and a podcast episode,
+# which is not a track
+EXPORT_RECORDS = [
+    {"ts": "2023-12-31T23:59:59Z", "ms_played": 59000, "master_metadata_track_name": "Café Olé", "master_metadata_album_artist_name": "Björk",
+     "master_metadata_album_album_name": "Début", "spotify_track_uri": "spotify:track:track1"},
+    {"ts": "2024-01-01T00:03:07Z", "ms_played": 3723000, "master_metadata_track_name": "日本語", "master_metadata_album_artist_name": "Artist 0",
+     "master_metadata_album_album_name": "Album 0", "spotify_track_uri": "spotify:track:track2"},
+    {"ts": "2024-07-01T12:00:00Z", "ms_played": 600000, "master_metadata_track_name": None, "master_metadata_album_artist_name": None,
+     "master_metadata_album_album_name": None, "spotify_track_uri": None, "episode_name": "An episode"},
+    {"ts": "2024-07-01T12:10:00Z", "ms_played": 5000, "master_metadata_track_name": "Track 3", "master_metadata_album_artist_name": "Artist 1",
+     "master_metadata_album_album_name": "Album 1", "spotify_track_uri": "spotify:track:track3"}
+]
+
+
+def write_export(tmp_path, records):
+    '''(pathlib.Path, list of dict) -> str
+    This function writes the records as a file of the export and returns its path.
+    '''
+    path = tmp_path / "Streaming_History_Audio_2024.json"
+    path.write_text(json.dumps(records, ensure_ascii=False, indent=1), encoding="utf-8")
+    return(str(path))
+
+
+def test_transform_matches_the_conversion_of_each_play():
+    track_df = transform_streaming_history(EXPORT_RECORDS)
+    tracks = [record for record in EXPORT_RECORDS if record["spotify_track_uri"]]
+    assert len(track_df) == len(tracks)
+    for row, record in zip(track_df.to_dict("records"), tracks):
+        assert row["played_at"] == convert_to_unix_timestamp(record["ts"])
+        assert (row["date_time_played"], row["date_played"], row["time_played"]) == convert_to_local_time(record["ts"])
+        assert row["duration"] == convert_duration(record["ms_played"])
+        assert row["track_id"] == record["spotify_track_uri"].split(":")[-1]
+        assert row["artist_id"] == NAME_ID_PREFIX + record["master_metadata_album_artist_name"]
+
+
+def test_chunks_read_by_offset_match_the_whole_file(tmp_path):
+    records = EXPORT_RECORDS * 25
+    path = write_export(tmp_path, records)
+    read, offset = [], None
+    # read blocks smaller than a record, so that records and multibyte characters are split across blocks
+    while True:
+        chunk, offset = read_json_array_chunk(path, offset, num_records=7, read_size=97)
+        read.extend(chunk)
+        if offset is None:
+            break
+    assert read == records
+
+
+def test_import_skips_plays_already_loaded_and_reuses_their_ids(tmp_path, load_plays, database_location):
+    load_plays([("2024-01-01 00:03:07.412", 2, 3723000)])
+    path = write_export(tmp_path, EXPORT_RECORDS)
+    import_streaming_history([path], processes=1, chunk_size=2)
+    with get_engine().connect() as conn:
+        plays = conn.exec_driver_sql("SELECT track_id, artist_id, album_id FROM complete_listening_history ORDER BY played_at").all()
+        num_artists = conn.exec_driver_sql("SELECT COUNT(*) FROM artists WHERE artist_name = 'Artist 0'").scalar()
+    assert [tuple(play) for play in plays] == [("track1", NAME_ID_PREFIX + "Björk", NAME_ID_PREFIX + "Björk/Début"), ("track2", "artist0", "album0"),
+                                               ("track3", NAME_ID_PREFIX + "Artist 1", NAME_ID_PREFIX + "Artist 1/Album 1")]
+    assert num_artists == 1
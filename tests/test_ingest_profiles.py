@@ -0,0 +1,39 @@
+from SpotifyHistory import etl_data, spotify_api
+from SpotifyHistory.database import get_engine
+from SpotifyHistory.ingest_profiles import ingest_profiles
+from benchmarks.fake_spotify import get_plays
+
+
+def get_times_played(database_location):
+    '''(str) -> list of int
+    This function returns the times played of every play in the given database, oldest first.
+    '''
+    with get_engine(database_location).connect() as conn:
+        return([row[0] for row in conn.exec_driver_sql("SELECT played_at FROM plays ORDER BY played_at")])
+
+
+def test_accounts_are_ingested_into_their_own_databases_through_rate_limits(fake_spotify, database_location, tmp_path, monkeypatch):
+    fake_spotify.rate_limit_every = 3
+    # extract the last 100 plays of each account, rather than those since midnight, whose number depends on the time the test is run
+    after = fake_spotify.now_ms - 100 * 4 * 60000
+    monkeypatch.setattr(etl_data, "get_today_unix_timestamp", lambda: after)
+    profiles = [{"name": name, "client_id": "id", "client_secret": "secret", "refresh_token": "refresh-" + name,
+                 "database": "sqlite:///" + str(tmp_path / (name + ".sqlite"))} for name in ("alice", "bob", "carol")]
+    profiles.append({"name": "dave", "client_id": "id", "client_secret": "secret", "refresh_token": "revoked", "database": database_location})
+    results = ingest_profiles(profiles, max_workers=4)
+    assert fake_spotify.num_rate_limited > 0
+    assert [result["name"] for result in results] == ["alice", "bob", "carol", "dave"]
+    for profile, result in zip(profiles[:3], results):
+        expected = [play["played_at_ms"] for play in get_plays(profile["name"], fake_spotify.now_ms) if play["played_at_ms"] > after]
+        assert result == {"name": profile["name"], "plays_added": len(expected), "error": None}
+        assert get_times_played(profile["database"]) == expected
+    # an account whose refresh token is refused is reported without stopping the others
+    assert results[3]["plays_added"] is None and results[3]["error"].startswith("Could not refresh the access token")
+
+
+def test_requests_give_up_after_the_last_retry(fake_spotify, monkeypatch):
+    fake_spotify.rate_limit_every = 1
+    monkeypatch.setattr(spotify_api, "MAX_RETRIES", 2)
+    response = spotify_api.send_request("GET", spotify_api.API_URL + "/tracks", params={"ids": "track1"})
+    assert response.status_code == 429
+    assert fake_spotify.num_requests == 3
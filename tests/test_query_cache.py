@@ -0,0 +1,21 @@
+from SpotifyHistory import database
+from SpotifyHistory.view_listening_history import get_total_duration, get_most_listened
+import os
+
+
+def test_cached_result_is_recomputed_after_a_load(load_plays):
+    load_plays([("2024-03-01 10:00:00", 1, 60000)])
+    assert get_total_duration("2024-03-01") == 60000
+    assert get_total_duration("2024-03-01") == 60000
+    load_plays([("2024-03-01 11:00:00", 2, 90000)])
+    assert get_total_duration("2024-03-01") == 150000
+
+
+def test_cached_result_is_not_reused_for_a_database_created_again(load_plays, tmp_path):
+    load_plays([("2024-03-01 10:00:00", 1)])
+    assert list(get_most_listened("track_name", 5)["track_name"]) == ["Track 1"]
+    # create the database again at the same location, where it reaches the same generation after the same number of loads
+    database.dispose_engines()
+    os.remove(str(tmp_path / "history.sqlite"))
+    load_plays([("2024-03-01 10:00:00", 2)])
+    assert list(get_most_listened("track_name", 5)["track_name"]) == ["Track 2"]
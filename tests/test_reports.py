@@ -0,0 +1,28 @@
+from SpotifyHistory.reports import CHARTS, get_report_tasks, render_reports
+from SpotifyHistory.view_listening_history import draw_num_songs_by_time, render_chart
+import datetime
+import sys
+
+# the first bytes of every png file
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def test_every_chart_of_every_profile_is_rendered_to_a_file(load_plays, database_location, tmp_path):
+    load_plays([("2024-03-04 12:00:00", 1), ("2024-03-05 18:30:00", 2), ("2024-03-05 18:34:00", 3), ("2024-02-20 08:00:00", 4)])
+    profiles = [{"name": "alice", "client_id": "id", "client_secret": "secret", "refresh_token": "refresh-alice", "database": database_location},
+                {"name": "bob", "client_id": "id", "client_secret": "secret", "refresh_token": "refresh-bob",
+                 "database": "sqlite:///" + str(tmp_path / "missing" / "bob.sqlite")}]
+    tasks = get_report_tasks(CHARTS, datetime.date(2024, 3, 6), "png", str(tmp_path / "reports"), profiles)
+    paths, errors = render_reports(tasks, processes=2)
+    # alice's charts are all rendered, while bob's database cannot be opened, which is reported for each of his charts without stopping the others
+    assert paths == sorted(str(tmp_path / "reports" / "alice" / (chart + "-2024-03-06.png")) for chart in CHARTS)
+    for path in paths:
+        with open(path, "rb") as f:
+            assert f.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
+    assert len(errors) == len(CHARTS) and all(error.startswith(str(tmp_path / "reports" / "bob")) for error in errors)
+
+
+def test_charts_are_rendered_to_bytes_without_pyplot():
+    svg = render_chart(draw_num_songs_by_time, ["12:00 AM", "6:00 AM", "12:00 PM", "6:00 PM"], [1, 0, 5, 2], image_format="svg")
+    assert svg.startswith(b"<?xml") and b"<svg" in svg
+    assert "matplotlib.pyplot" not in sys.modules
@@ -0,0 +1,31 @@
+from SpotifyHistory.database import get_engine
+from SpotifyHistory.sessions import rebuild_sessions
+
+# the listening sessions, in order
+SESSIONS_QUERY = """
+    SELECT first_played_at, last_played_at, started_at, start_date, num_plays, total_duration
+    FROM listening_sessions
+    ORDER BY first_played_at
+    """
+
+
+def get_sessions(database_location):
+    '''(str) -> list of tuple
+    This function returns every listening session of the given database.
+    '''
+    with get_engine(database_location).connect() as conn:
+        return([tuple(row) for row in conn.exec_driver_sql(SESSIONS_QUERY)])
+
+
+def test_sessions_kept_up_to_date_match_a_rebuild(load_plays, database_location):
+    # a session carried on by the next load, a new session, and older plays joining two sessions together and starting one before them all
+    loads = [[("2024-05-01 10:00:00", 1), ("2024-05-01 10:03:00", 2)],
+             [("2024-05-01 10:06:00", 3), ("2024-05-01 12:00:00", 4)],
+             [("2024-05-01 10:30:00", 5), ("2024-05-01 11:00:00", 6), ("2024-05-01 11:30:00", 7), ("2024-04-30 20:00:00", 9)],
+             [("2024-05-01 12:03:00", 8)]]
+    for plays in loads:
+        load_plays(plays)
+    sessions = get_sessions(database_location)
+    rebuild_sessions(database_location)
+    assert sessions == get_sessions(database_location)
+    assert [session[4] for session in sessions] == [1, 8]
@@ -0,0 +1,39 @@
+from SpotifyHistory.view_listening_history import get_days_history, iter_history, search_names
+import pandas as pd
+
+# plays at midday on three days, of tracks by artists 0, 1 and 2, and one on the day after
+PLAYS = [("2024-05-01 11:00:00", 0), ("2024-05-01 12:00:00", 6), ("2024-05-01 13:00:00", 1), ("2024-05-02 12:00:00", 7),
+         ("2024-05-03 11:00:00", 12), ("2024-05-03 12:00:00", 8), ("2024-05-04 12:00:00", 2)]
+
+
+def test_history_is_read_a_chunk_at_a_time_in_order(load_plays, database_location):
+    load_plays(PLAYS)
+    chunks = list(iter_history("2024-05-01", "2024-05-03", chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 2]
+    history_df = pd.concat(chunks)
+    expected_df = pd.concat([get_days_history(date) for date in ("2024-05-01", "2024-05-02", "2024-05-03")], ignore_index=True)
+    expected_df.index += 1
+    pd.testing.assert_frame_equal(history_df, expected_df)
+
+
+def test_history_is_filtered_by_part_of_an_artist_or_album_name(load_plays, database_location):
+    load_plays(PLAYS)
+    artist_df = pd.concat(iter_history("2024-05-01", "2024-05-04", artist="artist 1", chunk_size=2))
+    assert artist_df["track_name"].tolist() == ["Track 6", "Track 7", "Track 8"] and artist_df.index.tolist() == [1, 2, 3]
+    album_df = pd.concat(iter_history("2024-05-01", "2024-05-04", album="album 0"))
+    assert album_df["track_name"].tolist() == ["Track 0", "Track 1", "Track 2"]
+    # the wildcards of a pattern are matched literally
+    assert list(iter_history("2024-05-01", "2024-05-04", artist="%")) == []
+
+
+def test_names_are_found_by_any_part_and_kept_in_sync_with_the_plays(load_plays, database_location):
+    load_plays([("2024-05-01 11:00:00", 1), ("2024-05-01 12:00:00", 10, 200000), ("2024-05-02 12:00:00", 10, 200000), ("2024-05-02 13:00:00", 2)])
+    search_df = search_names("RACK 1")
+    assert search_df[["type", "name", "num_of_listens", "total_duration_in_ms"]].values.tolist() == [["track", "Track 10", 2, 400000], ["track", "Track 1", 1, 180000]]
+    assert search_df["first_played"][1] < search_df["last_played"][1]
+    # names too short for the trigram index are matched at their start, and misspelt names are still found by their shared trigrams
+    assert search_names("al", tables=("albums",))["name"].tolist() == ["Album 0", "Album 3"]
+    assert "Artist 1" in search_names("artsit 1", tables=("artists",), fuzzy=True)["name"].tolist()
+    assert search_names("track 4").empty
+    load_plays([("2024-05-03 12:00:00", 4)])
+    assert search_names("track 4")["name"].tolist() == ["Track 4"]